@@ -1,21 +1,85 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-import google.generativeai as genai
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional, Dict, Any, AsyncIterator, Awaitable, Callable, Coroutine, Iterator, Literal, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
 import PyPDF2
+from contextlib import asynccontextmanager
+import asyncio
 import json
 import os
-import re
-import pdfplumber
-import fitz  # PyMuPDF
+import time
 from datetime import datetime
-import tempfile
 import uuid
+import zipfile
+
+from document import (
+    DocumentHandle,
+    handle_for_path,
+    parse_page_ranges,
+    select_pages,
+    spool_upload,
+)
+from export import (
+    RESULT_MEDIA_TYPES,
+    arrow_available,
+    encode_rows,
+    invoice_rows,
+    item_fields,
+    rows_table,
+    select_columns,
+)
+from dedupe import PageDeduper, copy_items
+from extraction_cache import ExtractionCache, cache_key
+from jobs import BatchJob, BatchScheduler
+from json_stream import JsonObjectStream, parse_json_objects, parsed_response
+from metrics import (
+    ITEMS_TOTAL,
+    METRICS_ENABLED,
+    PAGES_IN_FLIGHT,
+    PAGES_TOTAL,
+    REEXTRACTED_PAGES_TOTAL,
+    REQUESTS_IN_FLIGHT,
+    TIMING_HEADERS,
+    Gauge,
+    observe_request,
+    observe_stage,
+    render as render_metrics,
+    server_timing,
+    set_document,
+    stage,
+    start_request_timings,
+)
+from model_backend import PartialResponseError, create_backend
+from model_scheduler import ModelCallScheduler, estimate_tokens
+from packing import PACKED_PAGES_PROMPT, PackedPage, PagePacker, UnsplittablePackError, split_packed_response
+from rasterize import RASTER_PROFILES, RasterProfile, get_profile
+from reconcile import reconcile_items, retry_is_better, unreconciled_pages
+from text_layer import parse_number
+from pdf_pipeline import (
+    count_pages,
+    HsnIndex,
+    extract_hsn_gst,
+    prepare_page,
+    release_document,
+    run_in_process,
+    shutdown_process_pool,
+)
 
 
-app = FastAPI(title="Invoice Extractor MCP API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    batch_scheduler.start()
+    yield
+    await batch_scheduler.stop()
+    shutdown_process_pool()
+    model_call_executor.shutdown(wait=False)
+    model_backend.close()
+
+
+app = FastAPI(title="Invoice Extractor MCP API", version="1.0.0", lifespan=lifespan)
 
 
 # CORS middleware
@@ -25,13 +89,149 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Total-Items", "X-Pages-Processed", "X-Failed-Pages",
+                    "X-Model-Calls-Saved"],
 )
 
 
-# Configure Gemini API
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+# Model backend: MODEL_BACKEND ("gemini" or the offline "stub") and MODEL_NAME;
+# created once so its clients are reused across requests
+model_backend = create_backend()
+
+
+# Concurrency limits for per-page Gemini calls
+# MAX_CONCURRENT_PAGES bounds the pages of one request that are in flight,
+# MAX_CONCURRENT_MODEL_CALLS bounds the calls in flight across all requests;
+# the shared limit halves on 429s and grows back, down to MIN_CONCURRENT_MODEL_CALLS.
+MAX_CONCURRENT_PAGES = int(os.getenv("MAX_CONCURRENT_PAGES", "4"))
+MAX_CONCURRENT_MODEL_CALLS = int(os.getenv("MAX_CONCURRENT_MODEL_CALLS", "16"))
+MIN_CONCURRENT_MODEL_CALLS = int(os.getenv("MIN_CONCURRENT_MODEL_CALLS", "1"))
+
+# Quota (0 = unlimited), retries and circuit breaking for model calls
+MODEL_REQUESTS_PER_MINUTE = float(os.getenv("MODEL_REQUESTS_PER_MINUTE", "0"))
+MODEL_TOKENS_PER_MINUTE = float(os.getenv("MODEL_TOKENS_PER_MINUTE", "0"))
+MODEL_MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", "3"))
+MODEL_RETRY_BASE_SECONDS = float(os.getenv("MODEL_RETRY_BASE_SECONDS", "0.5"))
+MODEL_RETRY_MAX_SECONDS = float(os.getenv("MODEL_RETRY_MAX_SECONDS", "20"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+model_call_executor = ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_MODEL_CALLS, thread_name_prefix="model-call"
+)
+model_scheduler = ModelCallScheduler(
+    lambda error: model_backend.classify_error(error), model_call_executor,
+    max_concurrency=MAX_CONCURRENT_MODEL_CALLS, min_concurrency=MIN_CONCURRENT_MODEL_CALLS,
+    requests_per_minute=MODEL_REQUESTS_PER_MINUTE, tokens_per_minute=MODEL_TOKENS_PER_MINUTE,
+    max_retries=MODEL_MAX_RETRIES, retry_base_seconds=MODEL_RETRY_BASE_SECONDS,
+    retry_max_seconds=MODEL_RETRY_MAX_SECONDS,
+    failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS
+)
+
+
+# Extraction cache: in-memory LRU bounded by EXTRACTION_CACHE_MAX_BYTES,
+# plus an on-disk tier when EXTRACTION_CACHE_DIR is set
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR") or None
+
+extraction_cache = ExtractionCache(EXTRACTION_CACHE_MAX_BYTES, EXTRACTION_CACHE_DIR)
+
+
+# Cache and model scheduler statistics, read when /metrics is scraped
+Gauge("invoice_extraction_cache", "Extraction cache counters and size", ("stat",),
+      callback=lambda: {(name,): value for name, value in extraction_cache.stats().items()})
+Gauge("invoice_model_scheduler", "Model call scheduler counters, concurrency limit and calls in flight", ("stat",),
+      callback=lambda: {(name,): value for name, value in model_scheduler.stats().items()
+                        if not isinstance(value, str)})
+Gauge("invoice_model_circuit_open", "1 while the model circuit breaker is open or half open",
+      callback=lambda: {(): int(model_scheduler.breaker.state != "closed")})
+
+
+# Text-layer fast path: pages whose line-item table reads cleanly from the PDF
+# text layer skip the vision model when the extractor's confidence is high enough
+TEXT_LAYER_MIN_CONFIDENCE = float(os.getenv("TEXT_LAYER_MIN_CONFIDENCE", "0.8"))
+
+
+# Line items are validated as InvoiceItem models ("full"), or, for trusted internal
+# deployments, kept as the typed dicts record_fields() produces ("light"), which
+# skips model construction for large results
+ITEM_VALIDATION = os.getenv("ITEM_VALIDATION", "full")
+
+
+# Near-duplicate pages: with DUPLICATE_PAGE_DETECTION on, a page whose raster hash is
+# at least DUPLICATE_PAGE_SIMILARITY alike an earlier page of the same request copies
+# that page's items instead of going to Gemini (see dedupe.py for the trade-off)
+DUPLICATE_PAGE_DETECTION = os.getenv("DUPLICATE_PAGE_DETECTION", "false").lower() in ("1", "true", "yes")
+DUPLICATE_PAGE_SIMILARITY = float(os.getenv("DUPLICATE_PAGE_SIMILARITY", "0.995"))
+
+
+# Reconciliation: once every page is extracted, pages read by the model whose line items
+# do not reconcile (qty x rate - discount, plus GST, against the amount) are extracted
+# once more, rendered with RECONCILE_RASTER_PROFILE (empty: the request's own profile),
+# and the result with fewer unreconciled items is kept
+RECONCILE_REEXTRACT = os.getenv("RECONCILE_REEXTRACT", "true").lower() in ("1", "true", "yes")
+RECONCILE_RASTER_PROFILE = os.getenv("RECONCILE_RASTER_PROFILE", "small_font")
+
+
+# Multi-page packing: pages of one request sent to Gemini in a single call
+# (1 disables packing), capped by the total image bytes per call; a partial
+# pack is sent once no further page has arrived for MODEL_PACK_LINGER_SECONDS;
+# it has to cover the time to render the next page, or packs go out part-full
+MODEL_PACK_PAGES = int(os.getenv("MODEL_PACK_PAGES", "1"))
+MODEL_PACK_MAX_BYTES = int(os.getenv("MODEL_PACK_MAX_BYTES", str(4 * 1024 * 1024)))
+MODEL_PACK_LINGER_SECONDS = float(os.getenv("MODEL_PACK_LINGER_SECONDS", "0.5"))
+
+
+# Uploads are spooled here (the system temp directory by default) rather than held in memory
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+
+# Batch jobs: files processed at once across all jobs, and how long finished jobs are kept
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+BATCH_JOB_RETENTION_SECONDS = int(os.getenv("BATCH_JOB_RETENTION_SECONDS", "3600"))
+
+
+INPUT_PROMPT = """
+        You are an expert in understanding invoices. Analyze the invoice image and extract ALL line items/transactions from the invoice.
+        Extract GST rate from PDF using HSN code and fill Section 2_Transaction gst column automatically.
+        For EACH line item in the invoice, create a separate JSON object with this structure:
+
+
+        {
+            "title": "[PDF filename or invoice title]",
+            "doc_id": "[generate a unique ID or extract from invoice]",
+            "type": "[invoice type like 'Tax Invoice']",
+            "uploaded_from": "web",
+            "user_doc_id": "[extract if available]",
+            "doc_meta_data": "[extract if available]",
+            "folder_name": "[extract if available]",
+            "folder_id": "[extract if available]",
+            "status": "reviewing",
+            "created_at_iso": "[current date in ISO format]",
+            "modified_at_iso": "[current date in ISO format]",
+            "Section 2_Transaction sort": "[line item number/sequence]",
+            "Section 2_Transaction number": "[product/part number]",
+            "Section 2_Transaction rate": "[unit price as number]",
+            "Section 2_Transaction qty": "[quantity as number]",
+            "Section 2_Transaction gst": "[GST percentage as number]",
+            "Section 2_Transaction discount": "[discount if any]",
+            "Section 2_Transaction hsn": "[HSN code]",
+            "Section 2_Transaction MRP": "[total amount for this line item]"
+        }
+
+
+        IMPORTANT: 
+        - Return a JSON ARRAY containing ALL line items from the invoice
+        - Each line item should be a separate object in the array
+        - Extract ALL products/services listed in the invoice
+        - Use consistent metadata for all line items from the same invoice
+        - Generate sequential numbers for 'Section 2_Transaction sort' (1, 2, 3, etc.)
+
+
+        Return ONLY the JSON array without any additional text.
+        """
+
+EXTRACTION_PROMPT = "Extract invoice information as JSON"
 
 
 # Pydantic models
@@ -58,12 +258,29 @@ class InvoiceItem(BaseModel):
     page_number: int
 
 
+class PageSummary(BaseModel):
+    page_number: int
+    path: str  # "text_layer", "cache", "model", "duplicate", "partial", "skipped" or "failed"
+    items: int
+    text_layer_confidence: Optional[float] = None
+    pack_size: Optional[int] = None  # pages sent to Gemini in the same request
+    duplicate_of: Optional[int] = None  # page whose items a duplicate page copied
+    reextracted: bool = False  # extracted again because line items did not reconcile
+    unreconciled_items: Optional[int] = None  # items still not reconciling, for re-extracted pages
+    dropped_items: int = 0  # line items that could not be decoded or validated
+    error: Optional[str] = None
+
+
 class InvoiceResponse(BaseModel):
     success: bool
     message: str
     data: List[InvoiceItem]
     total_items: int
     pages_processed: int
+    pages: List[PageSummary] = []
+    failed_pages: List[int] = []
+    model_calls_saved: int = 0  # duplicate pages that copied another page's items
+    reextracted_pages: List[int] = []
 
 
 class HealthResponse(BaseModel):
@@ -72,66 +289,721 @@ class HealthResponse(BaseModel):
     timestamp: str
 
 
+class BatchJobResponse(BaseModel):
+    job_id: str
+    status: str
+    total_files: int
+
+
+class BatchJobStatus(BaseModel):
+    job_id: str
+    status: str
+    total_files: int
+    completed_files: int
+    failed_files: int
+    pending_files: int
+    pages_processed: int
+    total_items: int
+    created_at: str
+    finished_at: Optional[str] = None
+
+
+class BatchFileResult(BaseModel):
+    filename: str
+    success: bool
+    error: Optional[str] = None
+    data: List[InvoiceItem]
+    pages_processed: int
+    failed_pages: List[int] = []
+    model_calls_saved: int = 0
+    reextracted_pages: List[int] = []
+
+
+class BatchJobResults(BatchJobStatus):
+    files: List[BatchFileResult]
+
+
+class CacheStatsResponse(BaseModel):
+    memory_hits: int
+    disk_hits: int
+    misses: int
+    evictions: int
+    entries: int
+    bytes: int
+    max_bytes: int
+
+
 # Utility functions
-def get_gemini_response(input_prompt: str, image_data: bytes, prompt: str) -> str:
-    """Get response from Gemini model"""
+def get_model_response(input_prompt: str, image_data: bytes, prompt: str,
+                       mime_type: str = "image/png") -> str:
+    """Get response from the model backend"""
+    image_parts = [{
+        "mime_type": mime_type,
+        "data": image_data
+    }]
+    return stream_model_response([input_prompt, image_parts[0], prompt])
+
+
+def get_model_packed_response(input_prompt: str, pages: List[PackedPage], prompt: str) -> str:
+    """Get one model response covering several labelled page images"""
+    parts: List[Any] = [input_prompt, PACKED_PAGES_PROMPT]
+    for page in pages:
+        parts.append(f"Page {page.page_number}:")
+        parts.append({"mime_type": page.mime_type, "data": page.image_data})
+    parts.append(prompt)
+    return stream_model_response(parts)
+
+
+def stream_model_response(parts: List[Any]) -> str:
+    """Stream a model response, decoding line items as they arrive
+
+    The text is returned with the decoded items attached, so they are not
+    parsed again; they are validated once the response is complete. If the
+    stream breaks off after some items are complete, the error carries the
+    text received so far so those items can be kept.
+    """
+    chunks = []
+    items = JsonObjectStream()
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        image_parts = [{
-            "mime_type": "image/png",
-            "data": image_data
-        }]
-        response = model.generate_content([input_prompt, image_parts[0], prompt])
-        return response.text
+        for chunk in model_backend.generate_stream(parts):
+            chunks.append(chunk)
+            items.feed(chunk)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Gemini API error: {str(e)}")
+        if items.objects:
+            raise PartialResponseError(str(e), parsed_response("".join(chunks), items)) from e
+        raise
+    return parsed_response("".join(chunks), items)
 
 
-def extract_hsn_and_rate(pdf_bytes: bytes) -> List[Dict[str, Any]]:
-    """Extract HSN codes and GST rates from PDF"""
-    results = []
-    hsn_pattern = r"\b\d{4,8}\b"
-    gst_pattern = r"(\d{1,2})\s*%"
-    
+async def extract_hsn_gst_data(document_handle: DocumentHandle, page_nums: List[int]) -> HsnIndex:
+    """Run HSN/GST extraction in the worker pool"""
     try:
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-            tmp_file.write(pdf_bytes)
-            tmp_file_path = tmp_file.name
-        
-        with pdfplumber.open(tmp_file_path) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text()
-                if not text:
-                    continue
-                
-                lines = text.split("\n")
-                for idx, line in enumerate(lines):
-                    hsn_match = re.search(hsn_pattern, line)
-                    if hsn_match:
-                        hsn_code = hsn_match.group(0)
-                        gst_rate = None
-                        
-                        gst_match = re.search(gst_pattern, line)
-                        if gst_match:
-                            gst_rate = int(gst_match.group(1))
-                        else:
-                            for next_line in lines[idx+1: idx+3]:
-                                gst_match_next = re.search(gst_pattern, next_line)
-                                if gst_match_next:
-                                    gst_rate = int(gst_match_next.group(1))
-                                    break
-                        
-                        results.append({
-                            "HSN": hsn_code,
-                            "GST_Rate(%)": gst_rate
-                        })
-        
-        os.unlink(tmp_file_path)
-        return results
+        with stage("hsn_extraction"):
+            return await run_in_process(extract_hsn_gst, document_handle, page_nums)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"HSN extraction error: {str(e)}")
 
 
+def basic_invoice_item(filename: str, page_number: int) -> InvoiceItem:
+    """Placeholder item for a page whose model output could not be parsed"""
+    return InvoiceItem(
+        title=filename,
+        doc_id=str(uuid.uuid4()),
+        type="Tax Invoice",
+        uploaded_from="web",
+        status="reviewing",
+        created_at_iso=datetime.now().isoformat(),
+        modified_at_iso=datetime.now().isoformat(),
+        section_2_transaction_sort=1,
+        page_number=page_number
+    )
+
+
+def parse_page_items(response: str, page_number: int, filename: str,
+                     hsn_index: HsnIndex, validate_items: bool = True) -> Tuple[List[InvoiceItem], int]:
+    """Parse Gemini output for one page into invoice items and the number of line items dropped"""
+    # Every complete JSON object is kept, even if others around it are malformed
+    with stage("json_parse"):
+        parsed = parse_json_objects(response)
+    if not has_line_items(parsed):
+        # If no line item could be parsed, create a basic item
+        item = basic_invoice_item(filename, page_number)
+        return [item if validate_items else item.__dict__], parsed.errors
+    items, dropped = build_invoice_items(parsed.objects, page_number, filename, hsn_index, validate_items)
+    return items, dropped + parsed.errors
+
+
+def has_line_items(parsed: JsonObjectStream) -> bool:
+    """Whether a model reply held line items, or a well-formed empty array for a page without any"""
+    return bool(parsed.objects) or (parsed.saw_array and not parsed.errors and not parsed.truncated)
+
+
+def build_invoice_items(records: List[Dict[str, Any]], page_number: int, filename: str,
+                        hsn_index: HsnIndex, validate_items: bool = True) -> Tuple[List[InvoiceItem], int]:
+    """Map model-style line-item records to invoice items (plain field dicts without validate_items)
+
+    Also returns the number of records dropped because they failed validation.
+    """
+    with stage("validation"):
+        return _build_invoice_items(records, page_number, filename, hsn_index, validate_items)
+
+
+def _build_invoice_items(records: List[Dict[str, Any]], page_number: int, filename: str,
+                         hsn_index: HsnIndex, validate_items: bool) -> Tuple[List[InvoiceItem], int]:
+    items = []
+    dropped = 0
+    timestamp = datetime.now().isoformat()
+    for row, item in enumerate(records):
+        try:
+            invoice_item = record_fields(item, page_number, filename, timestamp)
+        except (TypeError, ValueError):
+            # One unreadable line item does not discard the rest of the page
+            dropped += 1
+            continue
+
+        # Auto-fill HSN and GST from the matching text-layer row
+        if not invoice_item["section_2_transaction_hsn"] or not invoice_item["section_2_transaction_gst"]:
+            entry = hsn_index.lookup(page_number, row, invoice_item["section_2_transaction_hsn"])
+            if entry:
+                if not invoice_item["section_2_transaction_hsn"]:
+                    invoice_item["section_2_transaction_hsn"] = entry.hsn
+                if not invoice_item["section_2_transaction_gst"]:
+                    invoice_item["section_2_transaction_gst"] = entry.gst_rate
+
+        if not validate_items:
+            items.append(invoice_item)
+            continue
+        try:
+            items.append(InvoiceItem(**invoice_item))
+        except ValidationError:
+            dropped += 1
+    return items, dropped
+
+
+def optional_str(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def number_field(value: Any) -> Optional[float]:
+    """A numeric field read leniently ("Rs. 1,200.00" is 1200.0); None when missing, zero or unreadable"""
+    if not value:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return parse_number(str(value))
+
+
+def integer_field(value: Any) -> Optional[int]:
+    """A whole-number field; None for a value such as 2.5 that the field cannot hold"""
+    number = number_field(value)
+    return int(number) if number is not None and number.is_integer() else None
+
+
+def record_fields(item: Dict[str, Any], page_number: int, filename: str,
+                  timestamp: Optional[str] = None) -> Dict[str, Any]:
+    """Map one model-style record to InvoiceItem fields, converted to the field types"""
+    # The values already have InvoiceItem's types, so the light path can use them unvalidated;
+    # an unreadable number leaves only its own field empty
+    timestamp = timestamp or datetime.now().isoformat()
+    return {
+        "title": str(item.get("title") or filename),
+        "doc_id": str(item.get("doc_id") or uuid.uuid4()),
+        "type": str(item.get("type") or "Tax Invoice"),
+        "uploaded_from": "web",
+        "user_doc_id": optional_str(item.get("user_doc_id")),
+        "doc_meta_data": optional_str(item.get("doc_meta_data")),
+        "folder_name": optional_str(item.get("folder_name")),
+        "folder_id": optional_str(item.get("folder_id")),
+        "status": "reviewing",
+        "created_at_iso": timestamp,
+        "modified_at_iso": timestamp,
+        "section_2_transaction_sort": integer_field(item.get("Section 2_Transaction sort")) or 1,
+        "section_2_transaction_number": optional_str(item.get("Section 2_Transaction number")),
+        "section_2_transaction_rate": number_field(item.get("Section 2_Transaction rate")),
+        "section_2_transaction_qty": integer_field(item.get("Section 2_Transaction qty")),
+        "section_2_transaction_gst": number_field(item.get("Section 2_Transaction gst")),
+        "section_2_transaction_discount": number_field(item.get("Section 2_Transaction discount")),
+        "section_2_transaction_hsn": optional_str(item.get("Section 2_Transaction hsn")),
+        "section_2_transaction_mrp": number_field(item.get("Section 2_Transaction MRP")),
+        "page_number": page_number
+    }
+
+
+async def extract_page_items(document_handle: DocumentHandle, page_num: int, filename: str,
+                             document_hsn_index: Callable[[], Awaitable[HsnIndex]],
+                             page_semaphore: asyncio.Semaphore,
+                             use_text_layer: bool,
+                             profile: RasterProfile,
+                             packer: Optional[PagePacker] = None,
+                             validate_items: bool = True,
+                             deduper: Optional[PageDeduper] = None,
+                             read_cache: bool = True) -> Tuple[List[InvoiceItem], PageSummary]:
+    """Extract one page from its text layer, or rasterize it and send it to Gemini
+
+    HSN and GST are filled in from the page's own rows; document_hsn_index is
+    awaited only for an item whose HSN code appears on no row of this page.
+    """
+    prepared = await run_in_process(
+        prepare_page, document_handle, page_num, use_text_layer,
+        TEXT_LAYER_MIN_CONFIDENCE, model_backend.available, profile, deduper is not None
+    )
+    for stage_name, seconds in prepared["timings"].items():
+        observe_stage(stage_name, seconds)
+    confidence = prepared["confidence"]
+    img_data = prepared.pop("image")
+    pack_size = None
+    error = None
+    duplicate_of = None
+    leader_items = None
+
+    leader = None
+    if img_data is not None and deduper is not None:
+        leader = deduper.claim(page_num + 1, prepared["hash"])
+        if leader is not None:
+            # Reuse the earlier page's items, or extract this page after all if that page failed
+            leader_items = await leader[1]
+            if leader_items is not None:
+                duplicate_of = leader[0]
+                del img_data
+
+    if duplicate_of is not None:
+        path = "duplicate"
+    elif img_data is None:
+        path = "text_layer" if prepared["records"] else "skipped"
+    else:
+        key = cache_key(img_data, INPUT_PROMPT, EXTRACTION_PROMPT, model_backend.model_name)
+        response = await extraction_cache.get_async(key) if read_cache else None
+        path = "cache"
+        if response is None:
+            model_start = time.perf_counter()
+            try:
+                if packer is not None:
+                    # Sent along with other pages of this request; the reply is split per page
+                    response, pack_size = await packer.submit(PackedPage(page_num + 1, img_data, profile.mime_type))
+                else:
+                    async with page_semaphore:
+                        response = await model_scheduler.call(
+                            get_model_response, INPUT_PROMPT, img_data, EXTRACTION_PROMPT, profile.mime_type,
+                            tokens=estimate_tokens(INPUT_PROMPT, EXTRACTION_PROMPT, images=1)
+                        )
+            except PartialResponseError as e:
+                # The stream broke off on the last attempt: keep the line items that arrived
+                response = e.partial_pages[page_num + 1] if e.partial_pages else e.partial_text
+                error = f"Model API error: {str(e)}"
+                path = "partial"
+            except Exception as e:
+                # Retries are exhausted or the circuit is open: fail this page, not the document
+                error = f"Model API error: {str(e)}"
+                path = "failed"
+            else:
+                # The key is for a single-page request; a page's share of a pack reply is not cached.
+                # Neither is a reply without line items or an array: another call may do better
+                if pack_size in (None, 1) and has_line_items(parse_json_objects(response)):
+                    await extraction_cache.put_async(key, str(response))
+                path = "model"
+            observe_stage("model", time.perf_counter() - model_start)
+        # The raster is not needed while building items
+        del img_data
+
+    def page_items(hsn_index: HsnIndex) -> Tuple[List[InvoiceItem], int]:
+        if path == "text_layer":
+            return build_invoice_items(prepared["records"], page_num + 1, filename, hsn_index, validate_items)
+        if path == "duplicate":
+            return copy_items(leader_items, page_num + 1), 0
+        if path in ("skipped", "failed"):
+            return [], 0
+        return parse_page_items(response, page_num + 1, filename, hsn_index, validate_items)
+
+    page_hsn_index = HsnIndex(prepared["hsn_entries"])
+    items, dropped = page_items(page_hsn_index)
+    if path != "duplicate" and needs_document_hsn(items, page_hsn_index):
+        # A code listed on another page only: rebuild with the whole document's rows
+        items, dropped = page_items(await document_hsn_index())
+    if deduper is not None and leader is None:
+        # Only complete extractions are copied; duplicates of a failed or partial page extract themselves
+        deduper.publish(page_num + 1, items if path in ("model", "cache") else None)
+    PAGES_TOTAL.inc(path=path)
+    ITEMS_TOTAL.inc(len(items))
+    return items, PageSummary(
+        page_number=page_num + 1, path=path, items=len(items), text_layer_confidence=confidence,
+        pack_size=pack_size, duplicate_of=duplicate_of, dropped_items=dropped, error=error
+    )
+
+
+def needs_document_hsn(items: List[InvoiceItem], hsn_index: HsnIndex) -> bool:
+    """Whether an item has an HSN code without a GST rate, and the code is on no row of hsn_index"""
+    for item in items:
+        fields = item_fields(item)
+        hsn = fields["section_2_transaction_hsn"]
+        if hsn and not fields["section_2_transaction_gst"] and not hsn_index.has_code(hsn):
+            return True
+    return False
+
+
+async def iter_page_results(document_handle: DocumentHandle, filename: str, page_limit: int,
+                            text_layer: bool, profile: RasterProfile,
+                            page_ranges: Optional[List[Tuple[int, Optional[int]]]] = None,
+                            pack_pages: int = 1,
+                            validate_items: bool = True,
+                            duplicate_similarity: Optional[float] = None,
+                            reextract_profile: Optional[RasterProfile] = None
+                            ) -> AsyncIterator[Tuple[int, List[InvoiceItem], PageSummary]]:
+    """Run the extraction pipeline over one spooled PDF, yielding each page as soon as it completes
+
+    Yields (pages_total, page_items, page_summary) in completion order, where
+    pages_total counts the pages selected by page_ranges. With a
+    duplicate_similarity, near-duplicate pages copy the items of the first
+    page of their group. With a reextract_profile, pages whose items do not
+    reconcile are extracted again once all pages are done and yielded a
+    second time, marked reextracted; the later result replaces the first.
+    """
+    tasks: List[asyncio.Task] = []
+    page_semaphore = asyncio.Semaphore(page_limit)
+    hsn_index_task: Optional[asyncio.Task] = None
+
+    async def document_hsn_index() -> HsnIndex:
+        # Whole-document HSN rows, extracted the first time a page needs them
+        nonlocal hsn_index_task
+        if hsn_index_task is None:
+            hsn_index_task = asyncio.create_task(extract_hsn_gst_data(document_handle, page_nums))
+        # A cancelled page must not cancel the extraction other pages are waiting on
+        return await asyncio.shield(hsn_index_task)
+
+    async def windowed(pages: Iterator[Coroutine], window: int
+                       ) -> AsyncIterator[Tuple[List[InvoiceItem], PageSummary]]:
+        # Pages are started lazily: the window lets the next pages rasterize while
+        # earlier ones wait on Gemini, while bounding how many rasters are in memory
+        nonlocal tasks
+        running = set()
+        while True:
+            for page in pages:
+                page_task = asyncio.create_task(page)
+                PAGES_IN_FLIGHT.inc()
+                page_task.add_done_callback(lambda _: PAGES_IN_FLIGHT.dec())
+                running.add(page_task)
+                if len(running) >= window:
+                    break
+            if not running:
+                break
+            tasks = list(running)
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+
+    async def send_page(page: PackedPage) -> str:
+        async with page_semaphore:
+            return await model_scheduler.call(
+                get_model_response, INPUT_PROMPT, page.image_data, EXTRACTION_PROMPT,
+                page.mime_type, tokens=estimate_tokens(INPUT_PROMPT, EXTRACTION_PROMPT, images=1)
+            )
+
+    async def send_pack(pages: List[PackedPage]) -> Dict[int, Union[str, BaseException]]:
+        page_numbers = [page.page_number for page in pages]
+        if len(pages) == 1:
+            # A lone page gets the ordinary single-page request
+            return {page_numbers[0]: await send_page(pages[0])}
+        async with page_semaphore:
+            try:
+                response = await model_scheduler.call(
+                    get_model_packed_response, INPUT_PROMPT, pages, EXTRACTION_PROMPT,
+                    tokens=estimate_tokens(INPUT_PROMPT, PACKED_PAGES_PROMPT, EXTRACTION_PROMPT, images=len(pages))
+                )
+            except PartialResponseError as e:
+                try:
+                    e.partial_pages = split_packed_response(e.partial_text, page_numbers)
+                except UnsplittablePackError:
+                    # Nothing that arrived can be placed on a page
+                    e.partial_pages = {page_number: "[]" for page_number in page_numbers}
+                raise
+        try:
+            return split_packed_response(response, page_numbers)
+        except UnsplittablePackError:
+            # Untagged items would land on the wrong page: extract each page on its own instead
+            responses = await asyncio.gather(*(send_page(page) for page in pages), return_exceptions=True)
+            return dict(zip(page_numbers, responses))
+
+    packer = None
+    if pack_pages > 1:
+        packer = PagePacker(send_pack, pack_pages, MODEL_PACK_MAX_BYTES, MODEL_PACK_LINGER_SECONDS)
+    deduper = PageDeduper(duplicate_similarity) if duplicate_similarity is not None else None
+    # Every page's result, kept for the reconciliation pass
+    results: Dict[int, Tuple[List[InvoiceItem], PageSummary]] = {}
+
+    # Replace the labels of a previous document handled by the same task, as in batch workers
+    set_document(None, document_handle.size)
+    try:
+        count_start = time.perf_counter()
+        page_count = await run_in_process(count_pages, document_handle)
+        page_nums = select_pages(page_ranges, page_count)
+        set_document(len(page_nums), document_handle.size)
+        # Recorded once the page count is known, so it carries the document's labels
+        observe_stage("count_pages", time.perf_counter() - count_start)
+        if not page_nums:
+            raise HTTPException(status_code=400, detail=f"No pages selected; the PDF has {page_count} pages")
+
+        pages = (
+            extract_page_items(
+                document_handle, page_num, filename, document_hsn_index, page_semaphore, text_layer,
+                profile, packer, validate_items, deduper
+            )
+            for page_num in page_nums
+        )
+        async for page_items, page_summary in windowed(pages, page_limit * 2 * pack_pages):
+            if reextract_profile is not None:
+                results[page_summary.page_number] = (page_items, page_summary)
+            yield len(page_nums), page_items, page_summary
+
+        if reextract_profile is not None and model_backend.available:
+            with stage("reconcile"):
+                flagged = unreconciled_pages([item for page_items, _ in results.values() for item in page_items])
+            # Text-layer rows reconcile by construction, and duplicates follow the page they copied
+            retries = (
+                extract_page_items(
+                    document_handle, page_number - 1, filename, document_hsn_index, page_semaphore, False,
+                    reextract_profile, None, validate_items, read_cache=reextract_profile != profile
+                )
+                for page_number in flagged if results[page_number][1].path in ("model", "cache", "partial")
+            )
+            async for retry in windowed(retries, page_limit * 2):
+                for page_items, page_summary in reconciled_results(retry, results):
+                    yield len(page_nums), page_items, page_summary
+    finally:
+        # Stop outstanding pages if a page failed or the consumer went away
+        if hsn_index_task is not None:
+            tasks.append(hsn_index_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if packer is not None:
+            await packer.close()
+        if deduper is not None:
+            deduper.close()
+
+
+def reconciled_results(retry: Tuple[List[InvoiceItem], PageSummary],
+                       results: Dict[int, Tuple[List[InvoiceItem], PageSummary]]
+                       ) -> List[Tuple[List[InvoiceItem], PageSummary]]:
+    """The better of a page's two extractions, plus the duplicates that copied the page"""
+    retry_items, retry_summary = retry
+    page_number = retry_summary.page_number
+    first_items, first_summary = results[page_number]
+    first = reconcile_items(first_items)
+    retry_result = reconcile_items(retry_items)
+    # An empty or unparseable retry must not replace the items the first pass found
+    replaced = retry_summary.path in ("model", "cache") and retry_is_better(first, retry_result)
+    REEXTRACTED_PAGES_TOTAL.inc(outcome="replaced" if replaced else "kept")
+    if not replaced:
+        return [(first_items, first_summary.model_copy(
+            update={"reextracted": True, "unreconciled_items": first.unreconciled}
+        ))]
+    updated = [(retry_items, retry_summary.model_copy(
+        update={"reextracted": True, "unreconciled_items": retry_result.unreconciled}
+    ))]
+    for duplicate_items, duplicate_summary in results.values():
+        if duplicate_summary.duplicate_of == page_number:
+            duplicate_items = copy_items(retry_items, duplicate_summary.page_number)
+            updated.append((duplicate_items, duplicate_summary.model_copy(update={
+                "items": len(duplicate_items), "reextracted": True, "unreconciled_items": retry_result.unreconciled
+            })))
+    return updated
+
+
+async def process_pdf(document_handle: DocumentHandle, filename: str, page_limit: int,
+                      text_layer: bool, profile: RasterProfile,
+                      page_ranges: Optional[List[Tuple[int, Optional[int]]]] = None,
+                      pack_pages: int = 1, validate_items: Optional[bool] = None,
+                      duplicate_similarity: Optional[float] = None,
+                      reextract_profile: Optional[RasterProfile] = None) -> InvoiceResponse:
+    """Run the full extraction pipeline over one spooled PDF
+
+    validate_items defaults to ITEM_VALIDATION; without it, data holds plain
+    field dicts and the response is built without validation.
+    """
+    if validate_items is None:
+        validate_items = ITEM_VALIDATION != "light"
+    results: Dict[int, Tuple[PageSummary, List[InvoiceItem]]] = {}
+    async for _, page_items, page_summary in iter_page_results(
+        document_handle, filename, page_limit, text_layer, profile, page_ranges, pack_pages, validate_items,
+        duplicate_similarity, reextract_profile
+    ):
+        # A re-extracted page replaces its first result
+        results[page_summary.page_number] = (page_summary, page_items)
+    # Pages complete out of order; the response lists them in page order
+    page_results = sorted(results.values(), key=lambda result: result[0].page_number)
+
+    all_invoices = [item for _, page_items in page_results for item in page_items]
+    page_summaries = [page_summary for page_summary, _ in page_results]
+    failed_pages = failed_page_numbers(page_summaries)
+    # The items are either validated already or deliberately unvalidated
+    return InvoiceResponse.model_construct(
+        success=not failed_pages,
+        message=extraction_message(len(all_invoices), len(page_summaries), failed_pages),
+        data=all_invoices,
+        total_items=len(all_invoices),
+        pages_processed=len(page_summaries),
+        pages=page_summaries,
+        failed_pages=failed_pages,
+        model_calls_saved=calls_saved(page_summaries),
+        reextracted_pages=reextracted_page_numbers(page_summaries)
+    )
+
+
+def failed_page_numbers(page_summaries: List[PageSummary]) -> List[int]:
+    return [page_summary.page_number for page_summary in page_summaries
+            if page_summary.path in ("failed", "partial")]
+
+
+def reextracted_page_numbers(page_summaries: List[PageSummary]) -> List[int]:
+    return [page_summary.page_number for page_summary in page_summaries if page_summary.reextracted]
+
+
+def calls_saved(page_summaries: List[PageSummary]) -> int:
+    return sum(1 for page_summary in page_summaries if page_summary.path == "duplicate")
+
+
+def extraction_message(total_items: int, page_count: int, failed_pages: List[int]) -> str:
+    message = f"Successfully extracted {total_items} invoice items from {page_count} pages"
+    if failed_pages:
+        # Only the failed pages need to be sent again
+        message += (f"; {len(failed_pages)} pages failed, retry them with "
+                    f"pages={','.join(str(page_number) for page_number in failed_pages)}")
+    return message
+
+
+def format_stream_event(event: str, payload: Dict[str, Any], stream_format: str) -> str:
+    """Encode one streaming event as an NDJSON line or a Server-Sent Event"""
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps({"event": event, **payload}) + "\n"
+
+
+def resolve_duplicate_similarity(dedupe_pages: Optional[bool],
+                                 duplicate_similarity: Optional[float]) -> Optional[float]:
+    """Similarity threshold for near-duplicate pages, or None when detection is off"""
+    if dedupe_pages is None:
+        # Passing a threshold turns detection on
+        dedupe_pages = DUPLICATE_PAGE_DETECTION or duplicate_similarity is not None
+    if not dedupe_pages:
+        return None
+    return duplicate_similarity if duplicate_similarity is not None else DUPLICATE_PAGE_SIMILARITY
+
+
+def resolve_reextract_profile(reextract: Optional[bool], profile: RasterProfile) -> Optional[RasterProfile]:
+    """Raster profile for extracting unreconciled pages again, or None when that is off"""
+    if not (RECONCILE_REEXTRACT if reextract is None else reextract):
+        return None
+    return get_profile(RECONCILE_RASTER_PROFILE) if RECONCILE_RASTER_PROFILE else profile
+
+
+def resolve_raster_profile(raster_profile: Optional[str]) -> RasterProfile:
+    try:
+        return get_profile(raster_profile)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Unknown raster profile: {raster_profile}")
+
+
+def resolve_page_ranges(pages: Optional[str]) -> Optional[List[Tuple[int, Optional[int]]]]:
+    if not pages:
+        return None
+    try:
+        return parse_page_ranges(pages)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+ResultFormat = Literal["json", "table", "csv", "arrow", "parquet"]
+
+
+def resolve_columns(result_format: str, fields: Optional[str]) -> List[str]:
+    if result_format in ("arrow", "parquet") and not arrow_available():
+        raise HTTPException(status_code=400, detail=f"{result_format} results need pyarrow on the server")
+    try:
+        return select_columns(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def json_response(model: BaseModel) -> Response:
+    """Encode with pydantic's serializer instead of FastAPI's response_model validation and encoding"""
+    # warnings=False: unvalidated items (ITEM_VALIDATION=light) are dicts where models are declared
+    return Response(model.model_dump_json(warnings=False), media_type="application/json")
+
+
+def columnar_response(summary: Dict[str, Any], rows: List[Dict[str, Any]], result_format: str,
+                      columns: List[str]) -> Response:
+    """Rows as compact JSON (columns + row arrays), CSV, Arrow IPC or Parquet"""
+    if result_format == "table":
+        body = json.dumps({**summary, **rows_table(rows, columns)}, separators=(",", ":"))
+        return Response(body, media_type=RESULT_MEDIA_TYPES["table"])
+    # Binary and CSV bodies carry the summary in headers
+    headers = {
+        "X-Total-Items": str(summary["total_items"]),
+        "X-Pages-Processed": str(summary["pages_processed"]),
+    }
+    if summary.get("failed_pages"):
+        headers["X-Failed-Pages"] = ",".join(str(page_number) for page_number in summary["failed_pages"])
+    if summary.get("model_calls_saved"):
+        headers["X-Model-Calls-Saved"] = str(summary["model_calls_saved"])
+    return Response(encode_rows(rows, result_format, columns), media_type=RESULT_MEDIA_TYPES[result_format],
+                    headers=headers)
+
+
+def invoice_response(result: InvoiceResponse, filename: str, result_format: str,
+                     columns: List[str]) -> Response:
+    if result_format == "json":
+        return json_response(result)
+    summary = {
+        "success": result.success,
+        "message": result.message,
+        "total_items": result.total_items,
+        "pages_processed": result.pages_processed,
+        "pages": jsonable_encoder(result.pages),
+        "failed_pages": result.failed_pages,
+        "model_calls_saved": result.model_calls_saved,
+        "reextracted_pages": result.reextracted_pages,
+    }
+    return columnar_response(summary, invoice_rows(result.data, filename), result_format, columns)
+
+
+async def process_batch_file(path: str, filename: str, options: Dict[str, Any]) -> InvoiceResponse:
+    """Scheduler callback for one file of a batch job; the file is deleted afterwards"""
+    start = time.perf_counter()
+    document_handle = handle_for_path(path)
+    try:
+        with REQUESTS_IN_FLIGHT.track(endpoint="batch"):
+            result = await process_pdf(document_handle, filename, options["page_limit"],
+                                       options["text_layer"], options["profile"], options["page_ranges"],
+                                       options["pack_pages"], duplicate_similarity=options["duplicate_similarity"],
+                                       reextract_profile=options["reextract_profile"])
+    finally:
+        release_document(document_handle)
+    observe_request("batch", time.perf_counter() - start)
+    return result
+
+
+batch_scheduler = BatchScheduler(process_batch_file, BATCH_WORKERS, BATCH_JOB_RETENTION_SECONDS)
+
+
+def get_batch_job_or_404(job_id: str) -> BatchJob:
+    job = batch_scheduler.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Batch job not found: {job_id}")
+    return job
+
+
+def batch_job_status(job: BatchJob) -> BatchJobStatus:
+    return BatchJobStatus(
+        job_id=job.job_id,
+        status=job.status,
+        total_files=len(job.files),
+        completed_files=job.completed_files,
+        failed_files=job.failed_files,
+        pending_files=len(job.pending) + job.in_progress,
+        pages_processed=job.pages_processed,
+        total_items=job.total_items,
+        created_at=job.created_at,
+        finished_at=job.finished_at
+    )
+
+
+def batch_job_results(job: BatchJob) -> BatchJobResults:
+    files = [
+        BatchFileResult(
+            filename=batch_file.filename,
+            success=batch_file.result.success if batch_file.result else False,
+            # Failed pages do not raise; their file reports the extraction message instead
+            error=batch_file.error or (batch_file.result.message if not batch_file.result.success else None),
+            data=batch_file.result.data if batch_file.result else [],
+            pages_processed=batch_file.result.pages_processed if batch_file.result else 0,
+            failed_pages=batch_file.result.failed_pages if batch_file.result else [],
+            model_calls_saved=batch_file.result.model_calls_saved if batch_file.result else 0,
+            reextracted_pages=batch_file.result.reextracted_pages if batch_file.result else []
+        )
+        for batch_file in job.files if batch_file.done
+    ]
+    return BatchJobResults(**dict(batch_job_status(job)), files=files)
+
+
 # API Routes
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
@@ -144,159 +1016,248 @@ async def health_check():
 
 
 @app.post("/extract-invoice", response_model=InvoiceResponse)
-async def extract_invoice(file: UploadFile = File(...)):
+async def extract_invoice(
+    file: UploadFile = File(...),
+    max_concurrency: Optional[int] = Query(None, ge=1, description="Pages of this request sent to Gemini at once"),
+    text_layer: bool = Query(True, description="Read line items from the PDF text layer when it is reliable"),
+    raster_profile: Optional[str] = Query(None, description=f"One of {', '.join(RASTER_PROFILES)}"),
+    pages: Optional[str] = Query(None, description='1-based pages to extract, such as "1-5,8,10-"'),
+    pack_pages: Optional[int] = Query(None, ge=1, description="Pages sent to Gemini in one request (1 disables packing)"),
+    dedupe_pages: Optional[bool] = Query(None, description="Copy the items of near-duplicate pages instead of extracting them again"),
+    duplicate_similarity: Optional[float] = Query(None, gt=0, le=1, description="Minimum page hash similarity of a duplicate page"),
+    reextract: Optional[bool] = Query(None, description="Extract pages whose line items do not reconcile once more"),
+    result_format: ResultFormat = Query("json", description="json, or the items as table (compact JSON), csv, arrow or parquet"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns for table, csv, arrow and parquet results")
+):
     """Extract invoice information from uploaded PDF"""
-    
+
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
-    
+
+    profile = resolve_raster_profile(raster_profile)
+    page_ranges = resolve_page_ranges(pages)
+    columns = resolve_columns(result_format, fields)
+    similarity = resolve_duplicate_similarity(dedupe_pages, duplicate_similarity)
+    reextract_profile = resolve_reextract_profile(reextract, profile)
+
+    start = time.perf_counter()
+    timings = start_request_timings()
+    with stage("spool"):
+        document_handle = await asyncio.to_thread(spool_upload, file.file, UPLOAD_SPOOL_DIR)
+        set_document(None, document_handle.size)
     try:
-        # Read PDF content
-        pdf_content = await file.read()
-        
-        # Extract HSN and GST data
-        hsn_gst_data = extract_hsn_and_rate(pdf_content)
-        
-        # Process PDF pages
-        pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
-        all_invoices = []
-        
-        input_prompt = """
-        You are an expert in understanding invoices. Analyze the invoice image and extract ALL line items/transactions from the invoice.
-        Extract GST rate from PDF using HSN code and fill Section 2_Transaction gst column automatically.
-        For EACH line item in the invoice, create a separate JSON object with this structure:
+        page_limit = min(max_concurrency or MAX_CONCURRENT_PAGES, MAX_CONCURRENT_MODEL_CALLS)
+        with REQUESTS_IN_FLIGHT.track(endpoint="extract"):
+            result = await process_pdf(document_handle, file.filename, page_limit, text_layer, profile,
+                                       page_ranges, pack_pages or MODEL_PACK_PAGES,
+                                       duplicate_similarity=similarity, reextract_profile=reextract_profile)
+        with stage("serialize"):
+            response = invoice_response(result, file.filename, result_format, columns)
+        elapsed = time.perf_counter() - start
+        observe_request("extract", elapsed)
+        if TIMING_HEADERS:
+            response.headers["Server-Timing"] = server_timing(timings, elapsed)
+        return response
 
+    except HTTPException as e:
+        if e.status_code < 500:
+            raise
+        raise HTTPException(status_code=500, detail=f"Processing error: {e.detail}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
+    finally:
+        release_document(document_handle)
 
-        {
-            "title": "[PDF filename or invoice title]",
-            "doc_id": "[generate a unique ID or extract from invoice]",
-            "type": "[invoice type like 'Tax Invoice']",
-            "uploaded_from": "web",
-            "user_doc_id": "[extract if available]",
-            "doc_meta_data": "[extract if available]",
-            "folder_name": "[extract if available]",
-            "folder_id": "[extract if available]",
-            "status": "reviewing",
-            "created_at_iso": "[current date in ISO format]",
-            "modified_at_iso": "[current date in ISO format]",
-            "Section 2_Transaction sort": "[line item number/sequence]",
-            "Section 2_Transaction number": "[product/part number]",
-            "Section 2_Transaction rate": "[unit price as number]",
-            "Section 2_Transaction qty": "[quantity as number]",
-            "Section 2_Transaction gst": "[GST percentage as number]",
-            "Section 2_Transaction discount": "[discount if any]",
-            "Section 2_Transaction hsn": "[HSN code]",
-            "Section 2_Transaction MRP": "[total amount for this line item]"
-        }
 
+@app.post("/extract-invoice/stream")
+async def extract_invoice_stream(
+    file: UploadFile = File(...),
+    max_concurrency: Optional[int] = Query(None, ge=1, description="Pages of this request sent to Gemini at once"),
+    text_layer: bool = Query(True, description="Read line items from the PDF text layer when it is reliable"),
+    raster_profile: Optional[str] = Query(None, description=f"One of {', '.join(RASTER_PROFILES)}"),
+    pages: Optional[str] = Query(None, description='1-based pages to extract, such as "1-5,8,10-"'),
+    pack_pages: Optional[int] = Query(None, ge=1, description="Pages sent to Gemini in one request (1 disables packing)"),
+    dedupe_pages: Optional[bool] = Query(None, description="Copy the items of near-duplicate pages instead of extracting them again"),
+    duplicate_similarity: Optional[float] = Query(None, gt=0, le=1, description="Minimum page hash similarity of a duplicate page"),
+    reextract: Optional[bool] = Query(None, description="Extract pages whose line items do not reconcile once more"),
+    stream_format: Literal["ndjson", "sse"] = Query("ndjson", alias="format"),
+    item_format: Literal["objects", "table"] = Query("objects", description="Items as objects, or as row arrays after a columns event"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns for item_format=table")
+):
+    """Stream each page's invoice items as NDJSON or Server-Sent Events, then a summary"""
 
-        IMPORTANT: 
-        - Return a JSON ARRAY containing ALL line items from the invoice
-        - Each line item should be a separate object in the array
-        - Extract ALL products/services listed in the invoice
-        - Use consistent metadata for all line items from the same invoice
-        - Generate sequential numbers for 'Section 2_Transaction sort' (1, 2, 3, etc.)
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
 
+    profile = resolve_raster_profile(raster_profile)
+    page_ranges = resolve_page_ranges(pages)
+    columns = resolve_columns(item_format, fields)
+    similarity = resolve_duplicate_similarity(dedupe_pages, duplicate_similarity)
+    reextract_profile = resolve_reextract_profile(reextract, profile)
+    with stage("spool"):
+        document_handle = await asyncio.to_thread(spool_upload, file.file, UPLOAD_SPOOL_DIR)
+        set_document(None, document_handle.size)
+    page_limit = min(max_concurrency or MAX_CONCURRENT_PAGES, MAX_CONCURRENT_MODEL_CALLS)
+    filename = file.filename
 
-        Return ONLY the JSON array without any additional text.
-        """
-        
-        for page_num in range(len(pdf_document)):
-            page = pdf_document.load_page(page_num)
-            pix = page.get_pixmap()
-            img_data = pix.tobytes("png")
-            
-            # Get Gemini response
-            if GEMINI_API_KEY:
-                response = get_gemini_response(input_prompt, img_data, "Extract invoice information as JSON")
-                
-                try:
-                    # Parse JSON response
-                    json_start = response.find('[')
-                    json_end = response.rfind(']') + 1
-                    if json_start == -1:
-                        json_start = response.find('{')
-                        json_end = response.rfind('}') + 1
-                    
-                    if json_start != -1 and json_end != -1:
-                        json_str = response[json_start:json_end]
-                        parsed_data = json.loads(json_str)
-                        
-                        if isinstance(parsed_data, list):
-                            for item in parsed_data:
-                                # Map fields to snake_case for Pydantic
-                                invoice_item = {
-                                    "title": item.get("title", file.filename),
-                                    "doc_id": item.get("doc_id", str(uuid.uuid4())),
-                                    "type": item.get("type", "Tax Invoice"),
-                                    "uploaded_from": "web",
-                                    "user_doc_id": item.get("user_doc_id"),
-                                    "doc_meta_data": item.get("doc_meta_data"),
-                                    "folder_name": item.get("folder_name"),
-                                    "folder_id": item.get("folder_id"),
-                                    "status": "reviewing",
-                                    "created_at_iso": datetime.now().isoformat(),
-                                    "modified_at_iso": datetime.now().isoformat(),
-                                    "section_2_transaction_sort": item.get("Section 2_Transaction sort", 1),
-                                    "section_2_transaction_number": item.get("Section 2_Transaction number"),
-                                    "section_2_transaction_rate": float(item.get("Section 2_Transaction rate", 0)) if item.get("Section 2_Transaction rate") else None,
-                                    "section_2_transaction_qty": int(item.get("Section 2_Transaction qty", 0)) if item.get("Section 2_Transaction qty") else None,
-                                    "section_2_transaction_gst": float(item.get("Section 2_Transaction gst", 0)) if item.get("Section 2_Transaction gst") else None,
-                                    "section_2_transaction_discount": float(item.get("Section 2_Transaction discount", 0)) if item.get("Section 2_Transaction discount") else None,
-                                    "section_2_transaction_hsn": item.get("Section 2_Transaction hsn"),
-                                    "section_2_transaction_mrp": float(item.get("Section 2_Transaction MRP", 0)) if item.get("Section 2_Transaction MRP") else None,
-                                    "page_number": page_num + 1
-                                }
-                                
-                                # Auto-fill HSN and GST from extracted data
-                                for hg in hsn_gst_data:
-                                    if not invoice_item["section_2_transaction_hsn"]:
-                                        invoice_item["section_2_transaction_hsn"] = hg["HSN"]
-                                    if not invoice_item["section_2_transaction_gst"]:
-                                        invoice_item["section_2_transaction_gst"] = hg["GST_Rate(%)"]
-                                
-                                all_invoices.append(InvoiceItem(**invoice_item))
-                    else:
-                        # Handle single item
-                        invoice_item = {
-                            "title": parsed_data.get("title", file.filename),
-                            "doc_id": parsed_data.get("doc_id", str(uuid.uuid4())),
-                            "type": parsed_data.get("type", "Tax Invoice"),
-                            "uploaded_from": "web",
-                            "created_at_iso": datetime.now().isoformat(),
-                            "modified_at_iso": datetime.now().isoformat(),
-                            "section_2_transaction_sort": 1,
-                            "page_number": page_num + 1
-                        }
-                        all_invoices.append(InvoiceItem(**invoice_item))
-                
-                except json.JSONDecodeError:
-                    # If JSON parsing fails, create a basic item
-                    basic_item = {
-                        "title": file.filename,
-                        "doc_id": str(uuid.uuid4()),
-                        "type": "Tax Invoice",
-                        "uploaded_from": "web",
-                        "status": "reviewing",
-                        "created_at_iso": datetime.now().isoformat(),
-                        "modified_at_iso": datetime.now().isoformat(),
-                        "section_2_transaction_sort": 1,
-                        "page_number": page_num + 1
-                    }
-                    all_invoices.append(InvoiceItem(**basic_item))
-        
-        pdf_document.close()
-        
-        return InvoiceResponse(
-            success=True,
-            message=f"Successfully extracted {len(all_invoices)} invoice items from {len(pdf_document)} pages",
-            data=all_invoices,
-            total_items=len(all_invoices),
-            pages_processed=len(pdf_document)
-        )
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
+    async def events() -> AsyncIterator[str]:
+        total_items = 0
+        # A re-extracted page is sent again and replaces its first result
+        summaries_by_page: Dict[int, PageSummary] = {}
+        start = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc(endpoint="stream")
+        try:
+            if item_format == "table":
+                yield format_stream_event("columns", {"columns": columns}, stream_format)
+            async for page_count, page_items, page_summary in iter_page_results(
+                document_handle, filename, page_limit, text_layer, profile, page_ranges,
+                pack_pages or MODEL_PACK_PAGES, duplicate_similarity=similarity, reextract_profile=reextract_profile
+            ):
+                previous = summaries_by_page.get(page_summary.page_number)
+                total_items += len(page_items) - (previous.items if previous else 0)
+                summaries_by_page[page_summary.page_number] = page_summary
+                if item_format == "table":
+                    items = {"rows": rows_table(invoice_rows(page_items, filename), columns)["rows"]}
+                else:
+                    items = {"data": [item_fields(item) for item in page_items]}
+                yield format_stream_event("page", {
+                    **jsonable_encoder(page_summary),
+                    "pages_total": page_count,
+                    "pages_completed": len(summaries_by_page),
+                    **items
+                }, stream_format)
+
+            page_summaries = [summaries_by_page[page_number] for page_number in sorted(summaries_by_page)]
+            failed_pages = failed_page_numbers(page_summaries)
+            yield format_stream_event("summary", {
+                "success": not failed_pages,
+                "message": extraction_message(total_items, len(page_summaries), failed_pages),
+                "total_items": total_items,
+                "pages_processed": len(page_summaries),
+                "pages": jsonable_encoder(page_summaries),
+                "failed_pages": failed_pages,
+                "model_calls_saved": calls_saved(page_summaries),
+                "reextracted_pages": reextracted_page_numbers(page_summaries)
+            }, stream_format)
+            observe_request("stream", time.perf_counter() - start)
+        except Exception as e:
+            # Headers are already sent, so errors are reported in-band
+            yield format_stream_event("error", {
+                "detail": f"Processing error: {getattr(e, 'detail', None) or str(e)}"
+            }, stream_format)
+        finally:
+            REQUESTS_IN_FLIGHT.dec(endpoint="stream")
+            release_document(document_handle)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream" if stream_format == "sse" else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/batch-jobs", response_model=BatchJobResponse, status_code=202)
+async def create_batch_job(
+    files: List[UploadFile] = File(...),
+    max_concurrency: Optional[int] = Query(None, ge=1, description="Pages of each file sent to Gemini at once"),
+    text_layer: bool = Query(True, description="Read line items from the PDF text layer when it is reliable"),
+    raster_profile: Optional[str] = Query(None, description=f"One of {', '.join(RASTER_PROFILES)}"),
+    pages: Optional[str] = Query(None, description='1-based pages to extract, such as "1-5,8,10-"'),
+    pack_pages: Optional[int] = Query(None, ge=1, description="Pages sent to Gemini in one request (1 disables packing)"),
+    dedupe_pages: Optional[bool] = Query(None, description="Copy the items of near-duplicate pages instead of extracting them again"),
+    duplicate_similarity: Optional[float] = Query(None, gt=0, le=1, description="Minimum page hash similarity of a duplicate page"),
+    reextract: Optional[bool] = Query(None, description="Extract pages whose line items do not reconcile once more")
+):
+    """Queue many PDFs, or ZIP archives of PDFs, for background extraction"""
+
+    for file in files:
+        if not file.filename.lower().endswith(('.pdf', '.zip')):
+            raise HTTPException(status_code=400, detail=f"Only PDF and ZIP files are supported: {file.filename}")
+
+    profile = resolve_raster_profile(raster_profile)
+    page_ranges = resolve_page_ranges(pages)
+
+    job = batch_scheduler.create_job({
+        "page_limit": min(max_concurrency or MAX_CONCURRENT_PAGES, MAX_CONCURRENT_MODEL_CALLS),
+        "text_layer": text_layer,
+        "profile": profile,
+        "page_ranges": page_ranges,
+        "pack_pages": pack_pages or MODEL_PACK_PAGES,
+        "duplicate_similarity": resolve_duplicate_similarity(dedupe_pages, duplicate_similarity),
+        "reextract_profile": resolve_reextract_profile(reextract, profile),
+    })
+    try:
+        for file in files:
+            await asyncio.to_thread(job.add_upload, file.filename, file.file)
+    except zipfile.BadZipFile as e:
+        batch_scheduler.discard_job(job)
+        raise HTTPException(status_code=400, detail=f"Invalid ZIP archive: {str(e)}")
+
+    await batch_scheduler.submit(job)
+    return BatchJobResponse(job_id=job.job_id, status=job.status, total_files=len(job.files))
+
+
+@app.get("/batch-jobs/{job_id}", response_model=BatchJobStatus)
+async def get_batch_job(job_id: str):
+    """Progress counters for a batch job"""
+    return batch_job_status(get_batch_job_or_404(job_id))
+
+
+@app.get("/batch-jobs/{job_id}/partial", response_model=BatchJobResults)
+async def get_batch_job_partial_results(job_id: str):
+    """Results of the files a batch job has finished so far"""
+    return batch_job_results(get_batch_job_or_404(job_id))
+
+
+@app.get("/batch-jobs/{job_id}/results", response_model=BatchJobResults)
+async def get_batch_job_results(
+    job_id: str,
+    result_format: ResultFormat = Query("json", description="json, or the items as table (compact JSON), csv, arrow or parquet"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns for table, csv, arrow and parquet results")
+):
+    """Final results of a finished batch job"""
+    job = get_batch_job_or_404(job_id)
+    if not job.finished_at:
+        raise HTTPException(status_code=409, detail=f"Batch job {job_id} is still {job.status}")
+    columns = resolve_columns(result_format, fields)
+    if result_format == "json":
+        return json_response(batch_job_results(job))
+
+    rows = [
+        row
+        for batch_file in job.files if batch_file.result
+        for row in invoice_rows(batch_file.result.data, batch_file.filename)
+    ]
+    summary = {
+        **jsonable_encoder(batch_job_status(job)),
+        "files": [
+            {"filename": batch_file.filename, "success": batch_file.error is None, "error": batch_file.error,
+             "model_calls_saved": batch_file.result.model_calls_saved if batch_file.result else 0,
+             "reextracted_pages": batch_file.result.reextracted_pages if batch_file.result else []}
+            for batch_file in job.files
+        ],
+    }
+    return columnar_response(summary, rows, result_format, columns)
+
+
+@app.get("/cache/stats", response_model=CacheStatsResponse)
+async def cache_stats():
+    """Extraction cache hit/miss counters"""
+    return CacheStatsResponse(**extraction_cache.stats())
+
+
+@app.get("/model/stats")
+async def model_stats():
+    """Model backend counters plus retry, throttling and circuit breaker statistics"""
+    return {**model_backend.stats(), "scheduler": model_scheduler.stats()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: per-stage latency histograms, page and cache counters, in-flight gauges"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/")
@@ -1,45 +1,38 @@
 import streamlit as st
-from PIL import Image
-import google.generativeai as genai
-import PyPDF2
-import io
+import hashlib
 import json
 from dotenv import load_dotenv
 import os
-import re
-import pdfplumber
+import threading
+
+from model_backend import create_backend
+
+# PyMuPDF and pdfplumber (document, pdf_pipeline) take a noticeable part of a cold
+# start, so they are imported only once a page actually has to be extracted
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure the Google API key from environment variable
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
+# ===== Model backend, created once and kept across Streamlit reruns =====
+@st.cache_resource
+def load_model_backend():
+    return create_backend(os.getenv("MODEL_BACKEND"))
+
+model_backend = load_model_backend()
+if not model_backend.available:
     st.error("GEMINI_API_KEY not found in .env file. Please add your API key to the .env file.")
     st.stop()
 
-genai.configure(api_key=api_key)
-
-# ===== Function to load Gemini model and get responses =====
-def get_gemini_response(input, image, prompt):
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    response = model.generate_content([input, image[0], prompt])
-    return response.text
+# ===== Function to get model responses =====
+def get_model_response(input, image, prompt):
+    return model_backend.generate([input, image[0], prompt])
 
 # ===== Function to convert PDF pages to images =====
 def pdf_to_images(pdf_file):
-    import fitz  # PyMuPDF
-    pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-    images = []
-    
-    for page_num in range(len(pdf_document)):
-        page = pdf_document.load_page(page_num)
-        pix = page.get_pixmap()
-        img_data = pix.tobytes("png")
-        images.append(img_data)
-    
-    pdf_document.close()
-    return images
+    from document import InvoiceDocument
+
+    with InvoiceDocument(pdf_file.read()) as document:
+        return [document.render_page(page_num) for page_num in range(document.page_count)]
 
 # ===== Function to set up image for processing =====
 def input_image_setup(image_data, mime_type="image/png"):
@@ -54,42 +47,76 @@ def input_image_setup(image_data, mime_type="image/png"):
     else:
         raise FileNotFoundError("No image data provided")
 
-# ===== Extract HSN and GST rate directly from PDF =====
-def extract_hsn_and_rate(pdf_path):
-    results = []
-    hsn_pattern = r"\b\d{4,8}\b"   # HSN code pattern
-    gst_pattern = r"(\d{1,2})\s*%" # GST percentage pattern
-
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text()
-            if not text:
-                continue
-
-            lines = text.split("\n")
-            for idx, line in enumerate(lines):
-                hsn_match = re.search(hsn_pattern, line)
-                if hsn_match:
-                    hsn_code = hsn_match.group(0)
-                    gst_rate = None
-                    
-                    # Check GST rate in same line
-                    gst_match = re.search(gst_pattern, line)
-                    if gst_match:
-                        gst_rate = int(gst_match.group(1))
-                    else:
-                        # Check next 2 lines if not found
-                        for next_line in lines[idx+1: idx+3]:
-                            gst_match_next = re.search(gst_pattern, next_line)
-                            if gst_match_next:
-                                gst_rate = int(gst_match_next.group(1))
-                                break
-                    
-                    results.append({
-                        "HSN": hsn_code,
-                        "GST_Rate(%)": gst_rate
-                    })
-    return results
+class UnparseableResponse(ValueError):
+    """A model response without usable JSON; raised so that it is not cached"""
+
+    def __init__(self, message, raw):
+        super().__init__(message)
+        self.raw = raw
+
+# ===== Function to parse one page's model response into line items =====
+def parse_page_response(response, page_num, hsn_index):
+    """Line items of one page; raises UnparseableResponse with the raw response"""
+    try:
+        json_start = response.find('[')
+        json_end = response.rfind(']') + 1
+        if json_start == -1:
+            json_start = response.find('{')
+            json_end = response.rfind('}') + 1
+
+        if json_start == -1 or json_end == -1:
+            raise UnparseableResponse(f"Could not extract valid JSON from page {page_num + 1}", response)
+        parsed_data = json.loads(response[json_start:json_end])
+    except json.JSONDecodeError as e:
+        raise UnparseableResponse(f"Invalid JSON format on page {page_num + 1}: {str(e)}", response)
+
+    if not isinstance(parsed_data, list):
+        parsed_data["page_number"] = page_num + 1
+        return [parsed_data]
+    for row, item in enumerate(parsed_data):
+        item["page_number"] = page_num + 1
+        # Auto-fill GST & HSN from the matching text-layer row if missing
+        if not item.get("Section 2_Transaction hsn") or not item.get("Section 2_Transaction gst"):
+            entry = hsn_index.lookup(page_num + 1, row, item.get("Section 2_Transaction hsn"))
+            if entry:
+                if not item.get("Section 2_Transaction hsn"):
+                    item["Section 2_Transaction hsn"] = entry.hsn
+                if not item.get("Section 2_Transaction gst"):
+                    item["Section 2_Transaction gst"] = entry.gst_rate
+    return parsed_data
+
+# ===== Cached per-upload work, kept across reruns and keyed by the file's hash =====
+# The PDF bytes are an unhashed argument (leading underscore), so a rerun hashes the
+# upload once instead of once per cached call. Model errors and unparseable responses
+# raise and are not cached, so pressing the button again retries only the pages that
+# have not been extracted.
+@st.cache_resource(show_spinner=False, max_entries=4)
+def load_document(file_hash, _pdf_bytes):
+    """The upload parsed once, shared by every page and rerun; the lock serializes access to it"""
+    from document import InvoiceDocument
+
+    return InvoiceDocument(_pdf_bytes), threading.Lock()
+
+def count_pages(file_hash, pdf_bytes):
+    document, lock = load_document(file_hash, pdf_bytes)
+    with lock:
+        return document.page_count
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def load_hsn_index(file_hash, _pdf_bytes):
+    from pdf_pipeline import extract_hsn_and_rate
+
+    document, lock = load_document(file_hash, _pdf_bytes)
+    with lock:
+        return extract_hsn_and_rate(document)
+
+@st.cache_data(show_spinner=False, max_entries=2000)
+def extract_page(file_hash, page_num, model_name, _pdf_bytes):
+    document, lock = load_document(file_hash, _pdf_bytes)
+    with lock:
+        img_data = document.render_page(page_num)
+    response = get_model_response(input_prompt, input_image_setup(img_data), "Extract invoice information as JSON")
+    return parse_page_response(response, page_num, load_hsn_index(file_hash, _pdf_bytes))
 
 # ===== Streamlit App UI =====
 st.set_page_config(page_title="Invoice Extractor")
@@ -100,11 +127,15 @@ uploaded_file = st.file_uploader("Choose a PDF file...", type=["pdf"])
 
 if uploaded_file is not None:
     st.success(f"PDF file '{uploaded_file.name}' uploaded successfully!")
-    pdf_reader = PyPDF2.PdfReader(uploaded_file)
-    num_pages = len(pdf_reader.pages)
+    pdf_bytes = uploaded_file.getvalue()
+    file_hash = hashlib.sha256(pdf_bytes).hexdigest()
+    num_pages = count_pages(file_hash, pdf_bytes)
     st.info(f"PDF contains {num_pages} page(s). Each page will be processed as a separate invoice.")
 
 submit_button = st.button("Extract Invoice Information")
+if submit_button and uploaded_file is not None:
+    # Keep showing this file's results on later reruns, e.g. after the download button is clicked
+    st.session_state["extracted_file"] = file_hash
 
 input_prompt = """
 You are an expert in understanding invoices. Analyze the invoice image and extract ALL line items/transactions from the invoice.
@@ -143,78 +174,34 @@ IMPORTANT:
 Return ONLY the JSON array without any additional text.
 """
 
-if submit_button and uploaded_file is not None:
+if uploaded_file is not None and st.session_state.get("extracted_file") == file_hash:
     try:
-        st.subheader("Processing PDF...")
-        import fitz  # PyMuPDF
-        pdf_document = fitz.open(stream=uploaded_file.getvalue(), filetype="pdf")
-        
-        # Extract HSN & GST rates
-        uploaded_file.seek(0)
-        hsn_gst_data = extract_hsn_and_rate(uploaded_file)
+        st.subheader("Extracted Invoice Information")
+        progress = st.progress(0.0, text="Processing PDF...")
 
+        # Pages are shown as they complete; on a rerun they all come from the cache
         all_invoices = []
-        for page_num in range(len(pdf_document)):
-            st.write(f"Processing page {page_num + 1}...")
-            page = pdf_document.load_page(page_num)
-            pix = page.get_pixmap()
-            img_data = pix.tobytes("png")
-            
-            image_data = input_image_setup(img_data)
-            response = get_gemini_response(input_prompt, image_data, "Extract invoice information as JSON")
-            
+        for page_num in range(num_pages):
             try:
-                json_start = response.find('[')
-                json_end = response.rfind(']') + 1
-                if json_start == -1:
-                    json_start = response.find('{')
-                    json_end = response.rfind('}') + 1
-                    
-                if json_start != -1 and json_end != -1:
-                    json_str = response[json_start:json_end]
-                    parsed_data = json.loads(json_str)
-                    if isinstance(parsed_data, list):
-                        for item in parsed_data:
-                            item["page_number"] = page_num + 1
-                            # Auto-fill GST & HSN from extracted data if missing
-                            for hg in hsn_gst_data:
-                                if "Section 2_Transaction hsn" not in item or not item["Section 2_Transaction hsn"]:
-                                    item["Section 2_Transaction hsn"] = hg["HSN"]
-                                if "Section 2_Transaction gst" not in item or not item["Section 2_Transaction gst"]:
-                                    item["Section 2_Transaction gst"] = hg["GST_Rate(%)"]
-                            all_invoices.append(item)
-                    else:
-                        parsed_data["page_number"] = page_num + 1
-                        all_invoices.append(parsed_data)
-                else:
-                    st.error(f"Could not extract valid JSON from page {page_num + 1}")
-                    st.text(f"Raw response: {response}")
-            except json.JSONDecodeError as e:
-                st.error(f"Invalid JSON format on page {page_num + 1}: {str(e)}")
-                st.text(f"Raw response: {response}")
-        
-        pdf_document.close()
-        
-        if all_invoices:
-            st.subheader(f"Extracted Invoice Information ({len(all_invoices)} line items)")
-            pages = {}
-            for invoice in all_invoices:
-                page_num = invoice.get('page_number', 1)
-                if page_num not in pages:
-                    pages[page_num] = []
-                pages[page_num].append(invoice)
-            
-            for page_num in sorted(pages.keys()):
-                page_items = pages[page_num]
-                st.write(f"### Page {page_num} ({len(page_items)} line items)")
-                for i, invoice in enumerate(page_items[:3]):
+                page_items = extract_page(file_hash, page_num, model_backend.model_name, pdf_bytes)
+            except UnparseableResponse as e:
+                st.error(str(e))
+                st.text(f"Raw response: {e.raw}")
+                page_items = []
+            all_invoices.extend(page_items)
+            if page_items:
+                st.write(f"### Page {page_num + 1} ({len(page_items)} line items)")
+                for invoice in page_items[:3]:
                     st.json(invoice)
                 if len(page_items) > 3:
-                    with st.expander(f"Show remaining {len(page_items) - 3} items from page {page_num}"):
+                    with st.expander(f"Show remaining {len(page_items) - 3} items from page {page_num + 1}"):
                         for invoice in page_items[3:]:
                             st.json(invoice)
                 st.write("---")
-            
+            progress.progress((page_num + 1) / num_pages, text=f"Processed page {page_num + 1} of {num_pages}")
+        progress.empty()
+
+        if all_invoices:
             json_output = json.dumps(all_invoices, indent=2)
             st.download_button(
                 label=f"Download All {len(all_invoices)} Line Items as JSON",
@@ -224,7 +211,7 @@ if submit_button and uploaded_file is not None:
             )
         else:
             st.error("No valid invoice data could be extracted from the PDF.")
-            
+
     except Exception as e:
         st.error(f"Error processing PDF: {str(e)}")
         st.write("Please make sure you have uploaded a valid PDF file.")
@@ -0,0 +1,70 @@
+"""Benchmark /extract-invoice page concurrency against the offline stub model backend.
+
+Usage:
+    python benchmarks/bench_concurrency.py --pages 40 --latency 0.5 --concurrency 1 4 16 --pack-pages 1 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import fitz  # PyMuPDF
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+from model_backend import StubBackend  # noqa: E402
+
+
+def make_pdf(pages: int) -> bytes:
+    """Build a minimal multi-page PDF"""
+    document = fitz.open()
+    for page_num in range(pages):
+        page = document.new_page()
+        page.insert_text((72, 72), f"TAX INVOICE page {page_num + 1}")
+        page.insert_text((72, 100), "Laptop 8471 2 x 100.00 GST 18 %")
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.5, help="Stub model latency in seconds")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--pack-pages", type=int, nargs="+", default=[1], help="Pages per model request")
+    args = parser.parse_args()
+
+    app.model_backend = StubBackend(latency=args.latency)
+    pdf_bytes = make_pdf(args.pages)
+
+    with TestClient(app.app) as client:
+        def run(label: str, limit: int, pack_pages: int = 1):
+            before = app.model_backend.stats()
+            start = time.perf_counter()
+            response = client.post(
+                "/extract-invoice",
+                params={"max_concurrency": limit, "text_layer": False, "pack_pages": pack_pages},
+                files={"file": ("bench.pdf", pdf_bytes, "application/pdf")},
+            )
+            elapsed = time.perf_counter() - start
+            response.raise_for_status()
+            after = app.model_backend.stats()
+            print(f"{label:<24} pages={args.pages} "
+                  f"latency={elapsed:.2f}s throughput={args.pages / elapsed:.1f} pages/s "
+                  f"requests={after['requests'] - before['requests']} "
+                  f"prompt_chars={after['prompt_chars'] - before['prompt_chars']}")
+
+        for pack_pages in args.pack_pages:
+            for limit in args.concurrency:
+                app.extraction_cache.clear()
+                run(f"concurrency={limit} pack={pack_pages}", limit, pack_pages)
+
+        # Same upload again: every page is served from the extraction cache
+        run("warm cache", args.concurrency[-1])
+        print(f"cache: {app.extraction_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
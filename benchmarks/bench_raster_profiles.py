@@ -0,0 +1,97 @@
+"""Compare rasterization profiles: encode time, bytes sent and end-to-end latency.
+
+The stub model backend's latency grows with the payload (a fixed round trip
+plus upload time at --bandwidth), so smaller encodings show up in the latency.
+
+Usage:
+    python benchmarks/bench_raster_profiles.py --pages 10 --latency 0.3 --bandwidth 2
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+from document import InvoiceDocument  # noqa: E402
+from invoice_generator import generate_invoice_pdf, to_scanned  # noqa: E402
+from model_backend import StubBackend  # noqa: E402
+from rasterize import RASTER_PROFILES  # noqa: E402
+
+
+class UploadTimeStub(StubBackend):
+    """Stub backend that also charges upload time for the image bytes it receives"""
+
+    def __init__(self, latency: float, bandwidth: float):
+        super().__init__(latency=latency)
+        self.bandwidth = bandwidth
+
+    def _generate(self, parts):
+        image_bytes = sum(len(part["data"]) for part in parts if isinstance(part, dict))
+        time.sleep(image_bytes / (self.bandwidth * 1024 * 1024))
+        return super()._generate(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.3, help="Stub model round trip in seconds")
+    parser.add_argument("--bandwidth", type=float, default=2.0, help="Simulated upload bandwidth in MB/s")
+    parser.add_argument("--scanned", action="store_true", help="Use image-only pages instead of vector text")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    # Small print, where the raster profiles differ most in legibility
+    pdf_bytes = generate_invoice_pdf(args.pages, fontsize=6.5)
+    if args.scanned:
+        pdf_bytes = to_scanned(pdf_bytes)
+
+    app.model_backend = UploadTimeStub(args.latency, args.bandwidth)
+
+    report = []
+    with TestClient(app.app) as client:
+        # Warm up the worker pool so the first profile does not pay for process start-up
+        client.post("/extract-invoice", params={"text_layer": False},
+                    files={"file": ("warmup.pdf", generate_invoice_pdf(1), "application/pdf")})
+
+        for name, profile in RASTER_PROFILES.items():
+            with InvoiceDocument(pdf_bytes) as document:
+                start = time.perf_counter()
+                sizes = [len(document.render_page(page_num, profile)) for page_num in range(args.pages)]
+                encode_ms = (time.perf_counter() - start) * 1000 / args.pages
+
+            app.extraction_cache.clear()
+            start = time.perf_counter()
+            response = client.post(
+                "/extract-invoice",
+                params={"raster_profile": name, "text_layer": False},
+                files={"file": ("bench.pdf", pdf_bytes, "application/pdf")},
+            )
+            response.raise_for_status()
+            latency = time.perf_counter() - start
+
+            report.append({
+                "profile": name,
+                "dpi": profile.dpi,
+                "format": profile.image_format,
+                "encode_ms_per_page": round(encode_ms, 2),
+                "bytes_per_page": sum(sizes) // len(sizes),
+                "bytes_sent": sum(sizes),
+                "end_to_end_s": round(latency, 3),
+            })
+
+    print(f"{'profile':<12}{'dpi':>5}{'format':>8}{'encode ms/pg':>14}{'KB/pg':>9}{'latency s':>11}")
+    for row in report:
+        print(f"{row['profile']:<12}{row['dpi']:>5}{row['format']:>8}{row['encode_ms_per_page']:>14.2f}"
+              f"{row['bytes_per_page'] / 1024:>9.1f}{row['end_to_end_s']:>11.3f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Reproducible throughput benchmark of the extraction pipeline against the stub model.
+
+Generates synthetic GST invoices (text-layer and scanned variants) with
+benchmarks/invoice_generator.py and times:
+
+- extract/<variant>: POST /extract-invoice end to end, with the extraction
+  cache cleared before every run so each run does the full work;
+- hsn/text: extract_hsn_and_rate over the whole document in-process.
+
+For every scenario it reports pages/s, p50/p95/p99 latency and the peak RSS
+of the server process plus its PDF workers. --output saves the report as
+JSON; --compare checks a run against a saved report and exits with status 1
+when throughput or p95 latency regressed by more than --tolerance.
+
+Usage:
+    python benchmarks/bench_suite.py --pages 1 10 50 --items 15 --repeat 10 --output baseline.json
+    python benchmarks/bench_suite.py --pages 1 10 50 --items 15 --repeat 10 --compare baseline.json
+"""
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+from document import InvoiceDocument  # noqa: E402
+from invoice_generator import generate_invoice  # noqa: E402
+from model_backend import StubBackend  # noqa: E402
+from pdf_pipeline import extract_hsn_and_rate  # noqa: E402
+
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def process_rss(pid: int) -> int:
+    """Resident set size of a process in bytes, 0 if it cannot be read"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+class RssSampler:
+    """Samples the RSS of this process and its worker processes in a background thread"""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self) -> int:
+        pids = [os.getpid()] + [child.pid for child in multiprocessing.active_children()]
+        return sum(process_rss(pid) for pid in pids)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.sample())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.sample())
+        if not self.peak:
+            # No /proc: fall back to this process's high-water mark (KB on Linux, bytes on macOS)
+            scale = 1 if sys.platform == "darwin" else 1024
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def run_scenario(name: str, pages: int, repeat: int, run_once: Callable[[], Dict[str, Any]],
+                 **details: Any) -> Dict[str, Any]:
+    """Time repeat runs of one scenario"""
+    latencies = []
+    extracted = 0
+    with RssSampler() as sampler:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            run_start = time.perf_counter()
+            extracted = run_once().get("items", extracted)
+            latencies.append(time.perf_counter() - run_start)
+        elapsed = time.perf_counter() - start
+    return {
+        "name": name,
+        "pages": pages,
+        "runs": repeat,
+        **details,
+        "items": extracted,
+        "pages_per_s": round(pages * repeat / elapsed, 2),
+        "latency_s": {
+            "p50": round(percentile(latencies, 50), 4),
+            "p95": round(percentile(latencies, 95), 4),
+            "p99": round(percentile(latencies, 99), 4),
+            "mean": round(sum(latencies) / len(latencies), 4),
+        },
+        "peak_rss_mb": round(sampler.peak / (1024 * 1024), 1),
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> bool:
+    """Print the change against a saved report; returns True if any scenario regressed"""
+    previous = {row["name"]: row for row in baseline["results"]}
+    regressed = False
+    print(f"\n{'scenario':<28}{'pages/s':^18}{'p95 s':^20}{'d pages/s':>11}{'d p95':>9}")
+    for row in results:
+        old = previous.get(row["name"])
+        if old is None:
+            print(f"{row['name']:<28}{'(new)':>18}")
+            continue
+        throughput = row["pages_per_s"] / old["pages_per_s"] - 1
+        p95 = row["latency_s"]["p95"] / old["latency_s"]["p95"] - 1
+        flag = ""
+        if throughput < -tolerance or p95 > tolerance:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{row['name']:<28}{old['pages_per_s']:>7.1f} -> {row['pages_per_s']:<7.1f}"
+              f"{old['latency_s']['p95']:>8.3f} -> {row['latency_s']['p95']:<8.3f}"
+              f"{throughput:>+11.1%}{p95:>+9.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 50], help="Document sizes to run")
+    parser.add_argument("--items", type=int, default=15, help="Line items per page")
+    parser.add_argument("--variants", nargs="+", choices=["text", "scanned"], default=["text", "scanned"])
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per scenario")
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub model latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Stub model latency jitter in seconds")
+    parser.add_argument("--concurrency", type=int, help="max_concurrency for /extract-invoice")
+    parser.add_argument("--pack-pages", type=int, default=1, help="Pages per model request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--compare", help="Saved report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative slowdown")
+    args = parser.parse_args()
+
+    app.model_backend = StubBackend(latency=args.latency, jitter=args.jitter, seed=args.seed)
+    documents = {
+        (variant, pages): generate_invoice(pages, args.items, scanned=variant == "scanned", seed=args.seed)
+        for variant in args.variants for pages in args.pages
+    }
+
+    results = []
+    with TestClient(app.app) as client:
+        def extract(pdf_bytes: bytes) -> Dict[str, Any]:
+            app.extraction_cache.clear()
+            params = {"pack_pages": args.pack_pages}
+            if args.concurrency:
+                params["max_concurrency"] = args.concurrency
+            response = client.post("/extract-invoice", params=params,
+                                   files={"file": ("bench.pdf", pdf_bytes, "application/pdf")})
+            response.raise_for_status()
+            return {"items": response.json()["total_items"]}
+
+        # Start the worker pool before timing anything
+        extract(generate_invoice(1, args.items))
+
+        for (variant, pages), pdf_bytes in documents.items():
+            before = app.model_backend.stats()["requests"]
+            row = run_scenario(f"extract/{variant}/{pages}p", pages, args.repeat,
+                               lambda: extract(pdf_bytes), variant=variant, bytes=len(pdf_bytes))
+            row["model_requests"] = (app.model_backend.stats()["requests"] - before) // args.repeat
+            results.append(row)
+
+    for (variant, pages), pdf_bytes in documents.items():
+        if variant != "text":
+            continue
+
+        def hsn() -> Dict[str, Any]:
+            with InvoiceDocument(pdf_bytes) as document:
+                return {"items": len(extract_hsn_and_rate(document))}
+
+        results.append(run_scenario(f"hsn/text/{pages}p", pages, args.repeat, hsn,
+                                    variant=variant, bytes=len(pdf_bytes)))
+
+    print(f"{'scenario':<28}{'pages/s':>9}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'RSS MB':>9}{'model req':>11}")
+    for row in results:
+        latency = row["latency_s"]
+        print(f"{row['name']:<28}{row['pages_per_s']:>9.1f}{latency['p50']:>9.3f}{latency['p95']:>9.3f}"
+              f"{latency['p99']:>9.3f}{row['peak_rss_mb']:>9.1f}{row.get('model_requests', '-'):>11}")
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
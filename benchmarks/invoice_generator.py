@@ -0,0 +1,113 @@
+"""Synthetic GST invoice PDFs for benchmarks.
+
+Invoices are generated from a seed, so the same arguments always give the
+same bytes. Each page carries a seller/buyer header and a ruled line-item
+table (S.No, Description, HSN, Qty, Rate, Disc, GST %, Amount) whose amounts
+reconcile, so the text-layer extractor reads them with full confidence. The
+scanned variant replaces every page with a raster image of itself, leaving
+no text layer, which sends every page to the model.
+
+Usage:
+    python benchmarks/invoice_generator.py out.pdf --pages 20 --items 15 --scanned
+"""
+from typing import List
+import argparse
+import random
+
+import fitz  # PyMuPDF
+
+
+COLUMNS = ["S.No", "Description", "HSN", "Qty", "Rate", "Disc", "GST %", "Amount"]
+COLUMN_X = [40, 72, 230, 290, 325, 385, 430, 480, 570]
+GST_RATES = (5, 12, 18, 28)
+PRODUCTS = ("Laptop", "Monitor", "Keyboard", "Mouse", "Printer", "Toner", "Router", "Cable",
+            "Switch", "Scanner", "Webcam", "Headset", "SSD", "RAM", "UPS", "Projector")
+
+
+def line_items(count: int, rng: random.Random, first_sort: int = 1) -> List[List[str]]:
+    """Table rows for count line items; amount = (qty x rate - discount) x (1 + GST)"""
+    rows = []
+    for i in range(count):
+        qty = rng.randint(1, 20)
+        rate = round(rng.uniform(50, 5000), 2)
+        discount = round(qty * rate * rng.choice((0, 0, 0.05, 0.1)), 2)
+        gst = rng.choice(GST_RATES)
+        amount = (qty * rate - discount) * (1 + gst / 100)
+        rows.append([
+            str(first_sort + i),
+            f"{rng.choice(PRODUCTS)} {rng.randint(100, 999)}",
+            str(rng.choice((8471, 8473, 8443, 8517, 8504, 8544, 8523)) * 100 + rng.randint(0, 99)),
+            str(qty),
+            f"{rate:.2f}",
+            f"{discount:.2f}",
+            f"{gst}%",
+            f"{amount:.2f}",
+        ])
+    return rows
+
+
+def generate_invoice_pdf(pages: int, items: int = 15, seed: int = 0, fontsize: float = 8) -> bytes:
+    """Text-layer invoice with items line items on each of pages pages"""
+    rng = random.Random(seed)
+    document = fitz.open()
+    row_height = fontsize * 2.2
+    for page_num in range(pages):
+        page = document.new_page()
+        page.insert_text((40, 50), "TAX INVOICE", fontsize=14)
+        page.insert_text((40, 72), f"Invoice No: SYN-{seed:03d}-{page_num + 1:04d}   Date: 01-04-2025",
+                         fontsize=fontsize)
+        page.insert_text((40, 86), "Seller: Synthetic Traders Pvt Ltd  GSTIN 29ABCDE1234F1Z5", fontsize=fontsize)
+        page.insert_text((40, 100), "Buyer: Benchmark Retail LLP  GSTIN 27PQRSX5678K1Z2", fontsize=fontsize)
+
+        rows = [COLUMNS] + line_items(items, rng, first_sort=page_num * items + 1)
+        top = 120
+        for r, row in enumerate(rows):
+            for c, cell in enumerate(row):
+                page.insert_text((COLUMN_X[c] + 2, top + r * row_height + fontsize * 1.4), cell, fontsize=fontsize)
+        bottom = top + len(rows) * row_height
+        for r in range(len(rows) + 1):
+            page.draw_line((COLUMN_X[0], top + r * row_height), (COLUMN_X[-1], top + r * row_height))
+        for x in COLUMN_X:
+            page.draw_line((x, top), (x, bottom))
+        page.insert_text((40, bottom + 24), f"Page {page_num + 1} of {pages}. Amount in words: rupees only.",
+                         fontsize=fontsize)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def to_scanned(pdf_bytes: bytes, dpi: int = 150, jpeg_quality: int = 80) -> bytes:
+    """Replace every page with a JPEG image of itself, like a scanned batch"""
+    source = fitz.open(stream=pdf_bytes, filetype="pdf")
+    scanned = fitz.open()
+    for page in source:
+        image = page.get_pixmap(dpi=dpi).tobytes("jpg", jpg_quality=jpeg_quality)
+        new_page = scanned.new_page(width=page.rect.width, height=page.rect.height)
+        new_page.insert_image(new_page.rect, stream=image)
+    data = scanned.tobytes()
+    source.close()
+    scanned.close()
+    return data
+
+
+def generate_invoice(pages: int, items: int = 15, scanned: bool = False, seed: int = 0) -> bytes:
+    """Text-layer or scanned synthetic invoice"""
+    pdf_bytes = generate_invoice_pdf(pages, items, seed)
+    return to_scanned(pdf_bytes) if scanned else pdf_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", help="Path of the PDF to write")
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--items", type=int, default=15, help="Line items per page")
+    parser.add_argument("--scanned", action="store_true", help="Image-only pages without a text layer")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.output, "wb") as f:
+        f.write(generate_invoice(args.pages, args.items, args.scanned, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Near-duplicate page detection for skipping redundant model calls.
+
+Scanned batches often carry the same invoice more than once: the
+"original for recipient" / "duplicate for transporter" copies, or the same
+page included twice. Every page sent to the model gets a difference hash
+(dHash) of a small grayscale rendering: one bit per horizontally adjacent
+pixel pair, set where the left pixel is brighter. A PageDeduper compares each
+page's hash with the first page of every group seen so far in the request;
+a page at least min_similarity alike (the fraction of equal bits) joins that
+group and copies its items instead of being extracted again.
+
+The hash cannot read text, so the threshold is a trade-off. Copies that only
+differ by a copy label or a stamp score about 0.997, while a different
+invoice on the same template scores about 0.98 and the same invoice with one
+line item fewer about 0.993. Rescans of a paper copy differ by skew and noise
+far more than that and are not matched at the default threshold.
+"""
+from typing import Any, List, NamedTuple, Optional, Tuple
+import asyncio
+
+import fitz  # PyMuPDF
+import numpy as np
+
+
+# Hash bits per row; the row count follows the page's aspect ratio
+HASH_WIDTH = 128
+
+
+class PageHash(NamedTuple):
+    width: int
+    height: int
+    bits: int
+
+
+def page_hash(page: fitz.Page, width: int = HASH_WIDTH) -> PageHash:
+    """Difference hash of a page, rendered straight to width + 1 by height gray pixels
+
+    The tiny render takes a millisecond or two; the bits are compared and
+    packed as arrays, row by row from the top left.
+    """
+    height = max(1, round(width * page.rect.height / page.rect.width))
+    pix = page.get_pixmap(
+        matrix=fitz.Matrix((width + 1) / page.rect.width, height / page.rect.height),
+        colorspace=fitz.csGRAY,
+    )
+    pixels = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    brighter = pixels[:, :-1] > pixels[:, 1:]
+    packed = np.packbits(brighter)
+    # packbits pads the last byte with zero bits
+    bits = int.from_bytes(packed.tobytes(), "big") >> (packed.size * 8 - brighter.size)
+    return PageHash(pix.width - 1, pix.height, bits)
+
+
+def similarity(a: PageHash, b: PageHash) -> float:
+    """Fraction of equal hash bits; pages of different shapes are never alike"""
+    if (a.width, a.height) != (b.width, b.height):
+        return 0.0
+    return 1 - bin(a.bits ^ b.bits).count("1") / (a.width * a.height)
+
+
+class PageDeduper:
+    """Groups the pages of one request by hash; later pages of a group wait for the first one's items"""
+
+    def __init__(self, min_similarity: float):
+        self.min_similarity = min_similarity
+        # (hash, page number, future resolving to the page's items or None)
+        self._groups: List[Tuple[PageHash, int, asyncio.Future]] = []
+
+    def claim(self, page_number: int, hash_: PageHash) -> Optional[Tuple[int, asyncio.Future]]:
+        """The group leader's page number and items future for a duplicate page
+
+        Returns None, and makes the page the leader of a new group, when no
+        earlier page is alike. A leader must then call publish().
+        """
+        for leader_hash, leader_page, future in self._groups:
+            if similarity(hash_, leader_hash) >= self.min_similarity:
+                return leader_page, future
+        self._groups.append((hash_, page_number, asyncio.get_running_loop().create_future()))
+        return None
+
+    def publish(self, page_number: int, items: Optional[List[Any]]) -> None:
+        """Hand a leader's items to its duplicates; None makes them extract themselves"""
+        for _, leader_page, future in self._groups:
+            if leader_page == page_number and not future.done():
+                future.set_result(items)
+
+    def close(self) -> None:
+        for _, _, future in self._groups:
+            if not future.done():
+                future.set_result(None)
+
+
+def copy_items(items: List[Any], page_number: int) -> List[Any]:
+    """A leader's items (InvoiceItem models or field dicts) moved to another page"""
+    return [
+        {**item, "page_number": page_number} if isinstance(item, dict)
+        else item.model_copy(update={"page_number": page_number})
+        for item in items
+    ]
@@ -0,0 +1,228 @@
+"""Single-parse access to an uploaded invoice PDF.
+
+InvoiceDocument opens a PDF at most once per parser (PyMuPDF for rasters,
+pdfplumber for text and tables), and exposes lazy per-page access so every
+extraction stage shares the same parsed document.
+
+Uploads are spooled to disk in fixed-size chunks rather than read into
+memory. Worker processes receive a DocumentHandle pointing at the spooled
+file and open it once each: PyMuPDF reads pages from the file on demand and
+pdfplumber parses a memory map of it, so a 200 MB scan is never held as one
+bytes object. The open document is cached for the following pages of the
+same upload, and closed once the upload is released or its spool file is
+gone, so workers do not keep deleted files open.
+"""
+from collections import OrderedDict
+from typing import Any, BinaryIO, Dict, List, NamedTuple, Optional, Tuple, Union
+import io
+import mmap
+import os
+import tempfile
+import threading
+import uuid
+
+import fitz  # PyMuPDF
+import pdfplumber
+
+from dedupe import PageHash, page_hash
+from rasterize import RasterProfile, get_profile, render_page
+
+
+class InvoiceDocument:
+    """Lazily parsed PDF with per-page raster, text and metadata access"""
+
+    def __init__(self, source: Union[bytes, str]):
+        # PDF bytes, or the path of a PDF on disk
+        self.source = source
+        self._fitz_document: Optional[fitz.Document] = None
+        self._plumber_document: Optional[pdfplumber.PDF] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._texts: Dict[int, str] = {}
+
+    @property
+    def fitz_document(self) -> fitz.Document:
+        if self._fitz_document is None:
+            if isinstance(self.source, str):
+                # PyMuPDF cannot read from an mmap, but reads a file path lazily
+                self._fitz_document = fitz.open(self.source, filetype="pdf")
+            else:
+                self._fitz_document = fitz.open(stream=self.source, filetype="pdf")
+        return self._fitz_document
+
+    @property
+    def plumber_document(self) -> pdfplumber.PDF:
+        if self._plumber_document is None:
+            if isinstance(self.source, str):
+                with open(self.source, "rb") as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._plumber_document = pdfplumber.open(self._mmap)
+            else:
+                self._plumber_document = pdfplumber.open(io.BytesIO(self.source))
+        return self._plumber_document
+
+    @property
+    def page_count(self) -> int:
+        return len(self.fitz_document)
+
+    def render_page(self, page_num: int, profile: Optional[RasterProfile] = None) -> bytes:
+        """Rasterize one page with a raster profile (the configured default if omitted)"""
+        page = self.fitz_document.load_page(page_num)
+        return render_page(page, profile or get_profile())
+
+    def page_hash(self, page_num: int) -> PageHash:
+        """Perceptual hash of one page for near-duplicate detection"""
+        return page_hash(self.fitz_document.load_page(page_num))
+
+    def plumber_page(self, page_num: int) -> "pdfplumber.page.Page":
+        return self.plumber_document.pages[page_num]
+
+    def page_text(self, page_num: int) -> str:
+        """Text layer of one page (empty for scanned pages)"""
+        if page_num not in self._texts:
+            page = self.plumber_page(page_num)
+            self._texts[page_num] = page.extract_text() or ""
+            # Drop pdfplumber's parsed objects; the text is all we keep
+            page.flush_cache()
+        return self._texts[page_num]
+
+    def page_metadata(self, page_num: int) -> Dict[str, Any]:
+        page = self.fitz_document.load_page(page_num)
+        return {
+            "page_number": page_num + 1,
+            "width": page.rect.width,
+            "height": page.rect.height,
+            "rotation": page.rotation,
+            "has_text_layer": bool(page.get_text("text").strip()),
+            "image_count": len(page.get_images()),
+        }
+
+    def close(self) -> None:
+        if self._fitz_document is not None:
+            self._fitz_document.close()
+            self._fitz_document = None
+        if self._plumber_document is not None:
+            self._plumber_document.close()
+            self._plumber_document = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._texts.clear()
+
+    def __enter__(self) -> "InvoiceDocument":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def parse_page_ranges(spec: str) -> List[Tuple[int, Optional[int]]]:
+    """Parse a 1-based page range such as "1-5,8,10-" into (first, last) pairs; last None means to the end"""
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        try:
+            start = int(first) if first.strip() else 1
+            end = (int(last) if last.strip() else None) if sep else start
+        except ValueError:
+            raise ValueError(f"Invalid page range: {part!r}")
+        if start < 1 or (end is not None and end < start):
+            raise ValueError(f"Invalid page range: {part!r}")
+        ranges.append((start, end))
+    if not ranges:
+        raise ValueError("Empty page range")
+    return ranges
+
+
+def select_pages(ranges: Optional[List[Tuple[int, Optional[int]]]], page_count: int) -> List[int]:
+    """0-based page numbers covered by the ranges, in order, ignoring pages past the end"""
+    if not ranges:
+        return list(range(page_count))
+    selected = set()
+    for start, end in ranges:
+        selected.update(range(start - 1, min(end or page_count, page_count)))
+    return sorted(selected)
+
+
+class DocumentHandle(NamedTuple):
+    """Picklable reference to an upload spooled to disk"""
+    key: str
+    path: str
+    size: int
+
+
+# Uploads are copied to disk in chunks of this size
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+def spool_upload(source: BinaryIO, spool_dir: Optional[str] = None) -> DocumentHandle:
+    """Copy an upload stream to a temporary file; the caller must release() it when done"""
+    fd, path = tempfile.mkstemp(prefix="invoice-upload-", suffix=".pdf", dir=spool_dir)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as dst:
+            while True:
+                chunk = source.read(SPOOL_CHUNK_SIZE)
+                if not chunk:
+                    break
+                dst.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return DocumentHandle(uuid.uuid4().hex, path, size)
+
+
+def handle_for_path(path: str) -> DocumentHandle:
+    """Handle for a PDF that is already on disk"""
+    return DocumentHandle(uuid.uuid4().hex, path, os.path.getsize(path))
+
+
+def release(handle: DocumentHandle) -> None:
+    """Delete a spooled upload"""
+    try:
+        os.unlink(handle.path)
+    except FileNotFoundError:
+        pass
+
+
+# Open documents cached per worker thread (one thread per worker process)
+WORKER_CACHE_SIZE = 2
+_worker_state = threading.local()
+
+
+def _worker_cache() -> "OrderedDict[str, InvoiceDocument]":
+    cache = getattr(_worker_state, "documents", None)
+    if cache is None:
+        cache = _worker_state.documents = OrderedDict()
+    return cache
+
+
+def close_document_handle(key: Optional[str] = None) -> None:
+    """Worker-side: close the cached document of a handle and any whose file has been deleted"""
+    cache = _worker_cache()
+    for cached_key, document in list(cache.items()):
+        if cached_key == key or (isinstance(document.source, str) and not os.path.exists(document.source)):
+            del cache[cached_key]
+            document.close()
+
+
+def open_document_handle(handle: DocumentHandle) -> InvoiceDocument:
+    """Worker-side: parsed document for a handle, opened at most once per worker"""
+    cache = _worker_cache()
+    # A worker that missed a release closes the released documents on its next task
+    close_document_handle()
+
+    document = cache.get(handle.key)
+    if document is not None:
+        cache.move_to_end(handle.key)
+        return document
+
+    document = InvoiceDocument(handle.path)
+    cache[handle.key] = document
+    while len(cache) > WORKER_CACHE_SIZE:
+        _, evicted = cache.popitem(last=False)
+        evicted.close()
+    return document
@@ -0,0 +1,265 @@
+"""Tabular export of extracted line items: JSONL, CSV, Arrow and Parquet.
+
+Every line item becomes one flat row with the InvoiceItem fields plus the
+source file it came from. encode_rows() turns a whole result into one CSV,
+Arrow IPC or Parquet body for the API. Writers append rows as files finish and report
+how far the output is durable, so an interrupted batch run can resume
+without duplicating or losing rows:
+
+- JSONL and CSV are appended in place and synced after every write; the
+  durable position is the file offset, and a resumed run truncates anything
+  written after it.
+- Parquet cannot be appended to, so the output is a directory of part files.
+  Rows are buffered and written as a complete part-NNNNN.parquet every
+  flush_rows rows and on close; rows still in the buffer are not durable.
+  Parquet needs pyarrow, which is only imported when it is used.
+"""
+from typing import Any, Dict, Iterable, List, Optional
+import csv
+import io
+import json
+import os
+import re
+
+
+ROW_COLUMNS = [
+    "source",
+    "title",
+    "doc_id",
+    "type",
+    "uploaded_from",
+    "user_doc_id",
+    "doc_meta_data",
+    "folder_name",
+    "folder_id",
+    "status",
+    "created_at_iso",
+    "modified_at_iso",
+    "section_2_transaction_sort",
+    "section_2_transaction_number",
+    "section_2_transaction_rate",
+    "section_2_transaction_qty",
+    "section_2_transaction_gst",
+    "section_2_transaction_discount",
+    "section_2_transaction_hsn",
+    "section_2_transaction_mrp",
+    "page_number",
+]
+
+EXPORT_FORMATS = ("jsonl", "csv", "parquet")
+
+# Result bodies the API can return instead of the InvoiceResponse JSON
+RESULT_MEDIA_TYPES = {
+    "table": "application/json",
+    "csv": "text/csv; charset=utf-8",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def format_for_path(path: str) -> str:
+    """Export format implied by an output path's extension (a directory means Parquet)"""
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension in ("jsonl", "ndjson"):
+        return "jsonl"
+    if extension in ("csv", "parquet"):
+        return extension
+    if not extension or os.path.isdir(path):
+        return "parquet"
+    raise ValueError(f"Cannot tell the export format from {path}; use .jsonl, .csv or .parquet")
+
+
+def select_columns(fields: Optional[str]) -> List[str]:
+    """Columns named in a comma-separated list (all of them if empty); raises ValueError for unknown names"""
+    if not fields:
+        return ROW_COLUMNS
+    columns = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in columns if name not in ROW_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return columns
+
+
+def item_fields(item: Any) -> Dict[str, Any]:
+    """Field values of an InvoiceItem, or the item itself if it is already a dict of them"""
+    # __dict__ holds a model's field values; dict(model) is several times slower
+    return item if isinstance(item, dict) else item.__dict__
+
+
+def invoice_rows(items: Iterable[Any], source: str) -> List[Dict[str, Any]]:
+    """Flat rows for InvoiceItem models (or dicts of their fields) from one source file"""
+    return [{"source": source, **item_fields(item)} for item in items]
+
+
+def rows_table(rows: List[Dict[str, Any]], columns: List[str] = ROW_COLUMNS) -> Dict[str, Any]:
+    """Compact JSON form: the column names once, then one array of values per row"""
+    return {"columns": columns, "rows": [[row.get(column) for column in columns] for row in rows]}
+
+
+def arrow_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def encode_rows(rows: List[Dict[str, Any]], result_format: str, columns: List[str] = ROW_COLUMNS) -> bytes:
+    """One CSV, Arrow IPC stream or Parquet body holding all rows"""
+    if result_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+        return buffer.getvalue().encode("utf-8")
+
+    table = rows_to_arrow(rows, columns)
+    sink = io.BytesIO()
+    if result_format == "arrow":
+        import pyarrow as pa
+
+        with pa.ipc.new_stream(sink, table.schema) as stream:
+            stream.write_table(table)
+    elif result_format == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, sink)
+    else:
+        raise ValueError(f"Unknown result format: {result_format}")
+    return sink.getvalue()
+
+
+class ExportWriter:
+    """Appends rows; durable_position() is where a resumed run continues from"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Write out buffered rows"""
+
+    def durable_position(self) -> Optional[int]:
+        """Output position covering every row written and flushed so far, or None if rows are still buffered"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class _AppendWriter(ExportWriter):
+    def __init__(self, path: str, resume_at: Optional[int] = None):
+        super().__init__(path)
+        exists = os.path.exists(path)
+        self._file = open(path, "r+" if exists else "w", newline="", encoding="utf-8")
+        if exists:
+            # Drop rows written after the last checkpoint, e.g. by a run that was killed
+            self._file.truncate(resume_at or 0)
+            self._file.seek(0, os.SEEK_END)
+        self._fresh = self._file.tell() == 0
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        self._write_rows(rows)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _write_rows(self, rows: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    def durable_position(self) -> Optional[int]:
+        return self._file.tell()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class JsonlWriter(_AppendWriter):
+    def _write_rows(self, rows: List[Dict[str, Any]]) -> None:
+        for row in rows:
+            self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+class CsvWriter(_AppendWriter):
+    def __init__(self, path: str, resume_at: Optional[int] = None):
+        super().__init__(path, resume_at)
+        self._writer = csv.DictWriter(self._file, fieldnames=ROW_COLUMNS, extrasaction="ignore")
+        if self._fresh:
+            self._writer.writeheader()
+
+    def _write_rows(self, rows: List[Dict[str, Any]]) -> None:
+        self._writer.writerows(rows)
+
+
+def arrow_schema(columns: List[str] = ROW_COLUMNS):
+    import pyarrow as pa
+
+    types = {
+        "section_2_transaction_sort": pa.int64(),
+        "section_2_transaction_rate": pa.float64(),
+        "section_2_transaction_qty": pa.int64(),
+        "section_2_transaction_gst": pa.float64(),
+        "section_2_transaction_discount": pa.float64(),
+        "section_2_transaction_mrp": pa.float64(),
+        "page_number": pa.int64(),
+    }
+    return pa.schema([(column, types.get(column, pa.string())) for column in columns])
+
+
+def rows_to_arrow(rows: List[Dict[str, Any]], columns: List[str] = ROW_COLUMNS):
+    """Arrow table of rows with the fixed export schema, built column by column"""
+    import pyarrow as pa
+
+    return pa.Table.from_pydict({column: [row.get(column) for row in rows] for column in columns},
+                                schema=arrow_schema(columns))
+
+
+class ParquetWriter(ExportWriter):
+    def __init__(self, path: str, resume_at: Optional[int] = None, flush_rows: int = 50000):
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+        super().__init__(path)
+        self.flush_rows = flush_rows
+        os.makedirs(path, exist_ok=True)
+        self._part = resume_at or 0
+        # Parts beyond the checkpoint belong to a run that was killed before recording them
+        for name in os.listdir(path):
+            if re.fullmatch(r"part-\d+\.parquet(\.tmp)?", name) and int(name[5:].split(".")[0]) >= self._part:
+                os.remove(os.path.join(path, name))
+        self._rows: List[Dict[str, Any]] = []
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        self._rows.extend(rows)
+        if len(self._rows) >= self.flush_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._rows:
+            return
+        import pyarrow.parquet as pq
+
+        part_path = os.path.join(self.path, f"part-{self._part:05d}.parquet")
+        pq.write_table(rows_to_arrow(self._rows), part_path + ".tmp")
+        os.replace(part_path + ".tmp", part_path)
+        self._part += 1
+        self._rows = []
+
+    def durable_position(self) -> Optional[int]:
+        return None if self._rows else self._part
+
+    def close(self) -> None:
+        self.flush()
+
+
+def open_writer(path: str, export_format: str, resume_at: Optional[int] = None,
+                parquet_flush_rows: int = 50000) -> ExportWriter:
+    if export_format == "jsonl":
+        return JsonlWriter(path, resume_at)
+    if export_format == "csv":
+        return CsvWriter(path, resume_at)
+    if export_format == "parquet":
+        return ParquetWriter(path, resume_at, parquet_flush_rows)
+    raise ValueError(f"Unknown export format: {export_format}")
@@ -0,0 +1,262 @@
+"""Offline batch extraction over directories of invoice PDFs.
+
+Runs the same pipeline as the API (app.process_pdf) without HTTP: files are
+read in place, several files are in flight at once, and their PDF stages
+share one worker process pool (--workers) while model calls share the
+rate-limited model scheduler. Line items are appended to a JSONL or CSV file
+or a directory of Parquet parts as each file finishes.
+
+Progress is checkpointed to <output>.checkpoint.jsonl together with the
+position of the output it covers, so a run that is interrupted or killed can
+be started again with the same arguments: finished files are skipped, rows
+written after the last checkpoint are dropped, and files that raised an
+error are retried. Files with failed pages (retries exhausted or the model
+circuit open) keep the rows of their good pages and only the failed pages
+are retried; files changed since they were extracted are extracted again.
+Any failed file or page makes the run exit with status 1.
+
+Usage:
+    python extract_batch.py invoices/ --output items.jsonl
+    python extract_batch.py "scans/**/*.pdf" --output items.parquet --workers 8 --files 16
+"""
+from typing import Any, Dict, List, Optional, Set
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+
+from document import parse_page_ranges
+from export import EXPORT_FORMATS, format_for_path, invoice_rows, open_writer
+from rasterize import RASTER_PROFILES, get_profile
+
+
+def discover_pdfs(inputs: List[str]) -> List[str]:
+    """PDF paths under the given directories, glob patterns and files, sorted and de-duplicated"""
+    found: Set[str] = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for root, _, names in os.walk(pattern):
+                found.update(os.path.join(root, name) for name in names if name.lower().endswith(".pdf"))
+        elif os.path.isfile(pattern):
+            found.add(pattern)
+        else:
+            found.update(path for path in glob.glob(pattern, recursive=True)
+                         if os.path.isfile(path) and path.lower().endswith(".pdf"))
+    return sorted(found)
+
+
+class Checkpoint:
+    """Append-only record of finished files and the output position they are covered by"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.position: Optional[int] = None
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut short when the previous run was killed
+                        continue
+                    self.entries[entry["path"]] = entry
+                    self.position = entry["position"]
+        self._file = open(path, "a", encoding="utf-8")
+
+    def is_done(self, path: str) -> bool:
+        """Finished with every page extracted and unchanged since; failed files and pages are tried again"""
+        entry = self.entries.get(path)
+        return entry is not None and entry["status"] == "done" and not self.is_changed(path)
+
+    def is_changed(self, path: str) -> bool:
+        """Whether a file in the checkpoint has been modified since it was recorded"""
+        entry = self.entries.get(path)
+        if entry is None:
+            return False
+        stat = os.stat(path)
+        return entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime
+
+    def failed_pages(self, path: str) -> Optional[List[int]]:
+        """Pages still to extract from an unchanged file whose other pages are already written"""
+        entry = self.entries.get(path)
+        if entry is None or entry["status"] != "partial" or self.is_changed(path):
+            return None
+        return entry["failed_pages"]
+
+    def record(self, entries: List[Dict[str, Any]], position: int) -> None:
+        for entry in entries:
+            entry["position"] = position
+            self._file.write(json.dumps(entry) + "\n")
+            self.entries[entry["path"]] = entry
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.position = position
+
+    def close(self) -> None:
+        self._file.close()
+
+
+async def run_batch(paths: List[str], args: argparse.Namespace, writer, checkpoint: Checkpoint) -> Dict[str, Any]:
+    import app
+
+    profile = get_profile(args.raster_profile)
+    page_ranges = parse_page_ranges(args.pages) if args.pages else None
+    page_limit = min(args.max_concurrency or app.MAX_CONCURRENT_PAGES, app.MAX_CONCURRENT_MODEL_CALLS)
+    pack_pages = args.pack_pages or app.MODEL_PACK_PAGES
+    similarity = app.resolve_duplicate_similarity(args.dedupe_pages or None, args.duplicate_similarity)
+    reextract_profile = app.resolve_reextract_profile(False if args.no_reextract else None, profile)
+
+    totals: Dict[str, Any] = {"processed": 0, "failed": 0, "pages": 0, "items": 0, "calls_saved": 0, "reextracted": 0,
+                              "paths": {}}
+    # Finished files whose rows are still buffered by the writer
+    pending: List[Dict[str, Any]] = []
+    queue: "asyncio.Queue[str]" = asyncio.Queue()
+    for path in paths:
+        queue.put_nowait(path)
+
+    def commit(entry: Dict[str, Any], rows: List[Dict[str, Any]]) -> None:
+        writer.write(rows)
+        pending.append(entry)
+        position = writer.durable_position()
+        if position is not None:
+            checkpoint.record(pending, position)
+            pending.clear()
+
+    async def worker() -> None:
+        while not queue.empty():
+            path = queue.get_nowait()
+            stat = os.stat(path)
+            entry = {"path": path, "size": stat.st_size, "mtime": stat.st_mtime}
+            retry_pages = checkpoint.failed_pages(path)
+            file_pages = [(page, page) for page in retry_pages] if retry_pages else page_ranges
+            start = time.perf_counter()
+            try:
+                # Rows go straight to the writer, so items stay as the typed field dicts unless asked otherwise
+                result = await app.process_pdf(app.handle_for_path(path), path, page_limit, not args.no_text_layer,
+                                               profile, file_pages, pack_pages, args.validate_items, similarity,
+                                               reextract_profile)
+            except Exception as e:
+                totals["failed"] += 1
+                if retry_pages:
+                    # The good pages are already written; keep retrying only the failed ones
+                    commit({**entry, "status": "partial", "failed_pages": retry_pages, "error": str(e)}, [])
+                else:
+                    commit({**entry, "status": "error", "error": str(e)}, [])
+                print(f"[{totals['processed'] + totals['failed']}/{len(paths)}] {path}: error: {e}", file=sys.stderr)
+                continue
+
+            totals["processed" if not result.failed_pages else "failed"] += 1
+            totals["pages"] += result.pages_processed
+            totals["items"] += result.total_items
+            totals["calls_saved"] += result.model_calls_saved
+            totals["reextracted"] += len(result.reextracted_pages)
+            for page_summary in result.pages:
+                totals["paths"][page_summary.path] = totals["paths"].get(page_summary.path, 0) + 1
+            # Rows of the good pages are kept; a partial file is resumed with only its failed pages
+            commit({**entry, "status": "partial" if result.failed_pages else "done", "pages": result.pages_processed,
+                    "items": result.total_items, "failed_pages": result.failed_pages},
+                   invoice_rows(result.data, path))
+            failed = f", pages {','.join(map(str, result.failed_pages))} failed" if result.failed_pages else ""
+            if not args.quiet or failed:
+                print(f"[{totals['processed'] + totals['failed']}/{len(paths)}] {path}: "
+                      f"{result.pages_processed} pages, {result.total_items} items{failed} "
+                      f"({time.perf_counter() - start:.1f}s)", file=sys.stderr)
+
+    requests_before = app.model_backend.stats()["requests"]
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, args.files))))
+    finally:
+        writer.flush()
+        if pending:
+            checkpoint.record(pending, writer.durable_position())
+        writer.close()
+        app.shutdown_process_pool()
+        app.model_call_executor.shutdown(wait=False)
+        app.model_backend.close()
+    totals["model_requests"] = app.model_backend.stats()["requests"] - requests_before
+    totals["retries"] = app.model_scheduler.stats()["retries"]
+    return totals
+
+
+def print_summary(totals: Dict[str, Any], skipped: int, elapsed: float) -> None:
+    print(f"Files:    {totals['processed']} processed, {totals['failed']} failed, {skipped} skipped (checkpoint)")
+    paths = ", ".join(f"{path} {count}" for path, count in sorted(totals["paths"].items()))
+    print(f"Pages:    {totals['pages']} ({paths or '-'})")
+    print(f"Items:    {totals['items']}")
+    print(f"Model:    {totals['model_requests']} requests, {totals['retries']} retries, "
+          f"{totals['calls_saved']} duplicate pages copied, {totals['reextracted']} pages re-extracted")
+    elapsed = max(elapsed, 1e-9)
+    print(f"Elapsed:  {elapsed:.1f}s  {totals['processed'] / elapsed:.2f} files/s  "
+          f"{totals['pages'] / elapsed:.2f} pages/s  {totals['items'] / elapsed:.1f} items/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="+", help="Directories (searched recursively), PDF files or glob patterns")
+    parser.add_argument("--output", "-o", required=True, help="Output .jsonl, .csv or .parquet (a directory of parts)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, help="Output format (default: from the extension)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint.jsonl)")
+    parser.add_argument("--fresh", action="store_true", help="Ignore an existing checkpoint and start over")
+    parser.add_argument("--workers", type=int, help="PDF worker processes (default: PDF_WORKERS or the CPU count)")
+    parser.add_argument("--files", type=int, default=4, help="Files in flight at once")
+    parser.add_argument("--max-concurrency", type=int, help="Pages of each file sent to the model at once")
+    parser.add_argument("--pages", help='1-based pages to extract from every file, such as "1-5,8,10-"')
+    parser.add_argument("--pack-pages", type=int, help="Pages sent to the model in one request")
+    parser.add_argument("--raster-profile", choices=list(RASTER_PROFILES), help="Page rendering profile")
+    parser.add_argument("--no-text-layer", action="store_true", help="Always use the model, never the text layer")
+    parser.add_argument("--dedupe-pages", action="store_true",
+                        help="Copy the items of near-duplicate pages of a file instead of extracting them again")
+    parser.add_argument("--duplicate-similarity", type=float,
+                        help="Minimum page hash similarity of a duplicate page (default: DUPLICATE_PAGE_SIMILARITY)")
+    parser.add_argument("--no-reextract", action="store_true",
+                        help="Do not extract pages whose line items do not reconcile a second time")
+    parser.add_argument("--validate-items", action="store_true",
+                        help="Build a validated InvoiceItem per line item (slower; the row types are the same)")
+    parser.add_argument("--parquet-flush-rows", type=int, default=10000, help="Rows per Parquet part file")
+    parser.add_argument("--quiet", "-q", action="store_true", help="No per-file progress lines")
+    args = parser.parse_args()
+
+    try:
+        export_format = args.format or format_for_path(args.output)
+        if args.pages:
+            parse_page_ranges(args.pages)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.workers is not None:
+        # Read by pdf_pipeline when app is imported
+        os.environ["PDF_WORKERS"] = str(args.workers)
+
+    checkpoint_path = args.checkpoint or args.output.rstrip("/\\") + ".checkpoint.jsonl"
+    if args.fresh and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = Checkpoint(checkpoint_path)
+
+    paths = discover_pdfs(args.inputs)
+    todo = [path for path in paths if not checkpoint.is_done(path)]
+    changed = [path for path in todo if checkpoint.is_changed(path)]
+    print(f"{len(paths)} PDFs found, {len(paths) - len(todo)} already done", file=sys.stderr)
+    if changed:
+        # Append-only output: the rows of the earlier version stay where they are
+        print(f"{len(changed)} PDFs changed since they were extracted and will be extracted again; "
+              f"their earlier rows remain in {args.output}", file=sys.stderr)
+
+    writer = open_writer(args.output, export_format, checkpoint.position, args.parquet_flush_rows)
+    start = time.perf_counter()
+    try:
+        totals = asyncio.run(run_batch(todo, args, writer, checkpoint))
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume", file=sys.stderr)
+        sys.exit(130)
+    finally:
+        checkpoint.close()
+    print_summary(totals, len(paths) - len(todo), time.perf_counter() - start)
+    if totals["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Content-addressed cache for model extraction responses.
+
+Entries are keyed by a hash of the rendered page image, the prompt text and
+the model name, so re-uploading the same invoice reuses the earlier response
+instead of paying for another model call. The memory tier is an LRU bounded
+by total response size; the optional disk tier stores one file per key and
+survives restarts.
+"""
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+
+
+def cache_key(image_data: bytes, input_prompt: str, prompt: str, model_name: str) -> str:
+    """Hash of everything that determines the model output for a page"""
+    digest = hashlib.sha256()
+    for part in (model_name.encode(), input_prompt.encode(), prompt.encode()):
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    digest.update(image_data)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """Two-tier (memory LRU + optional disk) cache of model responses"""
+
+    def __init__(self, max_bytes: int, cache_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        # key -> (response text, encoded size)
+        self._entries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry[0]
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._remember(key, value)
+        self._write_disk(key, value)
+
+    async def get_async(self, key: str) -> Optional[str]:
+        """get() for the event loop: a disk read runs in a worker thread"""
+        if not self.cache_dir:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def put_async(self, key: str, value: str) -> None:
+        """put() for the event loop: the disk write runs in a worker thread"""
+        if not self.cache_dir:
+            return self.put(key, value)
+        await asyncio.to_thread(self.put, key, value)
+
+    def clear(self) -> None:
+        """Drop the memory tier (the disk tier is left in place)"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _remember(self, key: str, value: str) -> None:
+        # Caller holds the lock
+        size = len(value.encode())
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= previous[1]
+        self._entries[key] = (value, size)
+        self._size += size
+        while self._size > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._size -= evicted_size
+            self.evictions += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def _read_disk(self, key: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key: str, value: str) -> None:
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(value)
+        os.replace(tmp_path, path)
@@ -35,8 +35,21 @@ import TableViewIcon from '@mui/icons-material/TableView';
 import TrendingUpIcon from '@mui/icons-material/TrendingUp';
 import VisibilityIcon from '@mui/icons-material/Visibility';
 import GetAppIcon from '@mui/icons-material/GetApp';
-import axios from "axios";
 
+const API_URL = "http://192.168.200.63:8000";
+
+// Columns rendered in the results table; only these are requested from the API
+const TABLE_FIELDS = [
+  "title",
+  "type",
+  "section_2_transaction_hsn",
+  "section_2_transaction_gst",
+  "section_2_transaction_qty",
+  "section_2_transaction_rate",
+  "section_2_transaction_mrp",
+  "page_number",
+  "status",
+];
 
 const theme = createTheme({
   palette: {
@@ -187,32 +200,50 @@ export default function App() {
     setLoading(true);
     setError(null);
     setUploadProgress(0);
-    
-    // Simulate upload progress
-    const progressInterval = setInterval(() => {
-      setUploadProgress(prev => {
-        if (prev >= 90) {
-          clearInterval(progressInterval);
-          return 90;
-        }
-        return prev + Math.random() * 15;
-      });
-    }, 200);
-    
+    setData([]);
+    setShowTable(true);
+
     const formData = new FormData();
     formData.append("file", file);
     try {
-      const res = await axios.post("http://192.168.200.63:8000/extract-invoice", formData, {
-        headers: { "Content-Type": "multipart/form-data" },
+      // Items arrive page by page as NDJSON, so rows render before the whole PDF is done.
+      // item_format=table sends each page as value arrays for just the columns the table shows.
+      const params = new URLSearchParams({ format: "ndjson", item_format: "table", fields: TABLE_FIELDS.join(",") });
+      const res = await fetch(`${API_URL}/extract-invoice/stream?${params}`, {
+        method: "POST",
+        body: formData,
       });
+      if (!res.ok) throw new Error(`HTTP ${res.status}`);
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let columns = TABLE_FIELDS;
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
+        for (const line of lines) {
+          if (!line.trim()) continue;
+          const event = JSON.parse(line);
+          if (event.event === "columns") {
+            columns = event.columns;
+          } else if (event.event === "page") {
+            const rows = event.rows.map(values => Object.fromEntries(columns.map((column, i) => [column, values[i]])));
+            // A page extracted again after reconciliation replaces its earlier rows
+            setData(prev => [...prev.filter(row => !event.reextracted || row.page_number !== event.page_number), ...rows]
+              .sort((a, b) => a.page_number - b.page_number));
+            setUploadProgress((100 * event.pages_completed) / event.pages_total);
+          } else if (event.event === "error") {
+            throw new Error(event.detail);
+          }
+        }
+      }
       setUploadProgress(100);
-      setTimeout(() => {
-        setData(res.data.data);
-        setShowTable(true);
-        setLoading(false);
-      }, 500);
+      setLoading(false);
     } catch (err) {
-      clearInterval(progressInterval);
       setError("Upload failed. Please try again.");
       setLoading(false);
       setUploadProgress(0);
@@ -488,7 +519,7 @@ export default function App() {
                     <Badge badgeContent={data.length} color="primary" sx={{ '& .MuiBadge-badge': { fontSize: '0.75rem' } }}>
                       <Chip
                         icon={<CheckCircleIcon />}
-                        label="Extraction Complete"
+                        label={loading ? "Extracting..." : "Extraction Complete"}
                         color="success"
                         variant="outlined"
                       />
@@ -0,0 +1,180 @@
+"""Background batch jobs for multi-file and ZIP uploads.
+
+A batch job spools its PDFs to a per-job directory and returns immediately;
+a fixed set of scheduler workers then processes the files. Workers take
+files from the active jobs in round-robin order, so one month-end batch of
+thousands of invoices cannot starve a small job submitted after it.
+"""
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+
+
+class BatchFile:
+    def __init__(self, filename: str, path: str):
+        self.filename = filename
+        self.path = path
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.done = False
+
+
+class BatchJob:
+    def __init__(self, job_id: str, work_dir: str, options: Dict[str, Any]):
+        self.job_id = job_id
+        self.work_dir = work_dir
+        self.options = options
+        self.files: List[BatchFile] = []
+        self.pending: Deque[BatchFile] = deque()
+        self.in_progress = 0
+        self.completed_files = 0
+        self.failed_files = 0
+        self.pages_processed = 0
+        self.total_items = 0
+        self.created_at = datetime.now().isoformat()
+        self.finished_at: Optional[str] = None
+        self.finished_monotonic: Optional[float] = None
+
+    @property
+    def status(self) -> str:
+        if self.finished_at:
+            return "completed" if not self.failed_files else "completed_with_errors"
+        if self.completed_files or self.failed_files or self.in_progress:
+            return "running"
+        return "queued"
+
+    def add_file(self, filename: str, path: str) -> None:
+        batch_file = BatchFile(filename, path)
+        self.files.append(batch_file)
+        self.pending.append(batch_file)
+
+    def add_upload(self, filename: str, source) -> None:
+        """Spool one uploaded PDF, or every PDF inside an uploaded ZIP, into the job directory"""
+        if filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(source) as archive:
+                for member in archive.infolist():
+                    if member.is_dir() or not member.filename.lower().endswith(".pdf"):
+                        continue
+                    # Never use the member path on disk; archives may contain "../" entries
+                    path = os.path.join(self.work_dir, f"{len(self.files):06d}.pdf")
+                    with archive.open(member) as src, open(path, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                    self.add_file(member.filename, path)
+        else:
+            path = os.path.join(self.work_dir, f"{len(self.files):06d}.pdf")
+            with open(path, "wb") as dst:
+                shutil.copyfileobj(source, dst)
+            self.add_file(filename, path)
+
+
+# Called with the spooled file's path, the original filename and the job options
+ProcessFile = Callable[[str, str, Dict[str, Any]], Awaitable[Any]]
+
+
+class BatchScheduler:
+    """Fixed pool of workers sharing files fairly across active jobs"""
+
+    def __init__(self, process_file: ProcessFile, workers: int, retention_seconds: int):
+        self.process_file = process_file
+        self.workers = workers
+        self.retention_seconds = retention_seconds
+        self.jobs: Dict[str, BatchJob] = {}
+        self._ready: Deque[BatchJob] = deque()
+        self._wakeup: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._wakeup = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for job in self.jobs.values():
+            shutil.rmtree(job.work_dir, ignore_errors=True)
+
+    def create_job(self, options: Dict[str, Any]) -> BatchJob:
+        self._purge_expired()
+        job_id = str(uuid.uuid4())
+        job = BatchJob(job_id, tempfile.mkdtemp(prefix=f"invoice-job-{job_id[:8]}-"), options)
+        self.jobs[job_id] = job
+        return job
+
+    def discard_job(self, job: BatchJob) -> None:
+        """Drop a job that failed before it was submitted"""
+        self.jobs.pop(job.job_id, None)
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+
+    async def submit(self, job: BatchJob) -> None:
+        """Queue a job whose files have all been added"""
+        if not job.pending:
+            self._finish(job)
+            return
+        async with self._wakeup:
+            self._ready.append(job)
+            self._wakeup.notify_all()
+
+    async def _next_file(self):
+        async with self._wakeup:
+            await self._wakeup.wait_for(lambda: bool(self._ready))
+            job = self._ready.popleft()
+            batch_file = job.pending.popleft()
+            job.in_progress += 1
+            # Back of the line: the next worker serves another job first
+            if job.pending:
+                self._ready.append(job)
+            return job, batch_file
+
+    async def _worker(self) -> None:
+        while True:
+            job, batch_file = await self._next_file()
+            try:
+                batch_file.result = await self.process_file(batch_file.path, batch_file.filename, job.options)
+                # A result that is not a success (pages that failed) makes the file count as failed
+                if getattr(batch_file.result, "success", True):
+                    job.completed_files += 1
+                else:
+                    job.failed_files += 1
+                job.pages_processed += getattr(batch_file.result, "pages_processed", 0)
+                job.total_items += getattr(batch_file.result, "total_items", 0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                batch_file.error = getattr(e, "detail", None) or str(e)
+                job.failed_files += 1
+            finally:
+                _remove(batch_file.path)
+                batch_file.done = True
+                job.in_progress -= 1
+            if not job.pending and not job.in_progress:
+                self._finish(job)
+
+    def _finish(self, job: BatchJob) -> None:
+        job.finished_at = datetime.now().isoformat()
+        job.finished_monotonic = time.monotonic()
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+
+    def _purge_expired(self) -> None:
+        now = time.monotonic()
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.finished_monotonic is not None and now - job.finished_monotonic > self.retention_seconds
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+
+def _remove(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,114 @@
+"""Incremental parsing of the JSON line items in model output.
+
+The model is asked for a JSON array of objects but may wrap it in prose or
+Markdown fences, truncate it, or emit a malformed object in the middle.
+JsonObjectStream is fed the output chunk by chunk and decodes each top-level
+object as soon as its closing brace arrives. Brackets inside strings are
+ignored, and an object that fails to decode is skipped without losing the
+objects around it. An object wrapping the array, such as {"items": [...]},
+is replaced by the objects of its list, which may be empty. Only a
+single-key object outside any array counts as a wrapper, so a line item with
+a list field is kept as it is.
+
+A response whose objects were collected while it streamed is passed on as a
+ParsedResponse, which parse_json_objects() returns the stream of instead of
+parsing the text again.
+"""
+from typing import Any, Dict, List
+import json
+
+
+class JsonObjectStream:
+    """Collects the top-level JSON objects of a chunked text stream"""
+
+    def __init__(self):
+        self.objects: List[Dict[str, Any]] = []
+        self.errors = 0
+        self.saw_array = False
+        self._buffer: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Consume a chunk; returns the objects it completed"""
+        completed = []
+        start = 0 if self._depth else None
+        for i, char in enumerate(chunk):
+            if not self._depth:
+                # Between objects: skip prose, fences, commas and the array brackets
+                if char == "{":
+                    self._depth = 1
+                    start = i
+                elif char == "[":
+                    self.saw_array = True
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if not self._depth:
+                    self._buffer.append(chunk[start:i + 1])
+                    start = None
+                    completed.extend(self._decode("".join(self._buffer)))
+                    self._buffer = []
+        if self._depth and start is not None:
+            self._buffer.append(chunk[start:])
+        self.objects.extend(completed)
+        return completed
+
+    @property
+    def truncated(self) -> bool:
+        """Whether the text so far ends inside an object"""
+        return self._depth > 0
+
+    def _decode(self, text: str) -> List[Dict[str, Any]]:
+        try:
+            obj = json.loads(text)
+        except json.JSONDecodeError:
+            self.errors += 1
+            return []
+        if not self.saw_array and len(obj) == 1:
+            value = next(iter(obj.values()))
+            if isinstance(value, list) and all(isinstance(entry, dict) for entry in value):
+                self.saw_array = True
+                return value
+        return [obj]
+
+
+class ParsedResponse(str):
+    """Response text carrying the stream its objects were collected by"""
+
+    stream: JsonObjectStream
+
+
+def parsed_response(text: str, stream: JsonObjectStream) -> ParsedResponse:
+    response = ParsedResponse(text)
+    response.stream = stream
+    return response
+
+
+def objects_response(objects: List[Dict[str, Any]]) -> ParsedResponse:
+    """A JSON array of already decoded objects"""
+    stream = JsonObjectStream()
+    stream.objects = objects
+    stream.saw_array = True
+    return parsed_response(json.dumps(objects), stream)
+
+
+def parse_json_objects(text: str) -> JsonObjectStream:
+    """Parse complete model output in one pass, unless it was parsed as it streamed"""
+    if isinstance(text, ParsedResponse):
+        return text.stream
+    stream = JsonObjectStream()
+    stream.feed(text)
+    return stream
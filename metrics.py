@@ -0,0 +1,252 @@
+"""Per-stage latency histograms, counters and gauges in Prometheus text format.
+
+Stages are timed with stage(), which records into a histogram labelled with
+the stage and the current document's page-count and byte-size buckets, and
+adds the duration to the current request's timings (returned in the
+Server-Timing header when TIMING_HEADERS is on). Everything is kept in
+process memory and rendered on demand by render(); with METRICS_ENABLED off
+the timers do nothing.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import bisect
+import os
+import threading
+import time
+
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+# Per-request stage timings in a Server-Timing response header
+TIMING_HEADERS = os.getenv("TIMING_HEADERS", "false").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+PAGE_COUNT_BUCKETS = ((1, "1"), (10, "2-10"), (50, "11-50"), (200, "51-200"))
+BYTE_SIZE_BUCKETS = ((1 << 20, "<1MB"), (10 << 20, "1-10MB"), (100 << 20, "10-100MB"))
+
+
+def page_count_label(pages: int) -> str:
+    for limit, label in PAGE_COUNT_BUCKETS:
+        if pages <= limit:
+            return label
+    return "200+"
+
+
+def byte_size_label(size: int) -> str:
+    for limit, label in BYTE_SIZE_BUCKETS:
+        if size < limit:
+            return label
+    return "100MB+"
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help_text, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in values]
+
+
+class Gauge(_Metric):
+    """Gauge set directly, or read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, help_text, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self.callback = callback
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels: str) -> Iterator[None]:
+        """In-flight gauge for the duration of a block"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self) -> List[str]:
+        if self.callback is not None:
+            values = list(self.callback().items())
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+        # label values -> (per-bucket counts with a final +Inf slot, sum, count)
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        lines = []
+        names = self.label_names + ("le",)
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (le,))} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+STAGE_DURATION = Histogram(
+    "invoice_stage_duration_seconds",
+    "Time spent in each extraction stage, per page or per document",
+    ("stage", "pages", "size"),
+)
+REQUEST_DURATION = Histogram(
+    "invoice_request_duration_seconds",
+    "End-to-end extraction time per document",
+    ("endpoint", "pages", "size"),
+)
+PAGES_TOTAL = Counter("invoice_pages_total", "Pages processed, by how their items were obtained", ("path",))
+ITEMS_TOTAL = Counter("invoice_items_total", "Invoice line items extracted")
+REEXTRACTED_PAGES_TOTAL = Counter(
+    "invoice_reextracted_pages_total",
+    "Pages extracted again because line items did not reconcile, by whether the new result was kept",
+    ("outcome",),
+)
+REQUESTS_IN_FLIGHT = Gauge("invoice_requests_in_flight", "Documents being extracted", ("endpoint",))
+PAGES_IN_FLIGHT = Gauge("invoice_pages_in_flight", "Pages started and not yet finished")
+
+
+# Labels of the document being processed and the stage timings of the current request
+_document_labels: ContextVar[Dict[str, str]] = ContextVar("document_labels", default={"pages": "", "size": ""})
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def set_document(pages: Optional[int], size: int) -> None:
+    """Label the stages recorded from here on (and in tasks started from here) with this document
+
+    pages is None until the document's pages have been counted.
+    """
+    _document_labels.set({"pages": "" if pages is None else page_count_label(pages), "size": byte_size_label(size)})
+
+
+def start_request_timings() -> Dict[str, float]:
+    """Collect stage timings for the current request; returns the dict they accumulate in"""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    """Record a stage duration measured elsewhere, e.g. in a worker process"""
+    if not METRICS_ENABLED:
+        return
+    STAGE_DURATION.observe(seconds, stage=name, **_document_labels.get())
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block as one observation of a stage"""
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def observe_request(endpoint: str, seconds: float) -> None:
+    """Record the end-to-end time of one document"""
+    REQUEST_DURATION.observe(seconds, endpoint=endpoint, **_document_labels.get())
+
+
+def server_timing(timings: Dict[str, float], total: float) -> str:
+    """Server-Timing header value; stage durations are summed over the document's pages"""
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
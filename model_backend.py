@@ -0,0 +1,270 @@
+"""Model backends for invoice extraction.
+
+A backend turns a list of content parts (prompt strings and inline image
+dicts, as accepted by Gemini's generate_content) into the model's response
+text, either whole or streamed in chunks. The backend is chosen with
+MODEL_BACKEND:
+
+- "gemini": Google Gemini, model MODEL_NAME. Clients are created once and
+  reused from a small pool instead of being rebuilt for every page.
+- "stub": a deterministic local model with configurable latency and error
+  rate, for load tests and benchmarks without an API key or network.
+"""
+from typing import Any, Dict, Iterator, List, Optional
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "gemini")
+MODEL_NAME = os.getenv("MODEL_NAME", "gemini-1.5-flash")
+# Long-lived Gemini clients shared by the model-call threads; calls beyond
+# this many wait for a free client, so keep it at MAX_CONCURRENT_MODEL_CALLS
+MODEL_CLIENT_POOL_SIZE = int(os.getenv("MODEL_CLIENT_POOL_SIZE", "16"))
+
+# Stub backend behaviour
+STUB_LATENCY_SECONDS = float(os.getenv("STUB_LATENCY_SECONDS", "0.5"))
+STUB_LATENCY_JITTER_SECONDS = float(os.getenv("STUB_LATENCY_JITTER_SECONDS", "0"))
+STUB_ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+STUB_THROTTLE_RATE = float(os.getenv("STUB_THROTTLE_RATE", "0"))
+STUB_SEED = int(os.getenv("STUB_SEED", "0"))
+
+
+class ModelBackendError(Exception):
+    """A model call failed; kind is "throttle", "transient" or "fatal" as in classify_error()"""
+
+    def __init__(self, message: str, kind: str = "transient"):
+        super().__init__(message)
+        self.kind = kind
+
+
+class PartialResponseError(ModelBackendError):
+    """A streamed response broke off after some complete line items had arrived"""
+
+    def __init__(self, message: str, partial_text: str):
+        super().__init__(message, kind="transient")
+        self.partial_text = partial_text
+        # For a multi-page request: the partial text split per page number
+        self.partial_pages: Optional[Dict[int, str]] = None
+
+
+class ModelBackend:
+    """Base class: generate() returns the response text for a list of content parts"""
+
+    name = "base"
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+
+    @property
+    def available(self) -> bool:
+        """Whether calls can be made (e.g. an API key is configured)"""
+        return True
+
+    def generate(self, parts: List[Any]) -> str:
+        with self._lock:
+            self._requests += 1
+        try:
+            return self._generate(parts)
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+
+    def generate_stream(self, parts: List[Any]) -> Iterator[str]:
+        """Yield the response text in chunks as the model produces it"""
+        with self._lock:
+            self._requests += 1
+        try:
+            yield from self._generate_stream(parts)
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+
+    def _generate(self, parts: List[Any]) -> str:
+        raise NotImplementedError
+
+    def _generate_stream(self, parts: List[Any]) -> Iterator[str]:
+        # Backends without streaming return the whole response as one chunk
+        yield self._generate(parts)
+
+    def classify_error(self, error: BaseException) -> str:
+        """Error kind: "throttle" (quota, 429), "transient" (worth retrying) or "fatal" (give up)"""
+        if isinstance(error, ModelBackendError):
+            return error.kind
+        if isinstance(error, (TimeoutError, ConnectionError)):
+            return "transient"
+        message = str(error).lower()
+        if "429" in message or "quota" in message or "rate limit" in message:
+            return "throttle"
+        return "transient"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "model": self.model_name,
+            "requests": self._requests,
+            "errors": self._errors,
+        }
+
+    def close(self) -> None:
+        pass
+
+
+class GeminiBackend(ModelBackend):
+    """Google Gemini through a pool of reusable GenerativeModel clients"""
+
+    name = "gemini"
+
+    def __init__(self, model_name: str, api_key: Optional[str], pool_size: int = MODEL_CLIENT_POOL_SIZE):
+        super().__init__(model_name)
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self._clients: "queue.LifoQueue" = queue.LifoQueue()
+        self._created = 0
+        if api_key:
+            import google.generativeai as genai
+            genai.configure(api_key=api_key)
+
+    @property
+    def available(self) -> bool:
+        return bool(self.api_key)
+
+    def _acquire(self):
+        try:
+            return self._clients.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                import google.generativeai as genai
+                return genai.GenerativeModel(self.model_name)
+        # Pool exhausted: wait for a client to be returned
+        return self._clients.get()
+
+    def _generate(self, parts: List[Any]) -> str:
+        client = self._acquire()
+        try:
+            return client.generate_content(parts).text
+        finally:
+            self._clients.put(client)
+
+    def _generate_stream(self, parts: List[Any]) -> Iterator[str]:
+        client = self._acquire()
+        try:
+            for chunk in client.generate_content(parts, stream=True):
+                yield chunk.text
+        finally:
+            self._clients.put(client)
+
+    def classify_error(self, error: BaseException) -> str:
+        try:
+            from google.api_core import exceptions
+        except ImportError:
+            return super().classify_error(error)
+        if isinstance(error, (exceptions.ResourceExhausted, exceptions.TooManyRequests)):
+            return "throttle"
+        if isinstance(error, (exceptions.ServiceUnavailable, exceptions.DeadlineExceeded,
+                              exceptions.InternalServerError, exceptions.BadGateway,
+                              exceptions.GatewayTimeout)):
+            return "transient"
+        if isinstance(error, exceptions.ClientError):
+            # Bad request, permission denied, blocked content: retrying will not help
+            return "fatal"
+        return super().classify_error(error)
+
+
+class StubBackend(ModelBackend):
+    """Deterministic offline model: line items derived from a hash of each image"""
+
+    name = "stub"
+
+    def __init__(self, latency: float = STUB_LATENCY_SECONDS, error_rate: float = STUB_ERROR_RATE,
+                 jitter: float = STUB_LATENCY_JITTER_SECONDS, seed: int = STUB_SEED,
+                 throttle_rate: float = STUB_THROTTLE_RATE):
+        super().__init__("stub")
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._images = 0
+        self._prompt_chars = 0
+
+    def _generate(self, parts: List[Any]) -> str:
+        return "".join(self._generate_stream(parts))
+
+    def _generate_stream(self, parts: List[Any]) -> Iterator[str]:
+        with self._lock:
+            self._images += sum(1 for part in parts if isinstance(part, dict))
+            self._prompt_chars += sum(len(part) for part in parts if isinstance(part, str))
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            roll = self._random.random()
+        # A third of the latency before the first chunk, the rest spread over the items
+        time.sleep(delay / 3)
+        if roll < self.throttle_rate:
+            raise ModelBackendError("429 Stub backend injected quota error", kind="throttle")
+        if roll < self.throttle_rate + self.error_rate:
+            raise ModelBackendError("503 Stub backend injected error")
+
+        records = []
+        page_number = None
+        for part in parts:
+            if isinstance(part, str):
+                label = re.fullmatch(r"Page (\d+):", part.strip())
+                if label:
+                    page_number = int(label.group(1))
+            elif isinstance(part, dict):
+                records.extend(stub_records(part["data"], page_number))
+                page_number = None
+        yield "["
+        for i, record in enumerate(records):
+            time.sleep(delay * 2 / 3 / len(records))
+            yield ("," if i else "") + json.dumps(record)
+        yield "]"
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "images": self._images, "prompt_chars": self._prompt_chars}
+
+
+def stub_records(image_data: bytes, page_number: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Line items for one image, the same every time for the same bytes"""
+    digest = hashlib.sha256(image_data).digest()
+    records = []
+    for sort in range(1, digest[0] % 5 + 2):
+        rate = 50 + digest[sort] * 2
+        qty = digest[sort + 8] % 9 + 1
+        gst = (5, 12, 18, 28)[digest[sort + 16] % 4]
+        record = {
+            "Section 2_Transaction sort": sort,
+            "Section 2_Transaction number": f"STUB-{digest[sort + 24]:03d}",
+            "Section 2_Transaction rate": float(rate),
+            "Section 2_Transaction qty": qty,
+            "Section 2_Transaction gst": float(gst),
+            "Section 2_Transaction hsn": str(8400 + digest[sort + 4]),
+            "Section 2_Transaction MRP": round(rate * qty * (1 + gst / 100), 2),
+        }
+        if page_number is not None:
+            record["page_number"] = page_number
+        records.append(record)
+    return records
+
+
+def create_backend(name: Optional[str] = None) -> ModelBackend:
+    """Backend by name (MODEL_BACKEND if omitted); raises ValueError for unknown names"""
+    name = name or MODEL_BACKEND
+    if name == "gemini":
+        return GeminiBackend(MODEL_NAME, os.getenv("GEMINI_API_KEY"))
+    if name == "stub":
+        return StubBackend()
+    raise ValueError(f"Unknown model backend: {name}")
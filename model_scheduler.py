@@ -0,0 +1,218 @@
+"""Shared scheduler for model calls: rate limits, retries and circuit breaking.
+
+Every model call from every request goes through one ModelCallScheduler:
+
+- token buckets cap requests and estimated tokens per minute, so calls wait
+  for quota instead of being rejected with 429s;
+- an AIMD concurrency limit halves on throttling errors and grows back by
+  one call per window of successes;
+- a failed call is retried with jittered exponential backoff, so only the
+  page (or pack of pages) that failed is sent again;
+- a circuit breaker opens after consecutive upstream failures and fails
+  calls immediately until a trial call succeeds.
+"""
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict
+import asyncio
+import random
+import time
+
+
+# Rough token cost used for the token bucket (Gemini bills an image as 258 tokens)
+CHARS_PER_TOKEN = 4
+TOKENS_PER_IMAGE = 258
+
+
+def estimate_tokens(*texts: str, images: int = 0) -> int:
+    """Approximate input tokens for a request"""
+    return sum(len(text) for text in texts) // CHARS_PER_TOKEN + images * TOKENS_PER_IMAGE
+
+
+class CircuitOpenError(Exception):
+    """The circuit breaker is open; the call was not attempted"""
+
+
+class TokenBucket:
+    """Refills at rate_per_minute; 0 disables the limit"""
+
+    # Burst allowance, in seconds of refill
+    BURST_SECONDS = 10
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, self.rate * self.BURST_SECONDS)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1) -> float:
+        """Wait until amount tokens are available and take them; returns the seconds waited"""
+        if self.rate <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        # The lock keeps waiters in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+
+class AdaptiveConcurrencyLimiter:
+    """Concurrency limit that halves on throttling and grows back additively"""
+
+    def __init__(self, min_limit: int, max_limit: int):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc_info) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_throttle(self) -> None:
+        self.limit = max(self.min_limit, self.limit / 2)
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures; lets one trial call through after reset_seconds"""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.failure_threshold <= 0 or self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_neutral(self) -> None:
+        """A failure that says nothing about upstream health, such as a quota error"""
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or (self.failure_threshold > 0 and self.failures >= self.failure_threshold):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+
+class ModelCallScheduler:
+    """Runs blocking model calls on an executor under shared limits, with retries"""
+
+    def __init__(self, classify_error: Callable[[BaseException], str], executor: Executor,
+                 max_concurrency: int, min_concurrency: int = 1,
+                 requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_retries: int = 3, retry_base_seconds: float = 0.5, retry_max_seconds: float = 20,
+                 failure_threshold: int = 5, reset_seconds: float = 30):
+        self.classify_error = classify_error
+        self.executor = executor
+        self.limiter = AdaptiveConcurrencyLimiter(min_concurrency, max_concurrency)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.counters: Dict[str, float] = {
+            "calls": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retries": 0,
+            "throttled": 0,
+            "transient_errors": 0,
+            "circuit_rejections": 0,
+            "rate_limit_wait_seconds": 0.0,
+        }
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given retry number (0-based)"""
+        return random.uniform(0, min(self.retry_max_seconds, self.retry_base_seconds * 2 ** attempt))
+
+    async def call(self, func: Callable, *args: Any, tokens: int = 0) -> Any:
+        """Call func(*args) on the executor, retrying throttled and transient failures"""
+        self.counters["calls"] += 1
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                self.counters["circuit_rejections"] += 1
+                self.counters["failed"] += 1
+                raise CircuitOpenError("Model backend unavailable (circuit open)")
+
+            waited = await self.request_bucket.acquire(1)
+            waited += await self.token_bucket.acquire(tokens)
+            self.counters["rate_limit_wait_seconds"] += waited
+
+            async with self.limiter:
+                try:
+                    result = await loop.run_in_executor(self.executor, func, *args)
+                except asyncio.CancelledError:
+                    self.breaker.record_neutral()
+                    raise
+                except Exception as e:
+                    kind = self.classify_error(e)
+                    error = e
+                else:
+                    kind = None
+
+            if kind is None:
+                self.limiter.on_success()
+                self.breaker.record_success()
+                self.counters["succeeded"] += 1
+                return result
+
+            if kind == "transient":
+                self.counters["transient_errors"] += 1
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_neutral()
+            if kind == "throttle":
+                self.counters["throttled"] += 1
+                self.limiter.on_throttle()
+            if kind == "fatal" or attempt == self.max_retries:
+                self.counters["failed"] += 1
+                raise error
+            self.counters["retries"] += 1
+            await asyncio.sleep(self.backoff(attempt))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "rate_limit_wait_seconds": round(self.counters["rate_limit_wait_seconds"], 3),
+            "concurrency_limit": int(self.limiter.limit),
+            "in_flight": self.limiter.in_flight,
+            "circuit_state": self.breaker.state,
+        }
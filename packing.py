@@ -0,0 +1,140 @@
+"""Multi-page packing: several page images per model request.
+
+Every Gemini request resends the full extraction prompt and pays the request
+set-up cost, which dominates for invoices spread over many short pages. A
+PagePacker collects the rendered pages of one request and sends them
+together, closing a pack when it reaches the page limit, when the next image
+would take it over the byte budget, or when no further page has arrived
+within the linger time. Each page restarts the linger timer, so a pack waits
+at most max_pages x linger for pages that are still being rendered. The
+model tags each line item with its page_number and the reply is split back
+into one response per page. A reply with an item that is not tagged with one
+of the pack's pages cannot be split; its pages are sent again one at a time.
+"""
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+import asyncio
+
+from json_stream import objects_response, parse_json_objects
+
+
+PACKED_PAGES_PROMPT = """
+        You will receive several invoice pages in one request. Each image is preceded by a
+        label such as "Page 3:". Extract the line items of every page into one JSON ARRAY and
+        add a "page_number" field to each object with the number from the label of the page
+        the line item appears on.
+        """
+
+
+class PackedPage(NamedTuple):
+    page_number: int
+    image_data: bytes
+    mime_type: str
+
+
+# Sends one pack and returns the raw response text per page number, or the
+# exception a page failed with when its pages had to be sent one at a time
+SendPack = Callable[[List[PackedPage]], Awaitable[Dict[int, Union[str, BaseException]]]]
+
+
+class UnsplittablePackError(ValueError):
+    """A multi-page response has line items that are not tagged with one of its pages"""
+
+
+def split_packed_response(response: str, page_numbers: List[int]) -> Dict[int, str]:
+    """Split a multi-page model response into one JSON array per page
+
+    Raises UnsplittablePackError when a line item has no page_number of the
+    pack, since there is no telling which page it belongs to.
+    """
+    parsed = parse_json_objects(response)
+    if not parsed.objects and (parsed.errors or not parsed.saw_array):
+        # Unparseable: every page falls back to its placeholder item
+        return {page_number: response for page_number in page_numbers}
+
+    by_page: Dict[int, List] = {page_number: [] for page_number in page_numbers}
+    for record in parsed.objects:
+        try:
+            page_number = int(record.pop("page_number"))
+        except (KeyError, TypeError, ValueError):
+            page_number = None
+        if page_number not in by_page:
+            raise UnsplittablePackError(f"Line item not tagged with a page of the pack: {record}")
+        by_page[page_number].append(record)
+    return {page_number: objects_response(page_records) for page_number, page_records in by_page.items()}
+
+
+class PagePacker:
+    """Groups the page images of one request into multi-page model calls"""
+
+    def __init__(self, send_pack: SendPack, max_pages: int, max_bytes: int, linger: float):
+        self.send_pack = send_pack
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.linger = linger
+        self._pending: List[PackedPage] = []
+        self._futures: List[asyncio.Future] = []
+        self._pending_bytes = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, page: PackedPage) -> Tuple[str, int]:
+        """Queue one page; returns its response text and the number of pages sent with it"""
+        if self._pending and self._pending_bytes + len(page.image_data) > self.max_bytes:
+            self.flush()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(page)
+        self._futures.append(future)
+        self._pending_bytes += len(page.image_data)
+        if len(self._pending) >= self.max_pages:
+            self.flush()
+        else:
+            # The linger time counts from the latest page, not the first one
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = asyncio.get_running_loop().call_later(self.linger, self.flush)
+        return await future
+
+    def flush(self) -> None:
+        """Send the pages collected so far"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        task = asyncio.create_task(self._send(self._pending, self._futures))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self._pending, self._futures, self._pending_bytes = [], [], 0
+
+    async def _send(self, pages: List[PackedPage], futures: List[asyncio.Future]) -> None:
+        try:
+            responses = await self.send_pack(pages)
+        except asyncio.CancelledError:
+            for future in futures:
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for page, future in zip(pages, futures):
+            if future.done():
+                continue
+            response = responses[page.page_number]
+            if isinstance(response, BaseException):
+                future.set_exception(response)
+            else:
+                future.set_result((response, len(pages)))
+
+    async def close(self) -> None:
+        """Cancel packs still in flight, e.g. when a page failed or the client went away"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for future in self._futures:
+            future.cancel()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,213 @@
+"""CPU-bound PDF stages run in a worker process pool.
+
+PyMuPDF rasterization and pdfplumber text extraction hold the GIL for the
+whole page, so running them on the FastAPI event loop stalls every other
+request. The functions here are module-level so they can be pickled into
+worker processes, and this module avoids importing the Gemini client so
+workers start quickly.
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+import asyncio
+import multiprocessing
+import os
+import re
+import time
+
+from document import DocumentHandle, InvoiceDocument, close_document_handle, open_document_handle, release
+from rasterize import RasterProfile
+from text_layer import extract_page_records
+
+
+# Number of worker processes; 0 runs the stages on the default thread pool instead
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> Optional[Executor]:
+    """Return the shared worker pool, creating it on first use"""
+    global _process_pool
+    if PDF_WORKERS <= 0:
+        return None
+    if _process_pool is None:
+        # spawn keeps workers clear of the parent's gRPC and event loop threads
+        _process_pool = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    """Stop the worker pool if it was started"""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+
+
+# How long a close task keeps its worker from taking the next close task
+CLOSE_HOLD_SECONDS = 0.02
+
+
+def _close_in_worker(key: str) -> None:
+    close_document_handle(key)
+    time.sleep(CLOSE_HOLD_SECONDS)
+
+
+def release_document(handle: DocumentHandle) -> None:
+    """Delete a spooled upload and have the workers close their open copies of it
+
+    One close task is queued per worker without waiting for it. Each task
+    holds its worker for a moment so idle workers take one each; a busy
+    worker that misses it closes the document on its next task instead.
+    """
+    release(handle)
+    if _process_pool is None:
+        return
+    try:
+        for _ in range(PDF_WORKERS):
+            _process_pool.submit(_close_in_worker, handle.key)
+    except RuntimeError:
+        # The pool is shutting down and its workers with it
+        pass
+
+
+async def run_in_process(func: Callable, *args: Any) -> Any:
+    """Run a CPU-bound stage in the worker pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), func, *args)
+
+
+# Pipeline stages
+# Each stage takes a DocumentHandle and reuses the worker's parsed copy of the upload
+def count_pages(handle: DocumentHandle) -> int:
+    """Number of pages in the PDF"""
+    return open_document_handle(handle).page_count
+
+
+def prepare_page(handle: DocumentHandle, page_num: int, use_text_layer: bool,
+                 min_confidence: float, render_fallback: bool,
+                 profile: RasterProfile, duplicate_hash: bool = False) -> Dict[str, Any]:
+    """Try the text-layer extractor, rasterizing the page only if its confidence is too low
+
+    Returns a dict with the text-layer "records" and "confidence" (None when
+    the text layer was not tried), the page's "hsn_entries", the encoded
+    "image" (None when not rendered), the page's perceptual "hash" when
+    rendered with duplicate_hash, and the seconds spent in each stage under
+    "timings".
+    """
+    document = open_document_handle(handle)
+    result: Dict[str, Any] = {"records": [], "confidence": None, "hsn_entries": [], "image": None, "hash": None,
+                              "timings": {}}
+    if use_text_layer:
+        start = time.perf_counter()
+        records, confidence = extract_page_records(document.plumber_page(page_num))
+        result["timings"]["text_layer"] = time.perf_counter() - start
+        result["confidence"] = confidence
+
+    # The page's own HSN rows; page_text() reuses the parse above and then drops it
+    start = time.perf_counter()
+    result["hsn_entries"] = extract_hsn_and_rate(document, [page_num]).entries
+    result["timings"]["hsn_extraction"] = time.perf_counter() - start
+    if use_text_layer and confidence >= min_confidence:
+        result["records"] = records
+        return result
+
+    if render_fallback:
+        start = time.perf_counter()
+        result["image"] = document.render_page(page_num, profile)
+        result["timings"]["rasterize"] = time.perf_counter() - start
+        if duplicate_hash:
+            start = time.perf_counter()
+            result["hash"] = document.page_hash(page_num)
+            result["timings"]["page_hash"] = time.perf_counter() - start
+    return result
+
+
+def extract_hsn_gst(handle: DocumentHandle, page_nums: Optional[List[int]] = None) -> "HsnIndex":
+    """Worker entry point for extract_hsn_and_rate"""
+    return extract_hsn_and_rate(open_document_handle(handle), page_nums)
+
+
+HSN_PATTERN = re.compile(r"\b\d{4,8}\b")
+GST_PATTERN = re.compile(r"(\d{1,2})\s*%")
+
+
+class HsnEntry(NamedTuple):
+    hsn: str
+    gst_rate: Optional[int]
+    page_number: int
+    row: int  # position among the HSN lines of its page
+
+
+class HsnIndex:
+    """HSN codes and GST rates found in the text layer, indexed by page and by code"""
+
+    def __init__(self, entries: List[HsnEntry]):
+        self.entries = entries
+        self.by_page: Dict[int, List[HsnEntry]] = {}
+        self.by_code: Dict[str, List[HsnEntry]] = {}
+        # Rows with a GST rate nearby are the likely line items; header numbers
+        # such as PIN codes or years also match the HSN pattern but carry no rate
+        self.rated_by_page: Dict[int, List[HsnEntry]] = {}
+        for entry in entries:
+            self.by_page.setdefault(entry.page_number, []).append(entry)
+            self.by_code.setdefault(entry.hsn, []).append(entry)
+            if entry.gst_rate is not None:
+                self.rated_by_page.setdefault(entry.page_number, []).append(entry)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def has_code(self, hsn: str) -> bool:
+        return hsn in self.by_code
+
+    def lookup(self, page_number: int, row: int, hsn: Optional[str] = None) -> Optional[HsnEntry]:
+        """Entry for the row-th line item of a page, or for a known HSN code"""
+        if hsn:
+            matches = self.by_code.get(hsn)
+            if not matches:
+                return None
+            for entry in matches:
+                if entry.page_number == page_number:
+                    return entry
+            return matches[0]
+
+        page_entries = self.rated_by_page.get(page_number) or self.by_page.get(page_number)
+        if page_entries and row < len(page_entries):
+            return page_entries[row]
+        return None
+
+
+def extract_hsn_and_rate(document: InvoiceDocument, page_nums: Optional[Iterable[int]] = None) -> HsnIndex:
+    """Extract HSN codes and GST rates from PDF (only the given 0-based pages, if any)"""
+    entries = []
+
+    for page_num in (range(document.page_count) if page_nums is None else page_nums):
+        text = document.page_text(page_num)
+        if not text:
+            continue
+
+        lines = text.split("\n")
+        row = 0
+        for idx, line in enumerate(lines):
+            hsn_match = HSN_PATTERN.search(line)
+            if hsn_match:
+                hsn_code = hsn_match.group(0)
+                gst_rate = None
+
+                gst_match = GST_PATTERN.search(line)
+                if gst_match:
+                    gst_rate = int(gst_match.group(1))
+                else:
+                    for next_line in lines[idx+1: idx+3]:
+                        gst_match_next = GST_PATTERN.search(next_line)
+                        if gst_match_next:
+                            gst_rate = int(gst_match_next.group(1))
+                            break
+
+                entries.append(HsnEntry(hsn_code, gst_rate, page_num + 1, row))
+                row += 1
+    return HsnIndex(entries)
@@ -0,0 +1,95 @@
+"""Arithmetic reconciliation of extracted line items.
+
+A line item reconciles when qty x rate - discount, with or without its GST
+rate added, matches the line amount (section_2_transaction_mrp) to within
+1% or 0.50, the same rule the text-layer extractor scores its rows with.
+The check runs over every item of a document at once as NumPy arrays; items
+missing the quantity, rate or amount cannot be checked and are not flagged.
+
+A second extraction of a page only replaces the first when it keeps at
+least as many checkable items, has no placeholder items (rows without any
+line-item value, as made for unparseable model output) and a smaller share
+of its checkable items fails to reconcile; an empty or unreadable retry
+never wins over real data.
+"""
+from typing import Any, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from export import item_fields
+
+
+ABSOLUTE_TOLERANCE = 0.5
+RELATIVE_TOLERANCE = 0.01
+
+# Fields read from the invoice line itself; an item with none of them is a placeholder
+LINE_ITEM_FIELDS = (
+    "section_2_transaction_number",
+    "section_2_transaction_rate",
+    "section_2_transaction_qty",
+    "section_2_transaction_gst",
+    "section_2_transaction_discount",
+    "section_2_transaction_hsn",
+    "section_2_transaction_mrp",
+)
+
+
+class Reconciliation(NamedTuple):
+    items: int
+    checkable: int
+    unreconciled: int
+    placeholders: int
+
+    @property
+    def unreconciled_fraction(self) -> float:
+        return self.unreconciled / self.checkable if self.checkable else 0.0
+
+
+def _column(rows: List[dict], field: str) -> np.ndarray:
+    # None becomes NaN
+    return np.array([row.get(field) for row in rows], dtype=np.float64)
+
+
+def unreconciled_mask(items: Sequence[Any]) -> np.ndarray:
+    """Boolean array marking the items (InvoiceItem models or field dicts) whose amounts do not reconcile"""
+    checkable, reconciled = _check([item_fields(item) for item in items])
+    return checkable & ~reconciled
+
+
+def _check(rows: List[dict]) -> Tuple[np.ndarray, np.ndarray]:
+    """Masks of the rows that can be checked and of the rows that reconcile"""
+    qty = _column(rows, "section_2_transaction_qty")
+    rate = _column(rows, "section_2_transaction_rate")
+    amount = _column(rows, "section_2_transaction_mrp")
+    discount = np.nan_to_num(_column(rows, "section_2_transaction_discount"))
+    gst = np.nan_to_num(_column(rows, "section_2_transaction_gst"))
+
+    base = qty * rate - discount
+    tolerance = np.maximum(ABSOLUTE_TOLERANCE, np.abs(amount) * RELATIVE_TOLERANCE)
+    reconciled = (np.abs(base - amount) <= tolerance) | (np.abs(base * (1 + gst / 100) - amount) <= tolerance)
+    checkable = ~(np.isnan(qty) | np.isnan(rate) | np.isnan(amount))
+    return checkable, reconciled
+
+
+def reconcile_items(items: Sequence[Any]) -> Reconciliation:
+    """Counts of checkable, unreconciled and placeholder items of one extraction"""
+    rows = [item_fields(item) for item in items]
+    checkable, reconciled = _check(rows)
+    placeholders = sum(1 for row in rows if all(row.get(field) is None for field in LINE_ITEM_FIELDS))
+    return Reconciliation(len(rows), int(checkable.sum()), int((checkable & ~reconciled).sum()), placeholders)
+
+
+def retry_is_better(first: Reconciliation, retry: Reconciliation) -> bool:
+    """Whether a second extraction of a page should replace the first"""
+    if retry.placeholders or retry.checkable < first.checkable:
+        return False
+    return retry.unreconciled_fraction < first.unreconciled_fraction
+
+
+def unreconciled_pages(items: Sequence[Any]) -> List[int]:
+    """Page numbers with at least one item that does not reconcile"""
+    if not items:
+        return []
+    rows = [item_fields(item) for item in items]
+    page_numbers = np.array([row["page_number"] for row in rows], dtype=np.int64)
+    return np.unique(page_numbers[unreconciled_mask(rows)]).tolist()
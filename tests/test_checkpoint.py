@@ -0,0 +1,69 @@
+import json
+import os
+
+from export import open_writer
+from extract_batch import Checkpoint
+
+
+def make_pdf(tmp_path, name: str, content: bytes = b"%PDF-1.4 test") -> str:
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def entry(path: str, status: str, **fields):
+    stat = os.stat(path)
+    return {"path": path, "size": stat.st_size, "mtime": stat.st_mtime, "status": status, **fields}
+
+
+def test_resume_from_checkpoint(tmp_path):
+    done = make_pdf(tmp_path, "done.pdf")
+    partial = make_pdf(tmp_path, "partial.pdf")
+    error = make_pdf(tmp_path, "error.pdf")
+    checkpoint_path = str(tmp_path / "out.checkpoint.jsonl")
+
+    checkpoint = Checkpoint(checkpoint_path)
+    checkpoint.record([entry(done, "done", failed_pages=[])], 100)
+    checkpoint.record([entry(partial, "partial", failed_pages=[2, 5]), entry(error, "error", error="boom")], 250)
+    checkpoint.close()
+    # A run killed while writing its checkpoint leaves half a line
+    with open(checkpoint_path, "a", encoding="utf-8") as f:
+        f.write('{"path": "cut')
+
+    resumed = Checkpoint(checkpoint_path)
+    assert resumed.position == 250
+    assert resumed.is_done(done)
+    assert not resumed.is_done(partial) and resumed.failed_pages(partial) == [2, 5]
+    assert not resumed.is_done(error) and resumed.failed_pages(error) is None
+    assert not resumed.is_changed(make_pdf(tmp_path, "new.pdf"))
+    resumed.close()
+
+
+def test_changed_file_is_extracted_again(tmp_path):
+    done = make_pdf(tmp_path, "done.pdf")
+    partial = make_pdf(tmp_path, "partial.pdf")
+    checkpoint = Checkpoint(str(tmp_path / "out.checkpoint.jsonl"))
+    checkpoint.record([entry(done, "done"), entry(partial, "partial", failed_pages=[1])], 10)
+
+    make_pdf(tmp_path, "done.pdf", b"%PDF-1.4 a longer replacement")
+    make_pdf(tmp_path, "partial.pdf", b"%PDF-1.4 another replacement")
+    assert checkpoint.is_changed(done) and not checkpoint.is_done(done)
+    # Every page of a changed file is extracted, not only the ones that failed
+    assert checkpoint.is_changed(partial) and checkpoint.failed_pages(partial) is None
+    checkpoint.close()
+
+
+def test_writer_drops_rows_after_checkpoint(tmp_path):
+    output = str(tmp_path / "out.jsonl")
+    writer = open_writer(output, "jsonl")
+    writer.write([{"n": 1}, {"n": 2}])
+    position = writer.durable_position()
+    # Written by a run that was killed before its checkpoint
+    writer.write([{"n": 3}])
+    writer.close()
+
+    writer = open_writer(output, "jsonl", position)
+    writer.write([{"n": 4}])
+    writer.close()
+    with open(output, encoding="utf-8") as f:
+        assert [json.loads(line)["n"] for line in f] == [1, 2, 4]
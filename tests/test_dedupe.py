@@ -0,0 +1,40 @@
+import fitz
+
+from dedupe import PageHash, page_hash, similarity
+
+
+def reference_hash(page: fitz.Page, width: int) -> int:
+    """The dHash bit by bit: left pixel brighter than its right neighbour"""
+    height = max(1, round(width * page.rect.height / page.rect.width))
+    pix = page.get_pixmap(matrix=fitz.Matrix((width + 1) / page.rect.width, height / page.rect.height),
+                          colorspace=fitz.csGRAY)
+    bits = 0
+    for y in range(pix.height):
+        row = pix.samples[y * pix.stride:y * pix.stride + pix.width]
+        for x in range(pix.width - 1):
+            bits = (bits << 1) | (row[x] > row[x + 1])
+    return bits
+
+
+def invoice_page(label: str) -> fitz.Page:
+    document = fitz.open()
+    page = document.new_page()
+    for y in range(30):
+        page.insert_text((40, 120 + y * 20), f"Item {y}   8471   {y + 1} x {100 + y}.00   18%", fontsize=10)
+    page.insert_text((380, 50), label, fontsize=12)
+    return page
+
+
+def test_page_hash_matches_bitwise_definition():
+    page = invoice_page("ORIGINAL FOR RECIPIENT")
+    # 12 x 17 bits leave the last packed byte half full
+    for width in (12, 64, 128):
+        assert page_hash(page, width).bits == reference_hash(page, width)
+
+
+def test_similarity():
+    original = page_hash(invoice_page("ORIGINAL FOR RECIPIENT"))
+    duplicate = page_hash(invoice_page("DUPLICATE FOR TRANSPORTER"))
+    assert similarity(original, original) == 1.0
+    assert 0.99 < similarity(original, duplicate) < 1.0
+    assert similarity(original, PageHash(64, 83, original.bits)) == 0.0
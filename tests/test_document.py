@@ -0,0 +1,21 @@
+import pytest
+
+from document import parse_page_ranges, select_pages
+
+
+def test_parse_page_ranges():
+    assert parse_page_ranges("1-5,8,10-") == [(1, 5), (8, 8), (10, None)]
+    assert parse_page_ranges(" -3 , 7 ,") == [(1, 3), (7, 7)]
+
+
+@pytest.mark.parametrize("spec", ["", ",", "0", "5-3", "a", "1-b", "2-x-4"])
+def test_parse_page_ranges_rejects(spec):
+    with pytest.raises(ValueError):
+        parse_page_ranges(spec)
+
+
+def test_select_pages():
+    assert select_pages(None, 4) == [0, 1, 2, 3]
+    assert select_pages(parse_page_ranges("3-,1-2"), 5) == [0, 1, 2, 3, 4]
+    assert select_pages(parse_page_ranges("2,2,4-6"), 5) == [1, 3, 4]
+    assert select_pages(parse_page_ranges("8-"), 5) == []
@@ -0,0 +1,61 @@
+import csv
+import io
+
+import pytest
+
+from export import ROW_COLUMNS, encode_rows, format_for_path, invoice_rows, rows_table, select_columns
+
+ITEMS = [
+    {"title": "a.pdf", "section_2_transaction_hsn": "847130", "section_2_transaction_qty": 2,
+     "section_2_transaction_mrp": 236.0, "page_number": 1},
+    {"title": "a.pdf", "section_2_transaction_hsn": None, "section_2_transaction_qty": None,
+     "section_2_transaction_mrp": 35.4, "page_number": 2},
+]
+
+
+def test_select_columns():
+    assert select_columns(None) == ROW_COLUMNS
+    assert select_columns(" page_number, section_2_transaction_mrp,") == ["page_number", "section_2_transaction_mrp"]
+    with pytest.raises(ValueError, match="Unknown fields: price"):
+        select_columns("page_number,price")
+
+
+def test_rows_table_lists_columns_once():
+    rows = invoice_rows(ITEMS, "a.pdf")
+    assert rows_table(rows, ["source", "page_number", "section_2_transaction_hsn"]) == {
+        "columns": ["source", "page_number", "section_2_transaction_hsn"],
+        "rows": [["a.pdf", 1, "847130"], ["a.pdf", 2, None]],
+    }
+    assert len(rows_table(rows)["rows"][0]) == len(ROW_COLUMNS)
+
+
+def test_encode_csv_keeps_only_selected_columns():
+    body = encode_rows(invoice_rows(ITEMS, "a.pdf"), "csv", ["page_number", "section_2_transaction_mrp"])
+    assert list(csv.reader(io.StringIO(body.decode("utf-8")))) == [
+        ["page_number", "section_2_transaction_mrp"], ["1", "236.0"], ["2", "35.4"],
+    ]
+
+
+@pytest.mark.parametrize("result_format", ["arrow", "parquet"])
+def test_encode_columnar_formats(result_format):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    columns = ["source", "section_2_transaction_qty", "section_2_transaction_mrp"]
+    body = encode_rows(invoice_rows(ITEMS, "a.pdf"), result_format, columns)
+    if result_format == "arrow":
+        table = pa.ipc.open_stream(body).read_all()
+    else:
+        table = pq.read_table(io.BytesIO(body))
+    assert table.column_names == columns
+    assert table.schema.field("section_2_transaction_qty").type == pa.int64()
+    assert table.to_pydict()["section_2_transaction_qty"] == [2, None]
+    with pytest.raises(ValueError):
+        encode_rows([], "xlsx")
+
+
+def test_export_format_from_path():
+    with pytest.raises(ValueError):
+        format_for_path("out.xlsx")
+    assert format_for_path("out.NDJSON") == "jsonl"
+    assert format_for_path("out") == "parquet"
@@ -0,0 +1,69 @@
+import asyncio
+
+from extraction_cache import ExtractionCache, cache_key
+
+
+def test_key_covers_image_prompts_and_model():
+    key = cache_key(b"img", "input", "prompt", "model")
+    assert key == cache_key(b"img", "input", "prompt", "model")
+    assert key != cache_key(b"img2", "input", "prompt", "model")
+    assert key != cache_key(b"img", "input", "prompt", "other")
+    # Prompt boundaries are part of the key
+    assert cache_key(b"img", "ab", "c", "model") != cache_key(b"img", "a", "bc", "model")
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ExtractionCache(max_bytes=10)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    assert cache.get("a") == "aaaa"
+    cache.put("c", "cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == "aaaa" and cache.get("c") == "cccc"
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["bytes"] == 8 and stats["entries"] == 2
+    assert stats["memory_hits"] == 3 and stats["misses"] == 1
+
+
+def test_oversized_entry_is_not_kept_in_memory():
+    cache = ExtractionCache(max_bytes=4)
+    cache.put("a", "too long")
+    assert cache.get("a") is None and cache.stats()["entries"] == 0
+
+
+def test_disk_tier_outlives_memory_eviction(tmp_path):
+    cache = ExtractionCache(max_bytes=4, cache_dir=str(tmp_path))
+    cache.put("aa1", "1111")
+    cache.put("bb2", "2222")
+    assert cache.get("aa1") == "1111"
+    assert cache.stats()["disk_hits"] == 1
+
+    restarted = ExtractionCache(max_bytes=100, cache_dir=str(tmp_path))
+    assert restarted.get("bb2") == "2222"
+    assert restarted.get("bb2") == "2222"
+    assert restarted.stats()["disk_hits"] == 1 and restarted.stats()["memory_hits"] == 1
+    assert not list(tmp_path.rglob("*.tmp"))
+
+
+def test_async_access_reads_and_writes_disk(tmp_path):
+    cache = ExtractionCache(max_bytes=100, cache_dir=str(tmp_path))
+
+    async def run():
+        await cache.put_async("cc3", "[]")
+        cache.clear()
+        return await cache.get_async("cc3"), await cache.get_async("dd4")
+
+    assert asyncio.run(run()) == ("[]", None)
+    assert cache.stats()["disk_hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_only_replies_with_line_items_or_an_empty_array_are_cacheable():
+    import app
+    from json_stream import parse_json_objects
+
+    assert app.has_line_items(parse_json_objects('[{"a": 1}]'))
+    assert app.has_line_items(parse_json_objects("[]"))
+    assert app.has_line_items(parse_json_objects('{"items": []}'))
+    assert not app.has_line_items(parse_json_objects(""))
+    assert not app.has_line_items(parse_json_objects("I could not read this page."))
+    assert not app.has_line_items(parse_json_objects('[{"a": 1'))
@@ -0,0 +1,65 @@
+import fitz
+
+from document import InvoiceDocument
+from pdf_pipeline import HsnEntry, HsnIndex, extract_hsn_and_rate
+
+
+def pdf_with_lines(*pages):
+    document = fitz.open()
+    for lines in pages:
+        page = document.new_page()
+        for y, line in enumerate(lines):
+            page.insert_text((40, 60 + y * 16), line, fontsize=10)
+    return document.tobytes()
+
+
+def test_lookup_by_code_prefers_the_same_page():
+    index = HsnIndex([HsnEntry("8471", 18, 1, 0), HsnEntry("8471", 12, 3, 0), HsnEntry("3004", 5, 3, 1)])
+    assert index.lookup(3, 0, "8471").gst_rate == 12
+    # A code missing from the page falls back to its first row anywhere
+    assert index.lookup(2, 0, "8471").gst_rate == 18
+    assert index.lookup(1, 0, "9999") is None
+    assert index.has_code("3004") and not index.has_code("9999")
+
+
+def test_lookup_by_row_skips_unrated_numbers():
+    # 560001 is a PIN code in the header: it matches the HSN pattern but has no rate
+    index = HsnIndex([HsnEntry("560001", None, 1, 0), HsnEntry("8471", 18, 1, 1), HsnEntry("3004", 5, 1, 2)])
+    assert index.lookup(1, 0).hsn == "8471"
+    assert index.lookup(1, 1).hsn == "3004"
+    assert index.lookup(1, 2) is None
+    assert index.lookup(2, 0) is None
+    # Without any rated row, the page's rows are used as they are
+    assert HsnIndex([HsnEntry("560001", None, 1, 0)]).lookup(1, 0).hsn == "560001"
+
+
+def test_extract_hsn_and_rate_reads_rates_on_the_next_lines():
+    document = InvoiceDocument(pdf_with_lines(
+        ["Bengaluru 560001", "Tax Invoice", "Seller: Traders",
+         "Laptop 847130 2 x 100.00 18%", "Cable 854449 3 x 10.00", "IGST 12%"],
+        ["Toner 844399 1 x 50.00 28 %"],
+    ))
+    index = extract_hsn_and_rate(document)
+    assert [(entry.hsn, entry.gst_rate, entry.page_number, entry.row) for entry in index.entries] == [
+        ("560001", None, 1, 0), ("847130", 18, 1, 1), ("854449", 12, 1, 2), ("844399", 28, 2, 0),
+    ]
+    assert [entry.hsn for entry in extract_hsn_and_rate(document, [1]).entries] == ["844399"]
+    document.close()
+
+
+def test_document_rows_only_for_codes_missing_from_the_page():
+    import app
+
+    page_index = HsnIndex([HsnEntry("8471", 18, 2, 0)])
+    response = ('[{"Section 2_Transaction hsn": "8471"}, {"Section 2_Transaction hsn": "3004",'
+                ' "Section 2_Transaction gst": 12}]')
+    items, _ = app.parse_page_items(response, 2, "a.pdf", page_index, validate_items=False)
+    assert items[0]["section_2_transaction_gst"] == 18
+    assert not app.needs_document_hsn(items, page_index)
+
+    response = '[{"Section 2_Transaction hsn": "3004"}]'
+    items, _ = app.parse_page_items(response, 2, "a.pdf", page_index, validate_items=False)
+    assert app.needs_document_hsn(items, page_index)
+    document_index = HsnIndex([HsnEntry("8471", 18, 2, 0), HsnEntry("3004", 12, 5, 0)])
+    items, _ = app.parse_page_items(response, 2, "a.pdf", document_index, validate_items=False)
+    assert items[0]["section_2_transaction_gst"] == 12
@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+import asyncio
+import io
+import os
+import zipfile
+
+from jobs import BatchScheduler
+
+
+def run_jobs(process_file, job_files, workers=1):
+    """Submit one job per list of filenames and wait for all of them"""
+
+    async def main():
+        scheduler = BatchScheduler(process_file, workers, retention_seconds=60)
+        scheduler.start()
+        jobs = []
+        for filenames in job_files:
+            job = scheduler.create_job({})
+            for filename in filenames:
+                job.add_file(filename, f"{job.work_dir}/{filename}")
+            await scheduler.submit(job)
+            jobs.append(job)
+        while not all(job.finished_at for job in jobs):
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+        return jobs
+
+    return asyncio.run(main())
+
+
+def test_file_with_failed_pages_counts_as_failed():
+    async def process_file(path, filename, options):
+        if filename == "broken.pdf":
+            raise ValueError("not a PDF")
+        failed = filename == "partial.pdf"
+        return SimpleNamespace(success=not failed, pages_processed=2, total_items=1 if failed else 2)
+
+    job, = run_jobs(process_file, [["good.pdf", "partial.pdf", "broken.pdf"]])
+    assert job.status == "completed_with_errors"
+    assert (job.completed_files, job.failed_files) == (1, 2)
+    assert (job.pages_processed, job.total_items) == (4, 3)
+    assert [batch_file.error for batch_file in job.files] == [None, None, "not a PDF"]
+
+
+def test_workers_take_files_from_jobs_in_turn():
+    order = []
+
+    async def process_file(path, filename, options):
+        order.append(filename)
+        return SimpleNamespace(success=True, pages_processed=1, total_items=1)
+
+    big, small = run_jobs(process_file, [["a1", "a2", "a3", "a4"], ["b1", "b2"]])
+    # The small job submitted second is not stuck behind every file of the big one
+    assert order == ["a1", "b1", "a2", "b2", "a3", "a4"]
+    assert (big.status, small.status) == ("completed", "completed")
+    assert (big.completed_files, big.pages_processed, small.total_items) == (4, 4, 2)
+
+
+def test_status_moves_from_queued_to_running_to_completed():
+    async def main():
+        release = asyncio.Event()
+
+        async def process_file(path, filename, options):
+            await release.wait()
+            return SimpleNamespace(success=True)
+
+        scheduler = BatchScheduler(process_file, 1, retention_seconds=60)
+        scheduler.start()
+        job = scheduler.create_job({})
+        job.add_file("a.pdf", f"{job.work_dir}/a.pdf")
+        statuses = [job.status]
+        await scheduler.submit(job)
+        await asyncio.sleep(0.01)
+        statuses.append(job.status)
+        release.set()
+        while not job.finished_at:
+            await asyncio.sleep(0.01)
+        statuses.append(job.status)
+
+        empty = scheduler.create_job({})
+        await scheduler.submit(empty)
+        statuses.append(empty.status)
+        await scheduler.stop()
+        return statuses
+
+    assert asyncio.run(main()) == ["queued", "running", "completed", "completed"]
+
+
+def test_zip_upload_keeps_only_pdfs_inside_the_job_directory():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("march/inv1.pdf", b"%PDF-1")
+        zf.writestr("../escape.PDF", b"%PDF-2")
+        zf.writestr("notes.txt", b"not a pdf")
+    archive.seek(0)
+
+    scheduler = BatchScheduler(None, 1, retention_seconds=60)
+    job = scheduler.create_job({})
+    job.add_upload("batch.zip", archive)
+    job.add_upload("single.pdf", io.BytesIO(b"%PDF-3"))
+    assert [batch_file.filename for batch_file in job.files] == ["march/inv1.pdf", "../escape.PDF", "single.pdf"]
+    assert all(os.path.dirname(batch_file.path) == job.work_dir for batch_file in job.files)
+    with open(job.files[1].path, "rb") as f:
+        assert f.read() == b"%PDF-2"
+    scheduler.discard_job(job)
+    assert not os.path.exists(job.work_dir) and not scheduler.jobs
@@ -0,0 +1,134 @@
+import json
+
+from json_stream import JsonObjectStream, parse_json_objects
+
+
+def feed_all(chunks):
+    stream = JsonObjectStream()
+    for chunk in chunks:
+        stream.feed(chunk)
+    return stream
+
+
+def test_prose_and_fences_around_array():
+    parsed = parse_json_objects('Here you go:\n```json\n[{"a": 1}, {"b": 2}]\n```')
+    assert parsed.objects == [{"a": 1}, {"b": 2}]
+    assert parsed.saw_array and not parsed.errors
+
+
+def test_wrapped_array_is_unwrapped():
+    parsed = parse_json_objects('{"items": [{"a": 1}, {"a": 2}]}')
+    assert parsed.objects == [{"a": 1}, {"a": 2}]
+    assert parsed.saw_array
+
+
+def test_wrapped_empty_array_has_no_items():
+    parsed = parse_json_objects('{"items": []}')
+    assert parsed.objects == [] and parsed.saw_array and not parsed.errors
+
+
+def test_lone_object_is_kept():
+    assert parse_json_objects('{"a": 1, "b": "x"}').objects == [{"a": 1, "b": "x"}]
+
+
+def test_wrapped_response_becomes_line_items():
+    import app
+    from pdf_pipeline import HsnIndex
+
+    response = '{"items": [{"Section 2_Transaction qty": 2}, {"Section 2_Transaction qty": 3}]}'
+    items, dropped = app.parse_page_items(response, 1, "a.pdf", HsnIndex([]), validate_items=False)
+    assert [item["section_2_transaction_qty"] for item in items] == [2, 3]
+    assert dropped == 0
+
+
+def test_objects_split_across_chunks():
+    text = '[{"a": "x{y"}, {"b": [1, 2]}]'
+    stream = feed_all(list(text))
+    assert stream.objects == [{"a": "x{y"}, {"b": [1, 2]}]
+
+
+def test_feed_returns_objects_as_they_close():
+    stream = JsonObjectStream()
+    assert stream.feed('[{"a": 1}, {"b"') == [{"a": 1}]
+    assert stream.feed(': 2}]') == [{"b": 2}]
+
+
+def test_escaped_quotes_and_braces_in_strings():
+    text = r'[{"a": "say \"}\" twice", "b": "back\\"}, {"c": "\\\"{"}]'
+    expected = [{"a": 'say "}" twice', "b": "back\\"}, {"c": '\\"{'}]
+    assert parse_json_objects(text).objects == expected
+    # An escape split from the character it escapes
+    assert feed_all([text[:15], text[15:16], text[16:]]).objects == expected
+    assert feed_all(list(text)).objects == expected
+
+
+def test_malformed_object_is_skipped():
+    parsed = parse_json_objects('[{"a": 1}, {"b": 2,}, {"c": 3}]')
+    assert parsed.objects == [{"a": 1}, {"c": 3}]
+    assert parsed.errors == 1
+
+
+def test_truncated_output_keeps_complete_objects():
+    parsed = parse_json_objects('[{"a": 1}, {"b": 2}, {"c": "unfini')
+    assert parsed.objects == [{"a": 1}, {"b": 2}]
+    assert not parsed.errors
+
+
+def test_prose_without_json():
+    parsed = parse_json_objects("I could not find any line items on this page.")
+    assert parsed.objects == [] and not parsed.saw_array
+
+
+def test_line_items_with_list_fields_are_not_unwrapped():
+    parsed = parse_json_objects('[{"title": "A", "taxes": []}, {"title": "B", "discounts": [{"pct": 5}]}]')
+    assert parsed.objects == [{"title": "A", "taxes": []}, {"title": "B", "discounts": [{"pct": 5}]}]
+    # Outside an array, an object with other fields is a line item too
+    assert parse_json_objects('{"title": "A", "discounts": [{"pct": 5}]}').objects == [
+        {"title": "A", "discounts": [{"pct": 5}]}
+    ]
+
+
+def test_streamed_response_is_not_parsed_again(monkeypatch):
+    import app
+
+    class ChunkedBackend:
+        def generate_stream(self, parts):
+            yield from ['```json\n[{"a": 1}, {"b"', ': "x"}]', "\n```"]
+
+    monkeypatch.setattr(app, "model_backend", ChunkedBackend())
+    response = app.stream_model_response(["prompt"])
+    assert response == '```json\n[{"a": 1}, {"b": "x"}]\n```'
+    parsed = parse_json_objects(response)
+    assert parsed is response.stream
+    assert parsed.objects == [{"a": 1}, {"b": "x"}]
+    # Stored as plain text
+    assert type(str(response)) is str
+
+
+def test_formatted_numbers_do_not_drop_line_items():
+    import app
+    from pdf_pipeline import HsnIndex
+
+    response = json.dumps([
+        {"Section 2_Transaction rate": "1,200.00", "Section 2_Transaction qty": "2", "Section 2_Transaction MRP": 2400},
+        {"Section 2_Transaction rate": "₹450", "Section 2_Transaction qty": 1, "Section 2_Transaction gst": "18%"},
+        {"Section 2_Transaction rate": "n/a", "Section 2_Transaction qty": "2.5", "Section 2_Transaction MRP": "Rs. 90"},
+    ])
+    for validate_items in (False, True):
+        items, dropped = app.parse_page_items(response, 1, "a.pdf", HsnIndex([]), validate_items)
+        rows = [app.item_fields(item) for item in items]
+        assert [row["section_2_transaction_rate"] for row in rows] == [1200.0, 450.0, None]
+        # A quantity that is not a whole number does not fit the field; the rest of the item is kept
+        assert [row["section_2_transaction_qty"] for row in rows] == [2, 1, None]
+        assert [row["section_2_transaction_gst"] for row in rows] == [None, 18.0, None]
+        assert rows[2]["section_2_transaction_mrp"] == 90.0
+        assert dropped == 0
+
+
+def test_dropped_line_items_are_counted():
+    import app
+    from pdf_pipeline import HsnIndex
+
+    response = '[{"Section 2_Transaction qty": 1}, {"Section 2_Transaction qty": 2,}, {"Section 2_Transaction qty": 3}]'
+    items, dropped = app.parse_page_items(response, 1, "a.pdf", HsnIndex([]), validate_items=False)
+    assert len(items) == 2 and dropped == 1
@@ -0,0 +1,31 @@
+import asyncio
+
+from metrics import STAGE_DURATION, set_document, stage
+
+
+def stage_count(name: str, pages: str, size: str) -> int:
+    for line in STAGE_DURATION.samples():
+        if line.startswith(f'{STAGE_DURATION.name}_count{{stage="{name}",pages="{pages}",size="{size}"}}'):
+            return int(line.rsplit(" ", 1)[1])
+    return 0
+
+
+def test_stage_labels_follow_the_current_document():
+    async def document(pages, size):
+        set_document(None, size)
+        with stage("test_spool"):
+            pass
+        set_document(pages, size)
+        with stage("test_pages"):
+            pass
+
+    async def batch_worker():
+        # One task handling documents in turn, as batch workers do
+        await document(30, 5 << 20)
+        await document(1, 1000)
+
+    asyncio.run(batch_worker())
+    assert stage_count("test_spool", "", "1-10MB") == 1
+    assert stage_count("test_spool", "", "<1MB") == 1
+    assert stage_count("test_pages", "11-50", "1-10MB") == 1
+    assert stage_count("test_pages", "1", "<1MB") == 1
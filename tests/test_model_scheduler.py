@@ -0,0 +1,135 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+
+import pytest
+
+from model_backend import ModelBackendError, StubBackend
+from model_scheduler import CircuitBreaker, CircuitOpenError, ModelCallScheduler, TokenBucket
+
+
+def test_classify_error():
+    classify = StubBackend(latency=0).classify_error
+    assert classify(ModelBackendError("bad request", "fatal")) == "fatal"
+    assert classify(ModelBackendError("slow down", "throttle")) == "throttle"
+    assert classify(RuntimeError("429 Too Many Requests")) == "throttle"
+    assert classify(RuntimeError("Quota exceeded for this project")) == "throttle"
+    assert classify(TimeoutError()) == "transient"
+    assert classify(RuntimeError("connection reset")) == "transient"
+
+
+def test_token_bucket_disabled():
+    assert asyncio.run(TokenBucket(0).acquire(10 ** 9)) == 0.0
+
+
+def test_token_bucket_waits_for_refill():
+    async def main():
+        bucket = TokenBucket(600)  # 10 per second, burst of 100
+        assert await bucket.acquire(100) == 0.0
+        start = time.monotonic()
+        waited = await bucket.acquire(1)
+        return waited, time.monotonic() - start
+
+    waited, elapsed = asyncio.run(main())
+    assert 0.05 < waited < 0.5
+    assert elapsed >= 0.05
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.05)
+    breaker.record_failure()
+    assert breaker.allow() and breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.06)
+    # One trial call at a time while half open
+    assert breaker.allow() and breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0 and breaker.allow()
+
+
+def test_circuit_breaker_ignores_neutral_failures():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60)
+    breaker.record_neutral()
+    assert breaker.state == "closed"
+
+
+class FlakyCall:
+    """Raises the given errors in turn, then returns "ok\""""
+
+    def __init__(self, *errors: BaseException):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def run_call(func, **options):
+    executor = ThreadPoolExecutor(2)
+    scheduler = ModelCallScheduler(StubBackend(latency=0).classify_error, executor, max_concurrency=4,
+                                   retry_base_seconds=0, **options)
+
+    async def main():
+        try:
+            return await scheduler.call(func)
+        finally:
+            executor.shutdown()
+
+    try:
+        return asyncio.run(main()), scheduler
+    except Exception as e:
+        e.scheduler = scheduler
+        raise
+
+
+def test_transient_errors_are_retried():
+    func = FlakyCall(TimeoutError(), ModelBackendError("unavailable"))
+    result, scheduler = run_call(func, max_retries=3)
+    assert result == "ok" and func.calls == 3
+    assert scheduler.counters["retries"] == 2 and scheduler.counters["transient_errors"] == 2
+    assert scheduler.breaker.state == "closed"
+
+
+def test_fatal_error_is_not_retried():
+    func = FlakyCall(ModelBackendError("blocked", "fatal"))
+    with pytest.raises(ModelBackendError) as info:
+        run_call(func, max_retries=3)
+    assert func.calls == 1
+    assert info.value.scheduler.counters["retries"] == 0
+    assert info.value.scheduler.counters["failed"] == 1
+
+
+def test_throttling_halves_concurrency_without_tripping_the_breaker():
+    func = FlakyCall(*[RuntimeError("429 rate limit")] * 3)
+    result, scheduler = run_call(func, max_retries=3, failure_threshold=1)
+    assert result == "ok"
+    assert scheduler.counters["throttled"] == 3
+    # Halved from 4 down to the minimum of 1, then grown by 1 / limit on the success
+    assert scheduler.limiter.limit == 2
+    assert scheduler.breaker.state == "closed"
+
+
+def test_retries_exhausted():
+    func = FlakyCall(*[TimeoutError()] * 3)
+    with pytest.raises(TimeoutError):
+        run_call(func, max_retries=1, failure_threshold=0)
+    assert func.calls == 2
+
+
+def test_open_circuit_rejects_calls():
+    func = FlakyCall(*[TimeoutError()] * 5)
+    with pytest.raises(CircuitOpenError) as info:
+        run_call(func, max_retries=5, failure_threshold=2, reset_seconds=60)
+    assert func.calls == 2
+    assert info.value.scheduler.counters["circuit_rejections"] == 1
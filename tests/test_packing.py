@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+import pytest
+
+from json_stream import parse_json_objects
+from packing import PackedPage, PagePacker, UnsplittablePackError, split_packed_response
+
+
+def test_split_by_page_number():
+    response = json.dumps([
+        {"page_number": 2, "n": "a"},
+        {"page_number": "3", "n": "b"},
+        {"page_number": 2, "n": "c"},
+    ])
+    split = split_packed_response(response, [2, 3, 4])
+    assert {page: json.loads(text) for page, text in split.items()} == {
+        2: [{"n": "a"}, {"n": "c"}],
+        3: [{"n": "b"}],
+        4: [],
+    }
+
+
+@pytest.mark.parametrize("record", [{"n": "a"}, {"page_number": 9, "n": "a"}, {"page_number": "x", "n": "a"}])
+def test_untagged_or_foreign_items_cannot_be_split(record):
+    response = json.dumps([{"page_number": 5, "n": "b"}, record])
+    with pytest.raises(UnsplittablePackError):
+        split_packed_response(response, [5, 6])
+
+
+def test_unparseable_response_goes_to_every_page():
+    response = "Sorry, I cannot read these pages."
+    assert split_packed_response(response, [1, 2]) == {1: response, 2: response}
+
+
+def page(number: int, size: int = 10) -> PackedPage:
+    return PackedPage(number, b"x" * size, "image/png")
+
+
+def run_packer(arrivals, max_pages=3, max_bytes=1000, linger=0.1):
+    """Pack sizes sent for pages submitted at the given delays after each other"""
+    sent = []
+
+    async def send_pack(pages):
+        sent.append([p.page_number for p in pages])
+        return {p.page_number: "[]" for p in pages}
+
+    async def main():
+        packer = PagePacker(send_pack, max_pages, max_bytes, linger)
+        submitted = []
+        for number, (delay, size) in enumerate(arrivals, 1):
+            await asyncio.sleep(delay)
+            submitted.append(asyncio.ensure_future(packer.submit(page(number, size))))
+        results = await asyncio.gather(*submitted)
+        await packer.close()
+        return results
+
+    results = asyncio.run(main())
+    return sent, results
+
+
+def test_pack_closes_at_page_limit():
+    sent, results = run_packer([(0, 10)] * 4, max_pages=3)
+    assert sent == [[1, 2, 3], [4]]
+    assert [pack_size for _, pack_size in results] == [3, 3, 3, 1]
+
+
+def test_pack_closes_at_byte_budget():
+    sent, _ = run_packer([(0, 600), (0, 600), (0, 300)], max_bytes=1000)
+    assert sent == [[1], [2, 3]]
+
+
+def test_linger_restarts_on_each_page():
+    # Pages 0.12 s apart all join a pack with a 0.2 s linger, though the last
+    # one arrives after more than the linger time from the first
+    sent, _ = run_packer([(0, 10), (0.12, 10), (0.12, 10)], max_pages=4, linger=0.2)
+    assert sent == [[1, 2, 3]]
+
+
+def test_linger_sends_partial_pack():
+    sent, _ = run_packer([(0, 10), (0.2, 10)], max_pages=4, linger=0.05)
+    assert sent == [[1], [2]]
+
+
+def test_page_exception_fails_only_that_page():
+    async def send_pack(pages):
+        return {1: "[]", 2: ValueError("page 2 failed")}
+
+    async def main():
+        packer = PagePacker(send_pack, 2, 1000, 1)
+        return await asyncio.gather(packer.submit(page(1)), packer.submit(page(2)), return_exceptions=True)
+
+    first, second = asyncio.run(main())
+    assert first == ("[]", 2)
+    assert isinstance(second, ValueError)
+
+
+def test_split_pages_carry_their_objects():
+    split = split_packed_response(json.dumps([{"page_number": 1, "n": "a"}]), [1, 2])
+    assert parse_json_objects(split[1]).objects == [{"n": "a"}]
+    assert parse_json_objects(split[2]).saw_array
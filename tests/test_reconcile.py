@@ -0,0 +1,89 @@
+import app
+from pdf_pipeline import HsnIndex
+from reconcile import Reconciliation, reconcile_items, retry_is_better, unreconciled_mask, unreconciled_pages
+
+
+def item(qty=None, rate=None, amount=None, gst=None, discount=None, page_number=1, **fields):
+    return {
+        "section_2_transaction_qty": qty,
+        "section_2_transaction_rate": rate,
+        "section_2_transaction_mrp": amount,
+        "section_2_transaction_gst": gst,
+        "section_2_transaction_discount": discount,
+        "page_number": page_number,
+        **fields,
+    }
+
+
+def test_unreconciled_mask():
+    items = [
+        item(2, 100, 200),                # qty x rate
+        item(2, 100, 236, gst=18),        # plus GST
+        item(2, 100, 190, discount=10),   # minus discount
+        item(2, 100, 201),                # within the 0.50 tolerance
+        item(2, 100, 2360, gst=18),       # does not reconcile
+        item(2, None, 236),               # cannot be checked
+    ]
+    assert unreconciled_mask(items).tolist() == [False, False, False, False, True, False]
+
+
+def test_unreconciled_pages():
+    items = [item(1, 10, 10, page_number=1), item(1, 10, 99, page_number=3), item(1, 10, 98, page_number=3)]
+    assert unreconciled_pages(items) == [3]
+    assert unreconciled_pages([]) == []
+
+
+def test_reconcile_items_counts_placeholders():
+    result = reconcile_items([item(1, 10, 10), item(1, 10, 99), item(title="x.pdf")])
+    assert result == Reconciliation(items=3, checkable=2, unreconciled=1, placeholders=1)
+
+
+def test_retry_is_better():
+    first = Reconciliation(items=3, checkable=3, unreconciled=1, placeholders=0)
+    assert retry_is_better(first, Reconciliation(3, 3, 0, 0))
+    assert not retry_is_better(first, Reconciliation(3, 3, 1, 0))
+    # Fewer checkable items, an empty retry or a placeholder never win
+    assert not retry_is_better(first, Reconciliation(2, 2, 0, 0))
+    assert not retry_is_better(first, Reconciliation(0, 0, 0, 0))
+    assert not retry_is_better(first, Reconciliation(1, 0, 0, 1))
+    # More items with a smaller unreconciled share win
+    assert retry_is_better(first, Reconciliation(5, 5, 1, 0))
+
+
+def page_result(items, page_number=1, path="model", duplicate_of=None):
+    return items, app.PageSummary(page_number=page_number, path=path, items=len(items), duplicate_of=duplicate_of)
+
+
+def first_pass():
+    items = [item(2, 100, 236, gst=18), item(1, 50, 50), item(2, 100, 2360, gst=18)]
+    return {1: page_result(items), 2: page_result(app.copy_items(items, 2), 2, "duplicate", duplicate_of=1)}
+
+
+def parsed(response):
+    items, _ = app.parse_page_items(response, 1, "a.pdf", HsnIndex([]), validate_items=False)
+    return items
+
+
+def test_empty_retry_keeps_first_pass():
+    results = first_pass()
+    [(items, summary)] = app.reconciled_results(page_result(parsed("[]")), results)
+    assert items is results[1][0]
+    assert summary.reextracted and summary.unreconciled_items == 1
+
+
+def test_unparseable_retry_keeps_first_pass():
+    results = first_pass()
+    retry = parsed("Sorry, I could not read this invoice.")
+    assert len(retry) == 1 and reconcile_items(retry).placeholders == 1
+    [(items, summary)] = app.reconciled_results(page_result(retry), results)
+    assert len(items) == 3 and items is results[1][0]
+    assert summary.path == "model" and summary.items == 3
+
+
+def test_better_retry_replaces_page_and_duplicates():
+    results = first_pass()
+    retry = [item(2, 100, 236, gst=18), item(1, 50, 50), item(2, 100, 236, gst=18)]
+    updated = app.reconciled_results(page_result(retry), results)
+    assert [summary.page_number for _, summary in updated] == [1, 2]
+    assert updated[0][0] is retry and updated[0][1].unreconciled_items == 0
+    assert [row["page_number"] for row in updated[1][0]] == [2, 2, 2]
@@ -0,0 +1,63 @@
+import io
+
+import pdfplumber
+import pytest
+
+from benchmarks.invoice_generator import generate_invoice_pdf, to_scanned
+from text_layer import extract_page_records, map_header, parse_number, records_from_table, score_records
+
+HEADER = ["S.No", "Description", "HSN", "Qty", "Rate", "GST %", "Amount"]
+
+
+@pytest.mark.parametrize("cell, number", [
+    ("1,200.00", 1200.0), ("₹450", 450.0), ("18%", 18.0), ("-5", -5.0), ("", None), ("n/a", None),
+])
+def test_parse_number(cell, number):
+    assert parse_number(cell) == number
+
+
+def test_gst_rate_column_is_not_the_unit_rate():
+    columns = map_header(HEADER)
+    assert columns["Section 2_Transaction rate"] == 4
+    assert columns["Section 2_Transaction gst"] == 5
+
+
+def test_records_skip_total_rows_and_tax_amounts():
+    table = [
+        ["Seller: Traders", None, None, None, None, None, None],
+        HEADER,
+        ["1", "Laptop", "847130", "2", "100.00", "18%", "236.00"],
+        ["2", "Cable", "854449", "3", "10.00", "90", "35.40"],
+        ["", "Total", "", "", "", "", "271.40"],
+    ]
+    records, columns = records_from_table(table)
+    assert [record["Section 2_Transaction hsn"] for record in records] == ["847130", "854449"]
+    assert records[0]["Section 2_Transaction gst"] == 18.0
+    # 90 is a tax amount, not a GST rate
+    assert "Section 2_Transaction gst" not in records[1]
+    assert score_records(records, columns) == 0.5
+
+
+def test_score_counts_required_columns_and_reconciling_rows():
+    records, columns = records_from_table([
+        ["Description", "Qty", "Rate", "Amount"],
+        ["Laptop", "2", "100.00", "200.00"],
+        ["Cable", "3", "10.00", "99.00"],
+    ])
+    # Three of the four required columns, one of the two rows reconciles
+    assert score_records(records, columns) == round(3 / 4 * 1 / 2, 3)
+    assert score_records([], columns) == 0.0
+    assert records_from_table([["a", "b"], ["1", "2"]]) == ([], {})
+
+
+def test_extract_page_records_from_text_layer():
+    with pdfplumber.open(io.BytesIO(generate_invoice_pdf(1, items=5))) as pdf:
+        records, confidence = extract_page_records(pdf.pages[0])
+    assert confidence == 1.0
+    assert [record["Section 2_Transaction sort"] for record in records] == [1, 2, 3, 4, 5]
+    assert all(record["doc_id"] == "SYN-000-0001" and record["type"] == "Tax Invoice" for record in records)
+
+
+def test_scanned_page_has_no_records():
+    with pdfplumber.open(io.BytesIO(to_scanned(generate_invoice_pdf(1, items=5), dpi=50))) as pdf:
+        assert extract_page_records(pdf.pages[0]) == ([], 0.0)
@@ -0,0 +1,164 @@
+"""Deterministic line-item extraction from a page's PDF text layer.
+
+Invoices exported from billing software carry a complete text layer, so
+their line-item table can be read directly with pdfplumber instead of
+rendering the page and asking the vision model. The extractor returns
+records in the same shape as the model's JSON output together with a
+confidence score; callers only fall back to the model when the score is low.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import re
+
+import pdfplumber
+
+
+TEXT_STRATEGY = {"vertical_strategy": "text", "horizontal_strategy": "text"}
+
+# Header keywords per output field, checked in this order so that e.g. a
+# "GST Rate" column is not taken as the unit rate
+HEADER_KEYWORDS: List[Tuple[str, Tuple[str, ...]]] = [
+    ("Section 2_Transaction hsn", ("hsn", "sac")),
+    ("Section 2_Transaction gst", ("gst%", "gstrate", "taxrate", "tax%", "igst%", "gst")),
+    ("Section 2_Transaction discount", ("disc",)),
+    ("Section 2_Transaction qty", ("qty", "quantity")),
+    ("Section 2_Transaction rate", ("rate", "price", "unitcost")),
+    ("Section 2_Transaction MRP", ("amount", "total", "value", "mrp")),
+    ("Section 2_Transaction sort", ("sno", "srno", "slno", "sr", "sl", "#")),
+    ("Section 2_Transaction number", ("partno", "itemcode", "productcode", "code", "description",
+                                      "particulars", "product", "item")),
+]
+
+REQUIRED_FIELDS = (
+    "Section 2_Transaction hsn",
+    "Section 2_Transaction qty",
+    "Section 2_Transaction rate",
+    "Section 2_Transaction MRP",
+)
+
+NUMBER_PATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+INVOICE_NUMBER_PATTERN = re.compile(r"invoice\s*(?:no|number|#)\.?\s*[:\-]?\s*([A-Za-z0-9/\-]+)", re.IGNORECASE)
+MIN_WORDS = 20
+
+
+def _normalize_header(cell: Optional[str]) -> str:
+    return re.sub(r"[\s.\-_()/]", "", (cell or "").lower())
+
+
+def parse_number(cell: Optional[str]) -> Optional[float]:
+    """First number in a table cell, ignoring currency symbols and thousands separators"""
+    if not cell:
+        return None
+    match = NUMBER_PATTERN.search(cell.replace(",", ""))
+    return float(match.group(0)) if match else None
+
+
+def map_header(row: List[Optional[str]]) -> Dict[str, int]:
+    """Map output fields to column indexes for a candidate header row"""
+    columns: Dict[str, int] = {}
+    for idx, cell in enumerate(row):
+        header = _normalize_header(cell)
+        if not header:
+            continue
+        for field, keywords in HEADER_KEYWORDS:
+            if field not in columns and any(keyword in header for keyword in keywords):
+                columns[field] = idx
+                break
+    return columns
+
+
+def row_is_consistent(record: Dict[str, Any]) -> bool:
+    """Whether qty x rate - discount (optionally plus GST) matches the line amount"""
+    qty = record.get("Section 2_Transaction qty")
+    rate = record.get("Section 2_Transaction rate")
+    amount = record.get("Section 2_Transaction MRP")
+    if qty is None or rate is None or amount is None:
+        return False
+    base = qty * rate - (record.get("Section 2_Transaction discount") or 0)
+    gst = record.get("Section 2_Transaction gst") or 0
+    tolerance = max(0.5, abs(amount) * 0.01)
+    return any(abs(candidate - amount) <= tolerance for candidate in (base, base * (1 + gst / 100)))
+
+
+def records_from_table(table: List[List[Optional[str]]]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """Line-item records from the first row that looks like a header onwards"""
+    for header_idx, row in enumerate(table):
+        columns = map_header(row)
+        if sum(field in columns for field in REQUIRED_FIELDS) >= 2:
+            break
+    else:
+        return [], {}
+
+    records = []
+    for row in table[header_idx + 1:]:
+        label = " ".join(cell or "" for cell in row).lower()
+        if "total" in label and not row_has_hsn(row, columns):
+            continue
+
+        record: Dict[str, Any] = {}
+        for field, idx in columns.items():
+            cell = row[idx] if idx < len(row) else None
+            if field in ("Section 2_Transaction hsn", "Section 2_Transaction number"):
+                value = (cell or "").strip() or None
+            else:
+                value = parse_number(cell)
+            if field == "Section 2_Transaction gst" and value is not None and value > 28:
+                # A tax amount column rather than a GST rate
+                value = None
+            if value is not None:
+                record[field] = value
+
+        if record.get("Section 2_Transaction MRP") is None:
+            continue
+        if record.get("Section 2_Transaction qty") is None and record.get("Section 2_Transaction rate") is None:
+            continue
+        records.append(record)
+    return records, columns
+
+
+def row_has_hsn(row: List[Optional[str]], columns: Dict[str, int]) -> bool:
+    idx = columns.get("Section 2_Transaction hsn")
+    return idx is not None and idx < len(row) and bool(re.search(r"\d{4,8}", row[idx] or ""))
+
+
+def score_records(records: List[Dict[str, Any]], columns: Dict[str, int]) -> float:
+    """Confidence in [0, 1]: share of required columns found x share of rows that reconcile"""
+    if not records:
+        return 0.0
+    column_score = sum(field in columns for field in REQUIRED_FIELDS) / len(REQUIRED_FIELDS)
+    consistent = sum(row_is_consistent(record) for record in records)
+    return round(column_score * consistent / len(records), 3)
+
+
+def extract_page_records(page: "pdfplumber.page.Page") -> Tuple[List[Dict[str, Any]], float]:
+    """Line-item records and confidence for one pdfplumber page"""
+    words = page.extract_words()
+    if len(words) < MIN_WORDS:
+        return [], 0.0
+    if sum("(cid:" in word["text"] for word in words) > len(words) // 10:
+        # Fonts without a usable ToUnicode map; the text is not trustworthy
+        return [], 0.0
+
+    best_records: List[Dict[str, Any]] = []
+    best_score = 0.0
+    # Ruled tables first, then whitespace-aligned columns
+    for settings in (None, TEXT_STRATEGY):
+        tables = page.extract_tables(settings) if settings else page.extract_tables()
+        for table in tables:
+            records, columns = records_from_table(table)
+            score = score_records(records, columns)
+            if score > best_score:
+                best_records, best_score = records, score
+        if best_score:
+            break
+
+    text = " ".join(word["text"] for word in words)
+    invoice_number = INVOICE_NUMBER_PATTERN.search(text)
+    invoice_type = "Tax Invoice" if "tax invoice" in text.lower() else None
+    for sort, record in enumerate(best_records, start=1):
+        record.setdefault("Section 2_Transaction sort", sort)
+        record["Section 2_Transaction sort"] = int(record["Section 2_Transaction sort"])
+        if invoice_number:
+            record["doc_id"] = invoice_number.group(1)
+        if invoice_type:
+            record["type"] = invoice_type
+    return best_records, best_score